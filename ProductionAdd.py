@@ -1,56 +1,17 @@
 import streamlit as st
-import pandas as pd
 import sqlite3
 import os
 from datetime import datetime
-from config import CONN
+import db
+import alerts
+import week_calendar
+import yield_rollup
+import defect_clusters
 
-# 数据库连接
-conn = sqlite3.connect(CONN)
 if 'username' not in st.session_state or not st.session_state.username:
     st.warning("请先登录系统")
     st.stop()
 
-# 确保生产基础数据表存在
-def init_production_tables():
-    with sqlite3.connect(CONN) as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS Stations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            description TEXT,
-            create_date DATE NOT NULL
-        )""")
-        
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS Products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            pn TEXT NOT NULL UNIQUE,
-            module_name TEXT NOT NULL,
-            description TEXT,
-            create_date DATE NOT NULL
-        )""")
-        
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS YieldData (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER NOT NULL,
-            station_id INTEGER NOT NULL,
-            date_code TEXT NOT NULL,
-            production_count INTEGER NOT NULL,
-            bad_count INTEGER NOT NULL,
-            defect_description TEXT,
-            improvement_measures TEXT,
-            picture TEXT,
-            attachment TEXT,
-            create_date DATE NOT NULL,
-            FOREIGN KEY(product_id) REFERENCES Products(id),
-            FOREIGN KEY(station_id) REFERENCES Stations(id)
-        )""")
-
-# 初始化表
-init_production_tables()
-
 # 主界面
 st.subheader("Add Station and Product")
 
@@ -68,13 +29,15 @@ with col1:
                 if not name:
                     st.error("请填写工作站名称")
                 else:
-                    with sqlite3.connect(CONN) as conn:
+                    with db.connection() as conn:
                         try:
                             conn.execute("""
                             INSERT INTO Stations (name, description, create_date)
                             VALUES (?, ?, ?)
                             """, (name, description, datetime.now().date()))
+                            yield_rollup.refresh(conn)
                             conn.commit()
+                            db.invalidate("Stations", *yield_rollup.TABLES)
                             st.success("工作站添加成功!")
                         except sqlite3.IntegrityError:
                             st.error("该工作站名称已存在")
@@ -91,13 +54,15 @@ with col2:
                 if not all([pn, module_name]):
                     st.error("请填写所有必填字段(*)")
                 else:
-                    with sqlite3.connect(CONN) as conn:
+                    with db.connection() as conn:
                         try:
                             conn.execute("""
                             INSERT INTO Products (pn, module_name, description, create_date)
                             VALUES (?, ?, ?, ?)
                             """, (pn, module_name, description, datetime.now().date()))
+                            yield_rollup.refresh(conn)
                             conn.commit()
+                            db.invalidate("Products", *yield_rollup.TABLES)
                             st.success("产品添加成功!")
                         except sqlite3.IntegrityError:
                             st.error("该产品编号已存在")
@@ -110,8 +75,7 @@ st.subheader("现有基础数据")
 tab1, tab2 = st.tabs(["工作站列表", "产品列表"])
 
 with tab1:
-    with sqlite3.connect(CONN) as conn:
-        stations = pd.read_sql("SELECT id, name, description FROM Stations", conn)
+    stations = db.cached_read_sql("SELECT id, name, description FROM Stations")
     if not stations.empty:
         for _, station in stations.iterrows():
             col1, col2 = st.columns([4, 1])
@@ -126,25 +90,28 @@ with tab1:
                         new_desc = st.text_area("描述", value=station['description'])
                         
                         if st.form_submit_button("更新"):
-                            with sqlite3.connect(CONN) as conn:
+                            with db.connection() as conn:
                                 conn.execute("""
                                 UPDATE Stations SET name=?, description=? WHERE id=?
                                 """, (new_name, new_desc, station['id']))
+                                yield_rollup.refresh(conn)
                                 conn.commit()
+                                db.invalidate("Stations", *yield_rollup.TABLES)
                             st.success("工作站已更新!")
                             st.rerun()
                         if st.form_submit_button("删除", type="secondary"):
-                            with sqlite3.connect(CONN) as conn:
+                            with db.connection() as conn:
                                 conn.execute("DELETE FROM Stations WHERE id=?", (station['id'],))
+                                yield_rollup.refresh(conn)
                                 conn.commit()
+                                db.invalidate("Stations", *yield_rollup.TABLES)
                             st.success("工作站已删除!")
                             st.rerun()
     else:
         st.warning("暂无工作站数据")
 
 with tab2:
-    with sqlite3.connect(CONN) as conn:
-        products = pd.read_sql("SELECT id, pn, module_name, description FROM Products", conn)
+    products = db.cached_read_sql("SELECT id, pn, module_name, description FROM Products")
     if not products.empty:
         for _, product in products.iterrows():
             col1, col2 = st.columns([4, 1])
@@ -160,17 +127,21 @@ with tab2:
                         new_desc = st.text_area("描述", value=product['description'])
                         
                         if st.form_submit_button("更新"):
-                            with sqlite3.connect(CONN) as conn:
+                            with db.connection() as conn:
                                 conn.execute("""
                                 UPDATE Products SET pn=?, module_name=?, description=? WHERE id=?
                                 """, (new_pn, new_module, new_desc, product['id']))
+                                yield_rollup.refresh(conn)
                                 conn.commit()
+                                db.invalidate("Products", *yield_rollup.TABLES)
                             st.success("产品已更新!")
                             st.rerun()
                         if st.form_submit_button("删除", type="secondary"):
-                            with sqlite3.connect(CONN) as conn:
+                            with db.connection() as conn:
                                 conn.execute("DELETE FROM Products WHERE id=?", (product['id'],))
+                                yield_rollup.refresh(conn)
                                 conn.commit()
+                                db.invalidate("Products", *yield_rollup.TABLES)
                             st.success("产品已删除!")
                             st.rerun()
     else:
@@ -181,9 +152,8 @@ st.subheader("Add Production Yield Data")
 with st.expander("添加生产良率数据"):
     with st.form("yield_form"):
         # 获取产品和工站数据
-        with sqlite3.connect(CONN) as conn:
-            products = pd.read_sql("SELECT pn, module_name FROM Products", conn)
-            stations = pd.read_sql("SELECT name FROM Stations", conn)
+        products = db.cached_read_sql("SELECT pn, module_name FROM Products")
+        stations = db.cached_read_sql("SELECT name FROM Stations")
         
         # 产品选择
         product_options = [f"{p['pn']} - {p['module_name']}" for _, p in products.iterrows()]
@@ -226,6 +196,8 @@ with st.expander("添加生产良率数据"):
         if submitted:
             if not all([product_choice, station_choice, date_code, good_count is not None, bad_count is not None]):
                 st.error("请填写所有必填字段(*)")
+            elif week_calendar.week_key(date_code) is None:
+                st.error("日期代码格式不正确，应为YYWW(如2514)或YYMMWww(如2504W14)")
             else:
                 # 创建上传目录
                 os.makedirs("uploads/productionyield", exist_ok=True)
@@ -235,7 +207,7 @@ with st.expander("添加生产良率数据"):
                 station_name = station_choice
                 
                 # 插入数据
-                with sqlite3.connect(CONN) as conn:
+                with db.connection() as conn:
                     cursor = conn.cursor()
                     cursor.execute("""
                     INSERT INTO YieldData (
@@ -273,8 +245,13 @@ with st.expander("添加生产良率数据"):
                     SET picture=?, attachment=?
                     WHERE id=?
                     """, (picture_path, attachment_path, record_id))
+                    week_calendar.normalize(conn, [record_id])
+                    yield_rollup.refresh(conn)
+                    defect_clusters.update(conn)
                     
                     conn.commit()
+                    db.invalidate("YieldData", *yield_rollup.TABLES, *defect_clusters.TABLES)
+                    alerts.check_yield(conn)
                 st.success("良率数据添加成功!")
                 st.session_state.yield_form_date_code = "empty"
 
@@ -283,14 +260,13 @@ with st.expander("添加生产良率数据"):
 st.write("---")
 st.subheader("已录入的生产良率数据")
 
-with sqlite3.connect(CONN) as conn:
-    # 测试SQL语句是否返回数据
-    test_query = "SELECT COUNT(*) FROM YieldData"
-    count = conn.execute(test_query).fetchone()[0]
-    st.write(f"YieldData表中现有记录数: {count}")
-    
-    # 获取完整的YieldData数据，关联产品和工站名称
-    yield_data = pd.read_sql("""
+# 测试SQL语句是否返回数据
+test_query = "SELECT COUNT(*) AS count FROM YieldData"
+count = db.cached_read_sql(test_query)['count'][0]
+st.write(f"YieldData表中现有记录数: {count}")
+
+# 获取完整的YieldData数据，关联产品和工站名称
+yield_data = db.cached_read_sql("""
     SELECT y.id, p.pn, p.module_name, s.name as station_name, 
            y.date_code, y.production_count, y.bad_count,
            y.defect_description, y.improvement_measures,
@@ -300,7 +276,7 @@ with sqlite3.connect(CONN) as conn:
     LEFT JOIN Stations s ON y.station_id = s.id
     ORDER BY y.id DESC
     LIMIT 3
-    """, conn)
+    """)
 
 if not yield_data.empty:
     st.write(f"Latest {len(yield_data)} 条良率记录")
@@ -330,28 +306,42 @@ if not yield_data.empty:
                     improvement_measures = st.text_area("改善措施", value=row['improvement_measures'])
                     
                     if st.form_submit_button("更新数据"):
-                        with sqlite3.connect(CONN) as conn:
-                            conn.execute("""
-                            UPDATE YieldData SET
-                                date_code = ?,
-                                good_count = ?,
-                                bad_count = ?,
-                                defect_description = ?,
-                                improvement_measures = ?
-                            WHERE id = ?
-                            """, (
-                                date_code, good_count, bad_count,
-                                defect_description, improvement_measures,
-                                row['id']
-                            ))
-                            conn.commit()
-                        st.success("良率数据已更新!")
-                        st.rerun()
+                        if week_calendar.week_key(date_code) is None:
+                            st.error("日期代码格式不正确，应为YYWW(如2514)或YYMMWww(如2504W14)")
+                        else:
+                            with db.connection() as conn:
+                                old_keys = alerts.yield_keys(conn, [row['id']])
+                                conn.execute("""
+                                UPDATE YieldData SET
+                                    date_code = ?,
+                                    good_count = ?,
+                                    bad_count = ?,
+                                    defect_description = ?,
+                                    improvement_measures = ?
+                                WHERE id = ?
+                                """, (
+                                    date_code, good_count, bad_count,
+                                    defect_description, improvement_measures,
+                                    row['id']
+                                ))
+                                week_calendar.normalize(conn, [row['id']])
+                                yield_rollup.refresh(conn)
+                                defect_clusters.update(conn)
+                                conn.commit()
+                                db.invalidate("YieldData", *yield_rollup.TABLES, *defect_clusters.TABLES)
+                                alerts.check_yield(conn, [row['id']], old_keys)
+                            st.success("良率数据已更新!")
+                            st.rerun()
                     
                     if st.form_submit_button("删除记录", type="secondary"):
-                        with sqlite3.connect(CONN) as conn:
+                        with db.connection() as conn:
+                            old_keys = alerts.yield_keys(conn, [row['id']])
                             conn.execute("DELETE FROM YieldData WHERE id = ?", (row['id'],))
+                            yield_rollup.refresh(conn)
+                            defect_clusters.update(conn)
                             conn.commit()
+                            db.invalidate("YieldData", *yield_rollup.TABLES, *defect_clusters.TABLES)
+                            alerts.check_yield(conn, keys=old_keys)
                         st.success("良率数据已删除!")
                         st.rerun()
 else:
@@ -1 +1,102 @@
-/Users/richard/Documents/MMES/SPC.py
\ No newline at end of file
+import streamlit as st
+from datetime import datetime
+from config import PN_TO_MODULE
+import spc_registry
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("SPC参数设置")
+
+registry = spc_registry.get()
+today = datetime.now().strftime('%Y-%m-%d')
+
+# 当前参数及今天生效的规格限
+rows = []
+for parameter in sorted(registry.by_key.values(), key=lambda p: (p.pn, p.name)):
+    lsl, usl = registry.limits_at(parameter.pn, parameter.name, today)
+    rows.append({
+        'PN': parameter.pn,
+        'Module': PN_TO_MODULE.get(parameter.pn, "Unknown"),
+        '参数': parameter.name,
+        'SN列': parameter.sn_col,
+        '值列': parameter.value_col,
+        '起始行': parameter.start_row,
+        'LSL': lsl,
+        'USL': usl,
+        '启用': bool(parameter.active),
+    })
+st.dataframe(rows, hide_index=True, use_container_width=True)
+st.caption(f"注册表版本 {registry.version}，修改后所有页面和导入服务在{spc_registry.CHECK_INTERVAL}秒内自动生效")
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.subheader("新增/修改参数")
+    keys = sorted(registry.by_key)
+    choice = st.selectbox("选择已有参数(留空为新增)", [None] + keys,
+                          format_func=lambda k: "新增参数" if k is None else f"{k[0]} | {k[1]}")
+    current = registry.by_key.get(choice) if choice else None
+    with st.form("parameter_form"):
+        pn = st.text_input("PN*", value=current.pn if current else "")
+        name = st.text_input("参数名*", value=current.name if current else "")
+        c1, c2, c3 = st.columns(3)
+        sn_col = c1.number_input("SN列", min_value=1, value=current.sn_col if current else 1)
+        value_col = c2.number_input("值列", min_value=1, value=current.value_col if current else 2)
+        start_row = c3.number_input("起始行", min_value=1, value=current.start_row if current else 5)
+        active = st.checkbox("启用", value=bool(current.active) if current else True)
+        if current is None:
+            st.caption("新参数保存后请在右侧设置规格限")
+        if st.form_submit_button("保存参数"):
+            if not pn.strip() or not name.strip():
+                st.error("请填写PN和参数名")
+            else:
+                spc_registry.save_parameter(pn.strip(), name, int(sn_col), int(value_col), int(start_row),
+                                            active, st.session_state.username)
+                st.success("参数已保存")
+                st.rerun()
+
+with col2:
+    st.subheader("规格限版本")
+    keys = sorted(registry.by_key)
+    if not keys:
+        st.info("请先添加参数")
+    else:
+        target = st.selectbox("参数", keys, format_func=lambda k: f"{k[0]} | {k[1]}")
+        history = registry.limits_history(*target)
+        if history:
+            st.dataframe([{'生效日期': date, 'LSL': lsl, 'USL': usl} for date, lsl, usl in reversed(history)],
+                         hide_index=True, use_container_width=True)
+        lsl_now, usl_now = registry.limits_at(target[0], target[1], today)
+        with st.form("limits_form"):
+            effective_from = st.date_input("生效日期*", datetime.now())
+            c1, c2 = st.columns(2)
+            lsl = c1.number_input("LSL", value=lsl_now, format="%.4f")
+            usl = c2.number_input("USL", value=usl_now, format="%.4f")
+            st.caption("生效日期之后导入的数据和CPK计算使用新规格限，之前的数据不受影响")
+            if st.form_submit_button("保存规格限"):
+                if lsl is not None and usl is not None and lsl >= usl:
+                    st.error("LSL必须小于USL")
+                else:
+                    spc_registry.add_spec_limits(target[0], target[1], effective_from.strftime('%Y-%m-%d'),
+                                                 lsl, usl, st.session_state.username)
+                    st.success("规格限已保存")
+                    st.rerun()
+
+st.subheader("EWMA / CUSUM 参数")
+keys = sorted(registry.by_key)
+if keys:
+    target = st.selectbox("参数", keys, format_func=lambda k: f"{k[0]} | {k[1]}", key="shift_target")
+    lam, L, k, h = registry.shift_settings(*target)
+    with st.form("shift_form"):
+        c1, c2, c3, c4 = st.columns(4)
+        lam = c1.number_input("EWMA λ", min_value=0.01, max_value=1.0, value=float(lam), step=0.05)
+        L = c2.number_input("EWMA L", min_value=0.5, max_value=5.0, value=float(L), step=0.1)
+        k = c3.number_input("CUSUM k(σ)", min_value=0.0, max_value=3.0, value=float(k), step=0.1)
+        h = c4.number_input("CUSUM h(σ)", min_value=0.5, max_value=20.0, value=float(h), step=0.5)
+        st.caption("小偏移检测页面默认使用这组参数")
+        if st.form_submit_button("保存EWMA/CUSUM参数"):
+            spc_registry.save_shift_settings(target[0], target[1], lam, L, k, h, st.session_state.username)
+            st.success("EWMA/CUSUM参数已保存")
+            st.rerun()
@@ -1,5 +1,266 @@
-import streamlit as st
+from datetime import datetime
+
+import numpy as np
+
+from config import SPC_Group, YIELD_ALERT_RATIO, YIELD_ALERT_STATION_RATIO
+import db
+import spc_engine
+import week_calendar
+
+# 报警引擎: 导入测量数据或录入良率后增量检查，结果写入alerts表，报警页面只读这张表
+# 每类数据源记一个高水位(已检查到的最大id)，只检查新行；同一问题按dedupe_key合并，不重复报警
+#   spec  - 测量值超出lower_limit/upper_limit，按(PN, 参数, 测量日期)合并
+#   rule  - 子组均值违反Nelson判异规则，按(PN, 参数, 月份, 规则)合并
+#   yield - 良率记录不良率(bad/good，good为生产数量)超过阈值，按(PN, 工站, date_code)合并
+
+# 累计型: 每次只带来新的次数，加到已有次数上
+ADD_SQL = '''
+INSERT INTO alerts (kind, pn, subject, dedupe_key, message, value, occurrences, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(dedupe_key) DO UPDATE SET
+    message = excluded.message, value = excluded.value, last_seen = excluded.last_seen,
+    occurrences = alerts.occurrences + excluded.occurrences, acknowledged = 0
+'''
+# 重算型: 每次给出当前总次数，有新增时才重新打开已确认的报警
+SET_SQL = '''
+INSERT INTO alerts (kind, pn, subject, dedupe_key, message, value, occurrences, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(dedupe_key) DO UPDATE SET
+    message = excluded.message, value = excluded.value, last_seen = excluded.last_seen,
+    acknowledged = CASE WHEN excluded.occurrences > alerts.occurrences THEN 0 ELSE alerts.acknowledged END,
+    occurrences = excluded.occurrences
+'''
+
+# 良率: 同一键下记录数增加，或之前因恢复正常被系统自动确认，重新超限时都重新打开
+YIELD_SQL = '''
+INSERT INTO alerts (kind, pn, subject, dedupe_key, message, value, occurrences, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(dedupe_key) DO UPDATE SET
+    message = excluded.message, value = excluded.value, last_seen = excluded.last_seen,
+    acknowledged = CASE WHEN excluded.occurrences > alerts.occurrences OR alerts.ack_by = 'system'
+                        THEN 0 ELSE alerts.acknowledged END,
+    occurrences = excluded.occurrences
+'''
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def get_watermark(conn, source):
+    row = conn.execute("SELECT last_id FROM alert_watermarks WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def set_watermark(conn, source, last_id):
+    conn.execute('''
+    INSERT INTO alert_watermarks (source, last_id) VALUES (?, ?)
+    ON CONFLICT(source) DO UPDATE SET last_id = excluded.last_id''', (source, last_id))
+
+
+def check_measurements(conn):
+    # 检查高水位之后新写入或值被覆盖更新的测量数据，返回新增/更新的报警数
+    # 高水位记的是row_version(导入时按批次递增，原地更新的行也会拿到新版本号)
+    last_id = get_watermark(conn, 'measurement_data')
+    max_id = conn.execute("SELECT MAX(row_version) FROM measurement_data").fetchone()[0] or 0
+    if max_id <= last_id:
+        return 0
+    now = _now()
+    count = 0
+    with conn:
+        # 超规格: 按(PN, 参数, 日期)汇总新数据里的超限条数
+        spec_rows = conn.execute('''
+        SELECT pn, parameter_name, measurement_date, COUNT(*), MIN(measurement_value), MAX(measurement_value),
+               MIN(lower_limit), MAX(upper_limit), group_concat(sn, ', ')
+        FROM measurement_data
+        WHERE row_version > ? AND row_version <= ?
+          AND (measurement_value < lower_limit OR measurement_value > upper_limit)
+        GROUP BY pn, parameter_name, measurement_date
+        ''', (last_id, max_id)).fetchall()
+        for pn, param, date, n, low, high, lsl, usl, sns in spec_rows:
+            worst = high if usl is not None and high > usl else low
+            message = f"{n} 个测量值超出规格 [{lsl}, {usl}]，最差 {worst:.4f}; SN: {sns[:200]}"
+            conn.execute(ADD_SQL, ('spec', pn, param, f"spec|{pn}|{param}|{date}", message, worst, n, now, now))
+            count += 1
+
+        # 判异: 对有新数据的(PN, 参数, 月份)重算整月子组序列
+        months = conn.execute('''
+        SELECT DISTINCT pn, parameter_name, measurement_month FROM measurement_data
+        WHERE row_version > ? AND row_version <= ?
+        ''', (last_id, max_id)).fetchall()
+        for pn, param, month in months:
+            count += _check_rules(conn, pn, param, month, now)
+
+        set_watermark(conn, 'measurement_data', max_id)
+    if count:
+        db.invalidate('alerts')
+    return count
+
+
+def _check_rules(conn, pn, param, month, now):
+    rows = conn.execute('''
+    SELECT n, sum, max - min FROM spc_subgroup_stats
+    WHERE pn = ? AND parameter_name = ? AND month = ?
+    ORDER BY subgroup
+    ''', (pn, param, month)).fetchall()
+    if len(rows) < 2:
+        return 0
+    stats = np.array(rows, dtype=float)
+    n = stats[:, 0]
+    xbar = stats[:, 1] / n
+    limits = spc_engine.xbar_r(xbar, stats[:, 2], n)
+    violations = spc_engine.nelson_rules(xbar, limits['center'], limits['point_sigma'])
+    count = 0
+    for rule, mask in violations.items():
+        if not mask.any():
+            continue
+        last = int(np.flatnonzero(mask)[-1]) + 1
+        message = (f"{month} 规则{rule} {spc_engine.RULES[rule]}: {int(mask.sum())} 个子组，"
+                   f"最近第 {last} 组(每组{SPC_Group}个)")
+        conn.execute(SET_SQL, ('rule', pn, param, f"rule|{pn}|{param}|{month}|{rule}", message,
+                               float(xbar[last - 1]), int(mask.sum()), now, now))
+        count += 1
+    return count
+
+
+def yield_threshold(station):
+    return YIELD_ALERT_STATION_RATIO.get(station, YIELD_ALERT_RATIO)
+
+
+_YIELD_KEY_SQL = '''
+SELECT y.id, COALESCE(p.pn, y.pn), COALESCE(s.name, y.station), y.date_code
+FROM YieldData y
+LEFT JOIN Products p ON y.product_id = p.id
+LEFT JOIN Stations s ON y.station_id = s.id
+WHERE {where}
+'''
+
+
+def yield_keys(conn, ids):
+    # 记录当前所属的(PN, 工站, date_code)；修改或删除记录前取出，之后把旧键一起交给check_yield重算
+    ids = list(ids)
+    if not ids:
+        return set()
+    rows = conn.execute(_YIELD_KEY_SQL.format(where=f"y.id IN ({', '.join('?' * len(ids))})"), ids).fetchall()
+    return {(pn, station, date_code) for _, pn, station, date_code in rows}
+
+
+def check_yield(conn, ids=None, keys=()):
+    # 检查高水位之后新增的良率记录，以及ids(修改过的记录)和keys(修改/删除前的旧键)涉及的报警
+    # 同一(PN, 工站, date_code)可能有多条记录，按该键下全部记录的合计重算，再决定报警、自动确认或清除
+    last_id = get_watermark(conn, 'YieldData')
+    where, params = "y.id > ?", [last_id]
+    if ids:
+        where = f"(y.id > ? OR y.id IN ({', '.join('?' * len(ids))}))"
+        params += list(ids)
+    rows = conn.execute(_YIELD_KEY_SQL.format(where=where), params).fetchall()
+    affected = set(keys) | {(pn, station, date_code) for _, pn, station, date_code in rows}
+    if not affected:
+        return 0
+    now = _now()
+    count = 0
+    with conn:
+        for pn, station, date_code in affected:
+            key = f"yield|{pn}|{station}|{date_code}"
+            # date_code换算出的week_key与写入时一致，用(week_key, pn)索引缩小范围
+            records, good, bad = conn.execute('''
+            SELECT COUNT(*), SUM(y.good_count), SUM(y.bad_count)
+            FROM YieldData y
+            LEFT JOIN Products p ON y.product_id = p.id
+            LEFT JOIN Stations s ON y.station_id = s.id
+            WHERE y.week_key IS ? AND y.date_code = ?
+              AND COALESCE(p.pn, y.pn) IS ? AND COALESCE(s.name, y.station) IS ?
+            ''', (week_calendar.week_key(date_code), date_code, pn, station)).fetchone()
+            if not records:
+                # 该键下的记录都已删除，报警一并清除
+                conn.execute("DELETE FROM alerts WHERE dedupe_key = ?", (key,))
+                continue
+            # good_count是生产数量(投入数)，不良率与良率报表一致: 不良数/生产数量
+            ratio = (bad or 0) / good if good else 0.0
+            threshold = yield_threshold(station)
+            if ratio > threshold:
+                message = (f"{date_code} 不良率 {ratio:.1%} 超过 {threshold:.1%} "
+                           f"(不良 {bad} / 生产数量 {good}，{records} 条记录)")
+                conn.execute(YIELD_SQL, ('yield', pn, station, key, message, ratio, records, now, now))
+                count += 1
+            else:
+                # 合计已恢复正常，自动确认
+                conn.execute('''
+                UPDATE alerts SET acknowledged = 1, ack_by = 'system', ack_at = ?
+                WHERE dedupe_key = ? AND acknowledged = 0''', (now, key))
+        new_max = max((record_id for record_id, *_ in rows), default=last_id)
+        if new_max > last_id:
+            set_watermark(conn, 'YieldData', new_max)
+    db.invalidate('alerts')
+    return count
+
+
+def acknowledge(alert_ids, username):
+    with db.connection() as conn:
+        conn.executemany('''
+        UPDATE alerts SET acknowledged = 1, ack_by = ?, ack_at = ? WHERE id = ?
+        ''', [(username, _now(), alert_id) for alert_id in alert_ids])
+    db.invalidate('alerts')
+
+
+KIND_LABELS = {'spec': '超规格', 'rule': '判异', 'yield': '良率'}
+
 
 def show():
+    # 报警页面只读alerts表(带缓存)，不做任何计算；streamlit只在页面里加载，导入服务不需要它
+    import streamlit as st
+
+    if 'username' not in st.session_state or not st.session_state.username:
+        st.warning("请先登录系统")
+        st.stop()  # 停止执行后续代码
+
     st.title("Alerts")
-    st.write("这里是应用的主页面内容")
\ No newline at end of file
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        kinds = st.multiselect("类型", list(KIND_LABELS), default=list(KIND_LABELS),
+                               format_func=KIND_LABELS.get)
+    with col2:
+        show_acknowledged = st.checkbox("包含已确认", value=False)
+    with col3:
+        limit = st.number_input("最多显示", min_value=50, max_value=5000, value=500, step=50)
+
+    if not kinds:
+        st.stop()
+    placeholders = ', '.join('?' * len(kinds))
+    alerts = db.cached_read_sql(f'''
+    SELECT id, kind, pn, subject, message, occurrences, first_seen, last_seen, acknowledged, ack_by
+    FROM alerts
+    WHERE kind IN ({placeholders}) {'' if show_acknowledged else 'AND acknowledged = 0'}
+    ORDER BY last_seen DESC
+    LIMIT ?
+    ''', params=(*kinds, int(limit)))
+
+    open_count = int((alerts['acknowledged'] == 0).sum())
+    m1, m2, m3 = st.columns(3)
+    m1.metric("未确认", open_count)
+    for col, kind in ((m2, 'spec'), (m3, 'rule')):
+        col.metric(KIND_LABELS[kind], int(((alerts['kind'] == kind) & (alerts['acknowledged'] == 0)).sum()))
+
+    if alerts.empty:
+        st.success("没有报警")
+        return
+
+    alerts.insert(0, '确认', False)
+    alerts['kind'] = alerts['kind'].map(KIND_LABELS)
+    edited = st.data_editor(
+        alerts,
+        hide_index=True,
+        use_container_width=True,
+        disabled=[c for c in alerts.columns if c != '确认'],
+        column_config={'id': None, 'acknowledged': st.column_config.CheckboxColumn('已确认')},
+    )
+    selected = edited.loc[edited['确认'] & (edited['acknowledged'] == 0), 'id'].tolist()
+    if st.button(f"确认选中的 {len(selected)} 条报警", disabled=not selected):
+        acknowledge(selected, st.session_state.username)
+        st.rerun()
+
+
+if __name__ == '__main__':
+    # 作为页面运行时(st.Page("alerts.py"))渲染
+    show()
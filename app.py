@@ -1,15 +1,22 @@
 import streamlit as st
-from config import pages
+from config import PAGES
 import sqlite3
 
-from config import CONN
+import db
+import migrations
+
+
+@st.cache_resource
+def init_database():
+    # 每个进程只执行一次数据库迁移
+    return migrations.migrate()
 
 def login(username, password):
     username = username.strip().lower()
     password = password.strip().lower()
     
     try:
-        with sqlite3.connect(CONN) as conn:
+        with db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users WHERE LOWER(username)=? AND LOWER(password)=?", 
                          (username, password))
@@ -22,6 +29,13 @@ def logout():
     # 清除session状态已在app.py中处理
     pass
 
+def build_pages():
+    # 页面脚本只在被访问时才执行，各自的重依赖也只在那时加载
+    return {group: [st.Page(path, title=title) for path, title in entries]
+            for group, entries in PAGES.items()}
+
+
+init_database()
 
 # 初始化session状态
 if 'logged_in' not in st.session_state:
@@ -58,5 +72,5 @@ else:
             st.rerun()
 
 
-pg = st.navigation(pages)
+pg = st.navigation(build_pages())
 pg.run()
\ No newline at end of file
@@ -0,0 +1,100 @@
+# 导入性能对比: 整表pd.read_excel vs 流式只读读取，比较峰值内存(RSS)和耗时
+# 用法: python bench_ingest.py [文件.xlsx] [--rows 200000] [--width 30]
+# 不指定文件时生成一个模拟的T&A工作簿；每种方式在独立子进程中运行，互不影响峰值内存
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+
+
+def make_workbook(path, rows, width):
+    from openpyxl import Workbook
+    from config import SPC_PN
+    import spc_registry
+
+    pn = spc_registry.get().pns()[0]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([f"col{i + 1}" for i in range(width)])
+    for r in range(2, 6):
+        row = [None] * width
+        if r == SPC_PN[0] + 1:
+            row[SPC_PN[1] - 1] = pn
+        ws.append(row)
+    for i in range(rows):
+        row = [0.01 * (j % 9) for j in range(width)]
+        row[0] = f"S32201-3A{i:06d}-34"
+        ws.append(row)
+    wb.save(path)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(mode, path):
+    import pandas as pd
+    import ingest
+
+    filename = os.path.basename(path)
+    start = time.perf_counter()
+    if mode == 'pandas':
+        df = pd.read_excel(path)
+        df.columns = range(len(df.columns))
+        pn = ingest.detect_pn(df, filename)
+        batches, errors = ingest.extract_measurements(df, pn, filename)
+    else:
+        result = ingest.parse_file(filename, '2000-01-01', os.path.dirname(path))
+        batches, errors = result['batches'], result['errors']
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        'mode': mode,
+        'seconds': seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'records': sum(len(b['value']) for b in batches),
+        'errors': len(errors),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Excel import paths")
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--width', type=int, default=30)
+    parser.add_argument('--child', choices=['pandas', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.path)
+        return
+
+    tmpdir = None
+    path = args.path
+    if path is None:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'bench_T&A.xlsx')
+        print(f"生成模拟工作簿: {args.rows} 行 x {args.width} 列 ...")
+        make_workbook(path, args.rows, args.width)
+
+    print(f"{'方式':<10}{'耗时(s)':>10}{'峰值RSS(MB)':>14}{'记录数':>10}{'错误':>8}")
+    for mode in ['pandas', 'streaming']:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), path, '--child', mode],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        stats = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{mode:<10}{stats['seconds']:>10.2f}{stats['peak_rss_mb']:>14.1f}"
+              f"{stats['records']:>10}{stats['errors']:>8}")
+
+    if tmpdir:
+        os.remove(path)
+        os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# 启动性能基准: 每个页面在独立子进程中冷启动渲染一次，报告页面自身的导入耗时、首次渲染耗时和加载了哪些重依赖
+# 导入耗时只计页面模块顶层的import语句(Streamlit框架本身的导入各页面相同，不计入)，首次渲染不再包含这部分
+# 用法: python bench_startup.py [页面.py ...] [--max-seconds 3.0]
+# 任一页面首次渲染超过--max-seconds时返回码为1，可放进发布前检查
+import os
+import sys
+import ast
+import json
+import time
+import argparse
+import subprocess
+
+from config import PAGES
+
+HEAVY_MODULES = ['pandas', 'numpy', 'plotly', 'openpyxl', 'xlrd', 'matplotlib', 'scipy', 'sklearn']
+
+
+def page_imports(page):
+    # 页面顶层的import语句编译成一段代码；函数里和按钮分支里的延迟导入首次渲染不执行，不包括在内
+    with open(page, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=page)
+    body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return compile(ast.Module(body=body, type_ignores=[]), page, 'exec')
+
+
+def run_child(page):
+    from streamlit.testing.v1 import AppTest
+    preloaded = {name for name in HEAVY_MODULES if name in sys.modules}
+
+    code = page_imports(page)
+    start = time.perf_counter()
+    exec(code, {'__name__': 'bench_page'})
+    import_seconds = time.perf_counter() - start
+
+    at = AppTest.from_file(os.path.abspath(page), default_timeout=120)
+    at.session_state['username'] = 'bench'
+    start = time.perf_counter()
+    at.run()
+    render_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        'page': page,
+        'import_seconds': import_seconds,
+        'render_seconds': render_seconds,
+        'heavy': sorted(name for name in HEAVY_MODULES if name in sys.modules and name not in preloaded),
+        'errors': [e.message for e in at.exception],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold first-render time per page")
+    parser.add_argument('pages', nargs='*')
+    parser.add_argument('--max-seconds', type=float, help="首次渲染超过该秒数即判为失败")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    pages = args.pages or [path for entries in PAGES.values() for path, _ in entries]
+    here = os.path.dirname(os.path.abspath(__file__))
+    failed = False
+    print(f"{'页面':<20}{'页面导入(s)':>12}{'首次渲染(s)':>12}  加载的重依赖")
+    for page in pages:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', page],
+                             capture_output=True, text=True, cwd=here)
+        if out.returncode != 0:
+            print(f"{page:<20}运行失败: {out.stderr.strip().splitlines()[-1:]}")
+            failed = True
+            continue
+        stats = json.loads(out.stdout.strip().splitlines()[-1])
+        slow = args.max_seconds is not None and stats['render_seconds'] > args.max_seconds
+        failed = failed or slow or bool(stats['errors'])
+        print(f"{page:<20}{stats['import_seconds']:>12.2f}{stats['render_seconds']:>12.2f}  "
+              f"{', '.join(stats['heavy']) or '-'}{'  超时' if slow else ''}"
+              f"{'  异常: ' + stats['errors'][0] if stats['errors'] else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
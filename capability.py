@@ -0,0 +1,86 @@
+import streamlit as st
+from config import PN_TO_MODULE
+import spc_stats
+import spc_engine
+import spc_registry
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("过程能力批量报告")
+
+MIN_SAMPLES = 50  # 与SPC图表页一致，少于50个数据的月份不计算
+
+# 所有参数、所有月份的统计量来自子组统计表的一次分组查询
+summary = spc_stats.month_summary(MIN_SAMPLES)
+
+# 每个月用月末生效的规格限，只保留注册表中已配置且设置了规格上下限的参数
+registry = spc_registry.get()
+limits = [registry.limits_at(pn, param, f"{month}-31")
+          for pn, param, month in zip(summary['pn'], summary['parameter_name'], summary['month'])]
+summary['lsl'] = [lsl for lsl, _ in limits]
+summary['usl'] = [usl for _, usl in limits]
+summary['spec_changed'] = [registry.limits_changed(pn, param, f"{month}-01", f"{month}-31")
+                           for pn, param, month in zip(summary['pn'], summary['parameter_name'], summary['month'])]
+summary = summary[summary['lsl'].notna() & summary['usl'].notna()].reset_index(drop=True)
+
+if summary.empty:
+    st.warning("没有找到包含足够数据的参数")
+    st.stop()
+
+indices = spc_engine.capability(summary['mean'], summary['sigma_within'], summary['sigma_overall'],
+                                summary['lsl'], summary['usl'])
+for name, values in indices.items():
+    summary[name] = values
+summary['module'] = summary['pn'].map(lambda pn: PN_TO_MODULE.get(pn, "Unknown"))
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    pn_filter = st.multiselect("PN", sorted(summary['pn'].unique()))
+with col2:
+    metric = st.selectbox("热力图指标", ['cpk', 'ppk', 'cp', 'pp'], format_func=str.upper)
+with col3:
+    months = sorted(summary['month'].unique(), reverse=True)
+    month_range = st.slider("月份数", 1, len(months), min(12, len(months))) if len(months) > 1 else 1
+
+report = summary[summary['month'].isin(months[:month_range])]
+if pn_filter:
+    report = report[report['pn'].isin(pn_filter)]
+
+# 热力图: 行=PN/参数，列=月份；<1.0红色，1.0~1.33黄色，>=1.33绿色
+import plotly.graph_objects as go
+
+report = report.assign(label=report['pn'] + ' | ' + report['parameter_name'])
+grid = report.pivot(index='label', columns='month', values=metric).sort_index(axis=1)
+fig = go.Figure(go.Heatmap(
+    z=grid.to_numpy(),
+    x=grid.columns.tolist(),
+    y=grid.index.tolist(),
+    zmin=0, zmax=2,
+    colorscale=[[0, 'red'], [0.5, 'red'], [0.5, 'gold'], [0.665, 'gold'], [0.665, 'green'], [1, 'green']],
+    text=grid.round(2).astype(str).replace('nan', '').to_numpy(),
+    texttemplate='%{text}',
+    hovertemplate='%{y}<br>%{x}: %{z:.3f}<extra></extra>',
+    colorbar=dict(title=metric.upper()),
+))
+fig.update_layout(height=max(300, 40 * len(grid) + 120), yaxis=dict(autorange='reversed'))
+st.plotly_chart(fig, use_container_width=True)
+
+# 明细表，点击列标题可排序
+st.dataframe(
+    report[['pn', 'module', 'parameter_name', 'month', 'n', 'mean', 'sigma_within', 'sigma_overall',
+            'lsl', 'usl', 'spec_changed', 'cp', 'cpk', 'pp', 'ppk']].sort_values(metric),
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        'sigma_within': st.column_config.NumberColumn('σ组内', format='%.5f'),
+        'sigma_overall': st.column_config.NumberColumn('σ整体', format='%.5f'),
+        'mean': st.column_config.NumberColumn('平均值', format='%.4f'),
+        'spec_changed': st.column_config.CheckboxColumn('月内规格变更', help="按月末生效的规格限计算"),
+        'cp': st.column_config.NumberColumn('Cp', format='%.2f'),
+        'cpk': st.column_config.NumberColumn('Cpk', format='%.2f'),
+        'pp': st.column_config.NumberColumn('Pp', format='%.2f'),
+        'ppk': st.column_config.NumberColumn('Ppk', format='%.2f'),
+    },
+)
@@ -1,33 +1,40 @@
 
-import streamlit as st
-import sqlite3
 CONN='database.db'
 
-pages = {
+# 导航页面: 分组 -> [(页面文件, 标题)]，由app.py在运行时生成st.Page
+# 这里不导入streamlit，后台导入服务和子进程导入config时不用加载页面框架
+# 页面文件名必须与磁盘上的大小写一致(Linux区分大小写)；st.Page按文件名生成URL，改名会改变页面地址和书签
+PAGES = {
     
     "SPC": [
-        st.Page("read.py", title="Read from Excel"),
-        st.Page("draw.py", title="Draw SPC Chart"),
+        ("read.py", "Read from Excel"),
+        ("draw.py", "Draw SPC Chart"),
+        ("capability.py", "Capability Report"),
+        ("live_chart.py", "Live SPC Chart"),
+        ("spc_dashboard.py", "SPC Dashboard"),
+        ("small_shift.py", "EWMA / CUSUM"),
+        ("SPC_setting.py", "SPC Settings"),
     ],
     "Quality": [
-        #st.Page("8D.py", title="8D Customer Complaints"),
-        #st.Page("VCAR.py", title="VCAR Complaints Supplier"),
-        #st.Page("MVT.py", title="MVT PCN Tracking"),
-        st.Page("8D2.py", title="8D Complaints"),
-        st.Page("MVT2.py", title="MVT PCN Tracking"),
-        
-
-        
+        #("8D.py", "8D Customer Complaints"),
+        #("VCAR.py", "VCAR Complaints Supplier"),
+        #("MVT.py", "MVT PCN Tracking"),
+        ("8d2.py", "8D Complaints"),
+        ("mvt2.py", "MVT PCN Tracking"),
+        ("sn_trace.py", "SN Traceability"),
+        ("alerts.py", "Alerts"),
     ],
     "Production": [
-        st.Page("productionadd.py", title="Add Stations/Module"),
-        st.Page("loadyieldid.py", title="Load Production id="),
-        st.Page("reviewyield2.py", title="Review Yield Data2"),
-        
-        
+        ("ProductionAdd.py", "Add Stations/Module"),
+        ("loadyieldid.py", "Load Production id="),
+        ("reviewyield2.py", "Review Yield Data2"),
+        ("yield_report.py", "Yield Rollup"),
+        ("rty_dashboard.py", "RTY Dashboard"),
     ],
 }
 
+# SPC参数的初始配置，只在数据库迁移(版本7)时导入参数注册表spc_parameters/spc_spec_limits，
+# 之后新增参数或修改规格限请在"SPC Settings"页面操作，无需修改代码和重启
 SPC_DATA = {
     "Y Direction Measurement on Front Rail Z3": [1,4,5,0,0.075,'03232-0010-000'],
     "Y Direction Measurement on Front Rail Z4": [1,5,5,0,0.075,'03232-0010-000'],
@@ -44,3 +51,15 @@ PN_TO_MODULE = {
     # 可以继续添加更多映射
 }
 SPC_Group = 5  # 每组数据个数
+# 良率报警阈值: 不良率 bad/(good+bad) 超过该值报警，可按工站单独设置
+YIELD_ALERT_RATIO = 0.05
+YIELD_ALERT_STATION_RATIO = {
+    # "工站名": 0.02,
+}
+# EWMA/CUSUM小偏移检测参数: [λ, L, k, h]，没有单独设置的参数用SPC_SHIFT_DEFAULT
+# SPC_SHIFT只在数据库迁移(版本13)时导入参数注册表spc_shift_settings，之后请在"SPC Settings"页面修改
+SPC_SHIFT_DEFAULT = [0.2, 3.0, 0.5, 5.0]
+SPC_SHIFT = {
+    "Y Direction Measurement on Front Rail Z3": [0.1, 2.7, 0.5, 4.0],
+    "Y Direction Measurement on Front Rail Z4": [0.1, 2.7, 0.5, 4.0],
+}
@@ -1,15 +1,9 @@
 import streamlit as st
-import sqlite3
-import sqlite3
 import os
 from datetime import datetime
-import pandas as pd
-from config import CONN
+import db
 
 def tracking(tracking_name):
-# 初始化表
-    init_tracking_table()
-
     # 主界面
 
 
@@ -46,7 +40,7 @@ def tracking(tracking_name):
                     report_path = save_uploaded_file(report_file, report_no, tracking_name) if report_file else None
                     
                     # 保存到数据库
-                    with sqlite3.connect(CONN) as conn:
+                    with db.connection() as conn:
                         # 检查编号是否已存在
                         existing = conn.execute("SELECT No FROM Tracking WHERE No = ?", (report_no,)).fetchone()
                         if existing:
@@ -67,6 +61,7 @@ def tracking(tracking_name):
                                 tracking_name  # 固定为8D类型
                             ))
                             conn.commit()
+                            db.invalidate("Tracking")
                     st.success(f"{tracking_name}报告创建成功!")
 
     # 查看现有报告
@@ -91,9 +86,10 @@ def tracking(tracking_name):
                 col1, col2 = st.columns([0.9, 0.1])
                 with col2:
                     if st.button(f"🗑️", key=f"delete_{report['No']}" ,type="primary"):
-                        with sqlite3.connect(CONN) as conn:
+                        with db.connection() as conn:
                             conn.execute("DELETE FROM Tracking WHERE No = ?", (report['No'],))
                             conn.commit()
+                            db.invalidate("Tracking")
                         st.success(f"报告 {report['No']} 已删除!")
                         st.rerun()
                 
@@ -127,7 +123,7 @@ def tracking(tracking_name):
                             good_path = save_uploaded_file(new_good_pic, report['No'], tracking_name) if new_good_pic else report_details[9]
                             report_path = save_uploaded_file(new_report_file, report['No'], tracking_name) if new_report_file else report_details[10]
                             
-                            with sqlite3.connect(CONN) as conn:
+                            with db.connection() as conn:
                                 conn.execute("""
                                 UPDATE Tracking 
                                 SET customer=?, supplier=?, description=?, 
@@ -141,6 +137,7 @@ def tracking(tracking_name):
                                     report['No']
                                 ))
                                 conn.commit()
+                                db.invalidate("Tracking")
                             st.success("报告已更新!")
                             st.rerun()
                     
@@ -171,7 +168,7 @@ def tracking(tracking_name):
                     #                                 if report_details[6] else None)
                         
                     #     if st.form_submit_button("更新报告"):
-                    #         with sqlite3.connect(CONN) as conn:
+                    #         with db.connection() as conn:
                     #             conn.execute("""
                     #             UPDATE Tracking 
                     #             SET status = ?, end_date = ?
@@ -185,43 +182,20 @@ def tracking(tracking_name):
 
     return
 
-# 确保8D报告表存在
-def init_tracking_table():
-    with sqlite3.connect(CONN) as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS Tracking (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            No TEXT NOT NULL,
-            customer TEXT NOT NULL,
-            supplier TEXT NOT NULL,
-            description TEXT NOT NULL,
-            start_date DATE NOT NULL,
-            end_date DATE,
-            status TEXT CHECK(status IN ('open', 'closed')) NOT NULL,
-            NG_Picture TEXT,
-            Good_Picture TEXT,
-            report_file TEXT,
-            username TEXT NOT NULL,
-            create_date DATE NOT NULL,
-            type TEXT DEFAULT '8D' NOT NULL
-        )
-        """)
-
 # 获取当前年份的所有8D报告
 def get_all_reports(year=None, tracking_name=None):
     year = year or datetime.now().year
-    with sqlite3.connect(CONN) as conn:
-        query = """
-        SELECT No, customer, supplier, description, status, start_date, end_date 
-        FROM Tracking 
-        WHERE strftime('%Y', start_date) = ? AND type = ?
-        ORDER BY start_date DESC
-        """
-        return pd.read_sql(query, conn, params=(str(year), tracking_name))
+    query = """
+    SELECT No, customer, supplier, description, status, start_date, end_date 
+    FROM Tracking 
+    WHERE type = ? AND start_year = ?
+    ORDER BY start_date DESC
+    """
+    return db.cached_read_sql(query, params=(tracking_name, str(year)))
 
 # 获取单个报告的详细信息
 def get_report_details(report_no):
-    with sqlite3.connect(CONN) as conn:
+    with db.connection() as conn:
         query = "SELECT * FROM Tracking WHERE No = ?"
         return conn.execute(query, (report_no,)).fetchone()
 
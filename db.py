@@ -0,0 +1,157 @@
+import re
+import time
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import CONN
+
+# 全局共享的SQLite连接池: 各页面不再自己sqlite3.connect，统一从这里借用连接
+
+POOL_SIZE = 8  # 最多同时打开的连接数
+ACQUIRE_TIMEOUT = 30  # 连接全部借出时最多等待的秒数，超时报错而不是一直卡住
+STATEMENT_CACHE = 256  # 每个连接缓存的预编译语句数
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",  # 读写互不阻塞，多人同时使用不再database is locked
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -20000",  # 约20MB页缓存
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+CACHE_TTL = 60  # 查询结果缓存秒数，其他进程(后台导入服务)的写入最多延迟这么久可见
+CACHE_SIZE = 256  # 最多缓存的查询结果数，超出按最近最少使用淘汰
+
+
+def connect(database=CONN):
+    # 创建一个已调好参数的连接，后台服务等长期持有连接的地方也用它
+    conn = sqlite3.connect(database, timeout=5, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, database=CONN, size=POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return connect(self.database)
+                except Exception:
+                    self._created -= 1
+                    raise
+        # 持有连接时又在内层借连接(嵌套借用)会占满连接池，等不到就报错，不再无限阻塞
+        try:
+            return self._idle.get(timeout=ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError(f"数据库连接池已满: {self.size}个连接全部借出，{ACQUIRE_TIMEOUT}秒内没有归还") from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        # 正常结束时提交，出错时回滚，最后归还连接
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def read_sql(sql, params=None):
+    import pandas as pd
+    with connection() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+
+# 读查询结果缓存: 按(规范化SQL, 参数)缓存DataFrame，写入某张表后只清掉涉及该表的缓存
+_cache = OrderedDict()  # key -> (过期时间, 涉及的表, DataFrame)
+_cache_lock = threading.Lock()
+_TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    return ' '.join(sql.split())
+
+
+def tables_in(sql):
+    return {name.lower() for name in _TABLE_PATTERN.findall(sql)}
+
+
+def cached_read_sql(sql, params=None, ttl=CACHE_TTL):
+    key = (normalize_sql(sql), tuple(params or ()))
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] > now:
+            _cache.move_to_end(key)
+            return entry[2].copy()
+
+    df = read_sql(sql, params)
+    with _cache_lock:
+        _cache[key] = (now + ttl, tables_in(sql), df)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return df.copy()
+
+
+def invalidate(*tables):
+    # 写入后调用，清掉查询过这些表的缓存
+    tables = {table.lower() for table in tables}
+    with _cache_lock:
+        for key in [key for key, entry in _cache.items() if entry[1] & tables]:
+            del _cache[key]
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
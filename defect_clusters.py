@@ -0,0 +1,209 @@
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+import db
+
+# 不良描述聚类: 手工录入的defect_description写法五花八门("焊点虚焊"、"虚焊 "、"焊点 虚焊!")，
+# 把近似的描述归成一类再做Pareto
+# 特征: 规范化文本的1~3字符n-gram，哈希到固定维度后做TF-IDF(中文不需要分词，新文本也不需要重建词表)
+# 聚类: 在线小批量k-means的质心更新(质心 += (x - 质心)/n)，与最近质心的余弦相似度低于阈值时新开一类，
+# 类别数不用事先指定
+# IDF和质心在rebuild()时拟合并存库；之后update()只给新增或修改过描述的记录分配类别，不重新拟合，
+# 去重描述数增长到上次拟合时的REFIT_GROWTH倍后自动重建；也可以手动运行 python defect_clusters.py 重建
+
+DIMENSIONS = 2 ** 12
+NGRAMS = (1, 2, 3)
+SIMILARITY_THRESHOLD = 0.5  # 余弦相似度低于此值时新开一类
+REFINE_PASSES = 2  # 重建时按最近质心重新分配并重算质心的次数
+REFIT_GROWTH = 1.5  # 去重描述数达到上次拟合时的多少倍后重新拟合IDF和质心
+TABLES = ('defect_clusters', 'defect_cluster_members', 'defect_cluster_state')
+
+_SPACES = re.compile(r'\s+')
+_NOISE = re.compile(r'[^\w\s]')
+
+
+def normalize(text):
+    # 全角转半角、英文小写、去标点、合并空白
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    text = _NOISE.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def _counts(texts):
+    # 每条文本的n-gram哈希词频矩阵(稠密，行数为去重后的描述数，规模不大)
+    matrix = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        compact = text.replace(' ', '')
+        for n in NGRAMS:
+            for i in range(len(compact) - n + 1):
+                matrix[row, zlib.crc32(compact[i:i + n].encode('utf-8')) % DIMENSIONS] += 1
+    return matrix
+
+
+def _tfidf(counts, idf):
+    # 次线性词频 × IDF，按行L2归一化
+    tfidf = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0).astype(np.float32) * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    return tfidf / np.where(norms > 0, norms, 1)
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _assign(vectors, weights, centroids, members):
+    # 逐条分配到最近的质心并在线更新质心；相似度不够时新开一类。返回每条的类别下标
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for i, (vector, weight) in enumerate(zip(vectors, weights)):
+        if centroids:
+            similarity = np.stack(centroids) @ vector
+            best = int(similarity.argmax())
+            if similarity[best] >= SIMILARITY_THRESHOLD:
+                members[best] += weight
+                centroids[best] = _unit(centroids[best] + (vector - centroids[best]) * (weight / members[best]))
+                labels[i] = best
+                continue
+        centroids.append(vector.copy())
+        members.append(weight)
+        labels[i] = len(centroids) - 1
+    return labels
+
+
+def _pending(conn, everything=False):
+    # 需要分配类别的不良记录: 还没有分配过，或分配后描述被改过；返回(记录id, 描述, 原类别id或None)
+    sql = '''
+    SELECT y.id, y.defect_description, m.cluster_id
+    FROM YieldData y LEFT JOIN defect_cluster_members m ON m.record_id = y.id
+    WHERE y.bad_count > 0 AND TRIM(COALESCE(y.defect_description, '')) != ''
+    '''
+    if not everything:
+        sql += " AND (m.record_id IS NULL OR m.source != y.defect_description)"
+    return conn.execute(sql).fetchall()
+
+
+def _save_members(conn, rows, texts, cluster_ids):
+    conn.executemany('''
+    INSERT INTO defect_cluster_members (record_id, cluster_id, source, text) VALUES (?, ?, ?, ?)
+    ON CONFLICT(record_id) DO UPDATE SET
+        cluster_id = excluded.cluster_id, source = excluded.source, text = excluded.text
+    ''', [(record_id, cluster_id, source, text)
+          for (record_id, source, _), text, cluster_id in zip(rows, texts, cluster_ids)])
+
+
+def _release(conn, cluster_ids):
+    # 记录离开原类别(描述被改或记录被删除)时减掉原类别的成员数，减到0的类别删除
+    conn.executemany("UPDATE defect_clusters SET members = members - ? WHERE id = ?",
+                     [(count, cluster_id) for cluster_id, count in Counter(cluster_ids).items()])
+    conn.execute("DELETE FROM defect_clusters WHERE members <= 0")
+
+
+def _drop_orphans(conn):
+    # 已删除、不良数改为0或描述被清空的记录不再参与统计
+    orphans = conn.execute('''
+    SELECT record_id, cluster_id FROM defect_cluster_members WHERE record_id NOT IN (
+        SELECT id FROM YieldData
+        WHERE bad_count > 0 AND TRIM(COALESCE(defect_description, '')) != '')''').fetchall()
+    if not orphans:
+        return
+    conn.executemany("DELETE FROM defect_cluster_members WHERE record_id = ?",
+                     [(record_id,) for record_id, _ in orphans])
+    _release(conn, [cluster_id for _, cluster_id in orphans])
+
+
+def rebuild(conn):
+    # 重新拟合IDF和全部质心，返回类别数；调用方负责提交事务
+    rows = _pending(conn, everything=True)
+    conn.execute("DELETE FROM defect_clusters")
+    conn.execute("DELETE FROM defect_cluster_members")
+    conn.execute("DELETE FROM defect_cluster_state")
+    texts = [normalize(source) for _, source, _ in rows]
+    unique, inverse, weights = np.unique(np.array(texts, dtype=object), return_inverse=True, return_counts=True)
+    counts = _counts(list(unique))
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = (np.log((1 + len(unique)) / (1 + document_frequency)) + 1).astype(np.float32)
+    vectors = _tfidf(counts, idf)
+
+    # 先按出现次数从多到少分配，常见写法成为各类的初始质心；再按最近质心重分配几轮
+    order = np.argsort(-weights, kind='stable')
+    centroids, members = [], []
+    labels = np.empty(len(unique), dtype=np.int64)
+    labels[order] = _assign(vectors[order], weights[order], centroids, members)
+    for _ in range(REFINE_PASSES):
+        if not centroids:
+            break
+        labels = (vectors @ np.stack(centroids).T).argmax(axis=1)
+        used = np.unique(labels)
+        centroids = [_unit((vectors[labels == k] * weights[labels == k, None]).sum(axis=0)) for k in used]
+        labels = np.searchsorted(used, labels)
+        members = [int(weights[labels == k].sum()) for k in range(len(used))]
+
+    conn.executemany("INSERT INTO defect_clusters (id, members, centroid) VALUES (?, ?, ?)",
+                     [(k + 1, int(members[k]), centroids[k].astype(np.float32).tobytes())
+                      for k in range(len(centroids))])
+    conn.execute("INSERT INTO defect_cluster_state VALUES (1, ?, ?, ?)",
+                 (len(unique), idf.tobytes(), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    _save_members(conn, rows, texts, (labels[inverse] + 1).tolist() if len(rows) else [])
+    return len(centroids)
+
+
+def update(conn):
+    # 只给新增或修改过描述的记录分配类别，沿用已拟合的IDF和质心；返回处理的记录数
+    # 写入良率记录的事务里调用，调用方负责提交事务，提交后用db.invalidate(*TABLES)清除查询缓存
+    _drop_orphans(conn)
+    state = conn.execute("SELECT documents, idf FROM defect_cluster_state WHERE id = 1").fetchone()
+    if state is None:
+        rebuild(conn)
+        return conn.execute("SELECT COUNT(*) FROM defect_cluster_members").fetchone()[0]
+    rows = _pending(conn)
+    if not rows:
+        return 0
+    texts = [normalize(source) for _, source, _ in rows]
+    # 拟合后新写法多了，旧IDF(拟合时没有数据则全是常数)已不能代表现在的描述，整体重新拟合
+    documents = {text for text, in conn.execute("SELECT DISTINCT text FROM defect_cluster_members")}
+    if len(documents | set(texts)) >= max(state[0], 1) * REFIT_GROWTH:
+        rebuild(conn)
+        return len(rows)
+    _release(conn, [cluster_id for _, _, cluster_id in rows if cluster_id is not None])
+
+    idf = np.frombuffer(state[1], dtype=np.float32)
+    clusters = conn.execute("SELECT id, members, centroid FROM defect_clusters ORDER BY id").fetchall()
+    ids = [cluster_id for cluster_id, _, _ in clusters]
+    members = [count for _, count, _ in clusters]
+    centroids = [np.frombuffer(blob, dtype=np.float32).copy() for _, _, blob in clusters]
+    labels = _assign(_tfidf(_counts(texts), idf), [1] * len(texts), centroids, members)
+    next_id = max(ids, default=0) + 1
+    ids += list(range(next_id, next_id + len(centroids) - len(ids)))
+    touched = set(labels.tolist())
+    conn.executemany('''
+    INSERT INTO defect_clusters (id, members, centroid) VALUES (?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET members = excluded.members, centroid = excluded.centroid
+    ''', [(ids[k], int(members[k]), centroids[k].astype(np.float32).tobytes()) for k in sorted(touched)])
+    _save_members(conn, rows, texts, [ids[k] for k in labels])
+    return len(rows)
+
+
+def assignments():
+    # 全部记录的类别id和类别名；统计按cluster_id分组，类别名(该类中出现最多的规范化描述)只用于显示
+    members = db.cached_read_sql("SELECT record_id, cluster_id, text FROM defect_cluster_members")
+    if members.empty:
+        members['cluster'] = []
+        return members
+    top = (members.groupby(['cluster_id', 'text']).size().rename('count').reset_index()
+           .sort_values(['cluster_id', 'count', 'text'], ascending=[True, False, True])
+           .drop_duplicates('cluster_id').set_index('cluster_id')['text'])
+    members['cluster'] = members['cluster_id'].map(top)
+    return members
+
+
+if __name__ == '__main__':
+    # 手动重新拟合(调整阈值或批量修正历史描述之后)
+    conn = db.connect()
+    with conn:
+        print(f"重新聚类完成: {rebuild(conn)} 个类别")
+    conn.close()
@@ -0,0 +1,70 @@
+import numpy as np
+
+# 画图前的降采样: 点数太多时只把有代表性的点发给浏览器，判异点始终保留
+# 只影响显示，控制限、判异和CPK都在降采样之前用完整数据计算
+
+MAX_POINTS = 2000  # 每条曲线最多显示的点数
+WEBGL_THRESHOLD = 1000  # 超过这个点数改用Scattergl(WebGL)绘制
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: 首尾点固定，中间每个桶选与前一选中点、下一桶均值构成三角形面积最大的点
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = y.size
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < edges.size:
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        selected[i + 1] = a
+    selected[-1] = size - 1
+    return selected
+
+
+def minmax(y, buckets):
+    # 每个桶保留最小和最大值的点，峰值不会被平均掉；整体向量化计算
+    y = np.asarray(y, dtype=float)
+    size = y.size
+    if buckets * 2 >= size or buckets < 1:
+        return np.arange(size)
+    width = -(-size // buckets)
+    padded = np.full(buckets * width, np.nan)
+    padded[:size] = y
+    blocks = padded.reshape(buckets, width)
+    valid = ~np.isnan(blocks).all(axis=1)
+    offsets = np.arange(buckets)[valid] * width
+    lows = np.nanargmin(blocks[valid], axis=1) + offsets
+    highs = np.nanargmax(blocks[valid], axis=1) + offsets
+    return np.unique(np.concatenate([[0, size - 1], lows, highs]))
+
+
+def select(y, max_points=MAX_POINTS, keep=None, method='lttb', x=None):
+    # 返回要显示的点的下标(升序)；keep为布尔数组，为真的点(如判异点)一定保留
+    y = np.asarray(y, dtype=float)
+    if y.size <= max_points:
+        return np.arange(y.size)
+    if method == 'minmax':
+        index = minmax(y, max_points // 2)
+    else:
+        index = lttb(np.arange(y.size) if x is None else x, y, max_points)
+    if keep is not None:
+        index = np.union1d(index, np.flatnonzero(keep))
+    return index
+
+
+def scatter_class(points):
+    # 点数多时用WebGL绘制
+    import plotly.graph_objects as go
+    return go.Scattergl if points > WEBGL_THRESHOLD else go.Scatter
@@ -1,21 +1,21 @@
 import streamlit as st
-import pandas as pd
-import sqlite3
-import os
 #import matplotlib.pyplot as plt  # Change this line
-from config import SPC_DATA, PN_TO_MODULE,SPC_Group,CONN
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from config import PN_TO_MODULE
+import db
+import spc_stats
+import spc_engine
+import downsample
+import spc_registry
 
-# 数据库连接
-conn = sqlite3.connect(CONN)
 if 'username' not in st.session_state or not st.session_state.username:
     st.warning("请先登录系统")
     st.stop()  # 停止执行后续代码
-# 获取有足够数据的PN列表
+# 获取有足够数据的PN列表(读子组统计表，不再扫描原始数据)
+pn_counts = db.cached_read_sql("SELECT pn, SUM(n) AS n FROM spc_subgroup_stats GROUP BY pn").set_index('pn')['n'].to_dict()
+registry = spc_registry.get()
 pn_options = []
-for pn in {config[5] for config in SPC_DATA.values()}:
-    count = conn.execute("SELECT COUNT(*) FROM measurement_data WHERE pn=?", (pn,)).fetchone()[0]
+for pn in registry.pns():
+    count = pn_counts.get(pn, 0)
     #st.write(f"PN: {pn}, Count: {count}")
     if count >= 50:
         module = PN_TO_MODULE.get(pn, "Unknown")
@@ -29,19 +29,19 @@ else:
     with col1:
         selected_pn = st.selectbox("选择PN", options=pn_options, format_func=lambda x: x[1])
     with col2:
-        params = [name for name, config in SPC_DATA.items() if config[5] == selected_pn[0]]
+        params = [parameter.name for parameter in registry.parameters(selected_pn[0])]
         selected_param = st.selectbox("选择参数", params)
 
     # 查询可用月份
     month_query = """
-    SELECT DISTINCT strftime('%Y-%m', measurement_date) as month 
-    FROM measurement_data 
+    SELECT month 
+    FROM spc_subgroup_stats 
     WHERE pn=? AND parameter_name=?
     GROUP BY month
-    HAVING COUNT(*) >= 50
+    HAVING SUM(n) >= 50
     ORDER BY month DESC
     """
-    available_months = pd.read_sql(month_query, conn, params=(selected_pn[0], selected_param))['month'].tolist()
+    available_months = db.cached_read_sql(month_query, params=(selected_pn[0], selected_param))['month'].tolist()
     
     if not available_months:
         st.error("选定的PN和参数没有包含足够数据的月份")
@@ -50,56 +50,77 @@ else:
         with col3:
             selected_month = st.selectbox("选择月份", available_months)
 
+        # 子组很多时只把有代表性的点发给浏览器(判异点始终保留)，CPK仍用完整数据
+        ds_col1, ds_col2 = st.columns(2)
+        with ds_col1:
+            use_downsample = st.checkbox(f"点数超过{downsample.MAX_POINTS}时降采样显示", value=True)
+        with ds_col2:
+            ds_method = st.radio("降采样方法", ['lttb', 'minmax'], horizontal=True,
+                                 format_func=lambda m: {'lttb': 'LTTB', 'minmax': 'Min-Max'}[m])
+
         if st.button("生成SPC图表"):
-            # 从数据库获取数据（添加月份条件）
-            query = """
-            SELECT DISTINCT sn, measurement_value 
-            FROM measurement_data 
-            WHERE pn=? AND parameter_name=? AND strftime('%Y-%m', measurement_date)=?
-            ORDER BY measurement_date
-            """
-            df = pd.read_sql(query, conn, params=(selected_pn[0], selected_param, selected_month))
-            conn.close()
-            if len(df) >= 50:
-                # 计算X-bar和R值
-                df['subgroup'] = (df.index // SPC_Group) + 1  # 5个数据为一组
-                xbar_r = df.groupby('subgroup').agg(
-                    xbar=('measurement_value', 'mean'),
-                    r=('measurement_value', lambda x: max(x) - min(x))
-                )
+            # 从子组统计表获取该月数据，每组SPC_Group个数据
+            xbar_r = spc_stats.load(selected_pn[0], selected_param, selected_month)
+            n_total, overall_mean, std_dev = spc_stats.overall(xbar_r)
+            # 控制限用A2·R̄(按子组极差估计的组内σ)，并按Nelson八条规则判异
+            limits, violations = spc_engine.evaluate_stats(xbar_r)
+            flagged = spc_engine.any_violation(violations)
+            if n_total >= 50:
+                # plotly只在生成图表时加载
+                from plotly.subplots import make_subplots
                 
                 # 创建Plotly图表
                 fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
                               subplot_titles=(f'X-bar Chart for {selected_pn[1]} - {selected_param}',
                                             f'R Chart for {selected_pn[1]} - {selected_param}'))
                 
+                # 降采样: X-bar保留判异点，R保留超出上限的点
+                x_all = xbar_r.index.to_numpy()
+                xbar_all = xbar_r['xbar'].to_numpy()
+                r_all = xbar_r['r'].to_numpy()
+                max_points = downsample.MAX_POINTS if use_downsample else len(x_all)
+                xi = downsample.select(xbar_all, max_points, keep=flagged, method=ds_method)
+                ri = downsample.select(r_all, max_points, keep=r_all > limits['r_ucl'], method=ds_method)
+                Scatter = downsample.scatter_class(max(len(xi), len(ri)))
+                
                 # X-bar图
-                overall_mean = df['measurement_value'].mean()
-                std_dev = df['measurement_value'].std()
-                ucl = overall_mean + 3 * std_dev
-                lcl = overall_mean - 3 * std_dev
+                center = limits['center']
+                ucl = limits['ucl']
+                lcl = limits['lcl']
                 
-                fig.add_trace(go.Scatter(
-                    x=xbar_r.index,
-                    y=xbar_r['xbar'],
+                fig.add_trace(Scatter(
+                    x=x_all[xi],
+                    y=xbar_all[xi],
                     mode='lines+markers',
                     name='X-bar',
                     line=dict(color='blue')
                 ), row=1, col=1)
                 
-                # 添加控制线
-                fig.add_hline(y=overall_mean, line=dict(color='red', dash='dash'),
-                             annotation_text=f'AVG: {overall_mean:.3f}', row=1, col=1)
-                fig.add_hline(y=ucl, line=dict(color='green', dash='dash'),
-                             annotation_text=f'UCL: {ucl:.3f}', row=1, col=1)
-                fig.add_hline(y=lcl, line=dict(color='green', dash='dash'),
-                             annotation_text=f'LCL: {lcl:.3f}', row=1, col=1)
+                # 添加控制线(月末不满一组的子组限值会放宽，所以按点画阶梯线)
+                fig.add_hline(y=center, line=dict(color='red', dash='dash'),
+                             annotation_text=f'AVG: {center:.3f}', row=1, col=1)
+                fig.add_trace(Scatter(x=x_all[xi], y=ucl[xi], mode='lines', name=f'UCL: {ucl[0]:.3f}',
+                                      line=dict(color='green', dash='dash', shape='hvh')), row=1, col=1)
+                fig.add_trace(Scatter(x=x_all[xi], y=lcl[xi], mode='lines', name=f'LCL: {lcl[0]:.3f}',
+                                      line=dict(color='green', dash='dash', shape='hvh')), row=1, col=1)
+                
+                # 标出违反判异规则的点
+                labels = spc_engine.violation_labels(violations)
+                fig.add_trace(Scatter(
+                    x=x_all[flagged],
+                    y=xbar_all[flagged],
+                    mode='markers',
+                    name='判异',
+                    marker=dict(color='red', size=10, symbol='circle-open', line=dict(width=2)),
+                    text=[f"规则 {labels[i]}" for i in flagged.nonzero()[0]],
+                    hovertemplate='%{text}<extra></extra>'
+                ), row=1, col=1)
                 
                 # R图
-                r_mean = xbar_r['r'].mean()
-                fig.add_trace(go.Scatter(
-                    x=xbar_r.index,
-                    y=xbar_r['r'],
+                r_mean = float(limits['r_center'][0])
+                fig.add_trace(Scatter(
+                    x=x_all[ri],
+                    y=r_all[ri],
                     mode='lines+markers',
                     name='R',
                     line=dict(color='green')
@@ -107,6 +128,9 @@ else:
                 
                 fig.add_hline(y=r_mean, line=dict(color='red', dash='dash'),
                              annotation_text=f'AVG: {r_mean:.3f}', row=2, col=1)
+                fig.add_trace(Scatter(x=x_all[ri], y=limits['r_ucl'][ri], mode='lines',
+                                      name=f"R UCL: {limits['r_ucl'][0]:.3f}",
+                                      line=dict(color='orange', dash='dash', shape='hvh')), row=2, col=1)
                 
                 # 更新布局
                 fig.update_layout(
@@ -120,35 +144,75 @@ else:
                 fig.update_yaxes(title_text="R VALUE", row=2, col=1)
                 
                 st.plotly_chart(fig, use_container_width=True)
+                if len(xi) < len(x_all) or len(ri) < len(x_all):
+                    shown = len(xi) + len(ri)
+                    st.caption(f"降采样({ds_method}): 显示 {shown} / {2 * len(x_all)} 个点，"
+                               f"压缩 {2 * len(x_all) / shown:.1f} 倍；控制限、判异和CPK均按全部数据计算")
                 
-                # 计算并显示CPK
-                param_config = next((v for k, v in SPC_DATA.items() 
-                                   if k == selected_param and v[5] == selected_pn[0]), None)
-                if param_config:
-                    lsl = param_config[3]  # 第4位是LSL
-                    usl = param_config[4]  # 第5位是USL
-                    
-                    if usl is not None and lsl is not None:
-                        sigma = df['measurement_value'].std()
-                        mean = df['measurement_value'].mean()
-                        cpu = (usl - mean) / (3 * sigma) if sigma != 0 else float('nan')
-                        cpl = (mean - lsl) / (3 * sigma) if sigma != 0 else float('nan')
-                        cpk = min(cpu, cpl)
-                        
-                        st.markdown(f"""
-                        **CPK计算结果**  
-                        - 参数: {selected_param}  
-                        - PN: {selected_pn[0]}  
-                        - 平均值: {mean:.4f}  
-                        - 标准差: {sigma:.4f}  
-                        - USL: {usl:.4f}  
-                        - LSL: {lsl:.4f}  
-                        - CPK: {cpk:.4f}  
-                        """)
-                    else:
-                        st.warning("该参数未设置规格上下限，无法计算CPK")
+                # 判异汇总
+                counts = {rule: int(mask.sum()) for rule, mask in violations.items() if mask.any()}
+                if counts:
+                    st.warning("判异: " + "；".join(f"规则{rule} {spc_engine.RULES[rule]} ×{count}"
+                                                    for rule, count in counts.items()))
                 else:
+                    st.success("未发现违反Nelson判异规则的点")
+                
+                # 计算并显示CPK: 按测量当天生效的规格限分段，月内规格限未变更时只有一段
+                if registry.parameter(selected_pn[0], selected_param) is None:
                     st.warning(f"未找到参数 {selected_param} 和 PN {selected_pn[0]} 的配置")
+                else:
+                    daily = spc_stats.daily_summary(selected_pn[0], selected_param, selected_month)
+                    daily['limits'] = [registry.limits_at(selected_pn[0], selected_param, date)
+                                       for date in daily['measurement_date']]
+                    # 按连续的天分段: 规格限A→B→A时两段A分开计算，每段的起止日期内只有该版本的数据
+                    runs = (daily['limits'] != daily['limits'].shift()).cumsum()
+                    segments = [(segment['limits'].iloc[0], segment) for _, segment in daily.groupby(runs)]
+                    if len(segments) > 1:
+                        st.info("本月规格限有变更，CPK按各版本生效期间的数据分别计算")
+                    for (lsl, usl), segment in segments:
+                        if usl is not None and lsl is not None:
+                            n, mean, sigma = spc_stats.overall(segment)
+                            cpu = (usl - mean) / (3 * sigma) if sigma != 0 else float('nan')
+                            cpl = (mean - lsl) / (3 * sigma) if sigma != 0 else float('nan')
+                            cpk = min(cpu, cpl)
+                            
+                            st.markdown(f"""
+                            **CPK计算结果**  
+                            - 参数: {selected_param}  
+                            - PN: {selected_pn[0]}  
+                            - 日期: {segment['measurement_date'].iloc[0]} ~ {segment['measurement_date'].iloc[-1]} ({n} 个数据)  
+                            - 平均值: {mean:.4f}  
+                            - 标准差: {sigma:.4f}  
+                            - USL: {usl:.4f}  
+                            - LSL: {lsl:.4f}  
+                            - CPK: {cpk:.4f}  
+                            """)
+                            
+                            # 正态性检验；不服从正态时给出Box-Cox变换和百分位法的结果
+                            result = spc_stats.nonnormal_capability(
+                                selected_pn[0], selected_param, selected_month,
+                                segment['measurement_date'].iloc[0], segment['measurement_date'].iloc[-1],
+                                lsl, usl)
+                            method_names = {'normal': '正态', 'boxcox': 'Box-Cox变换', 'percentile': '百分位法'}
+                            with st.expander(f"正态性检验 / 非正态能力 (建议: {method_names[result['method']]})",
+                                             expanded=result['method'] != 'normal'):
+                                m1, m2, m3, m4 = st.columns(4)
+                                m1.metric("AD统计量", f"{result['ad']:.3f}")
+                                m2.metric("p值", f"{result['p']:.4f}")
+                                m3.metric("偏度", f"{result['skewness']:.3f}")
+                                m4.metric("正态Ppk", f"{result['normal_ppk']:.4f}")
+                                m1, m2, m3, m4 = st.columns(4)
+                                m1.metric("Box-Cox λ", f"{result['boxcox_lambda']:.3f}")
+                                m2.metric("变换后p值", f"{result['boxcox_p']:.4f}")
+                                m3.metric("Box-Cox Ppk", f"{result['boxcox_ppk']:.4f}")
+                                m4.metric("百分位法Ppk", f"{result['percentile_ppk']:.4f}")
+                                if result['boxcox_shift']:
+                                    st.caption(f"数据含0或负值，Box-Cox前整体平移 {result['boxcox_shift']:.4g}")
+                                if result['method'] != 'normal':
+                                    st.warning(f"数据不服从正态分布(Anderson-Darling p < {spc_engine.NORMAL_ALPHA})，"
+                                               f"正态CPK可能失真，建议采用{method_names[result['method']]}的结果")
+                        else:
+                            st.warning("该参数未设置规格上下限，无法计算CPK")
 
             else:
                 st.error(f"选定的参数在{selected_month}没有足够的数据点(需要至少50个)")
@@ -0,0 +1,368 @@
+import os
+import re
+import csv
+import time
+import hashlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from config import SPC_PN
+import db
+import spc_stats
+import alerts
+import spc_registry
+
+UPLOAD_DIR = 'uploads'
+ERROR_FILE = os.path.join(UPLOAD_DIR, 'error_log.csv')
+CHUNK_SIZE = 5000  # 流式读取时每块行数
+
+# 自然键(pn, parameter_name, sn, measurement_date)重复时更新测量值
+# row_version: 新增或值有变化的行都记上本次写入的版本号，按id增量读取会漏掉原地更新的行，
+# 报警检查和实时控制图改按row_version读取变化；值没变的重复行保持原版本号
+INSERT_SQL = '''
+INSERT INTO measurement_data
+(parameter_name, pn, sn, measurement_value, measurement_date, lower_limit, upper_limit, row_version)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(pn, parameter_name, sn, measurement_date) DO UPDATE SET
+    measurement_value = excluded.measurement_value,
+    lower_limit = excluded.lower_limit,
+    upper_limit = excluded.upper_limit,
+    row_version = excluded.row_version
+WHERE measurement_value IS NOT excluded.measurement_value
+   OR lower_limit IS NOT excluded.lower_limit
+   OR upper_limit IS NOT excluded.upper_limit
+'''
+
+
+def next_row_version(conn):
+    # 在写事务里取号(UPDATE先拿到写锁)，并发的导入进程不会拿到相同的版本号
+    conn.execute("UPDATE row_sequences SET value = value + 1 WHERE name = 'measurement_data'")
+    return conn.execute("SELECT value FROM row_sequences WHERE name = 'measurement_data'").fetchone()[0]
+
+
+def list_excel_files(folder=UPLOAD_DIR):
+    # 跳过Excel打开时生成的~$临时文件
+    return [f for f in os.listdir(folder)
+            if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$')]
+
+
+def file_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_imported(conn, digest):
+    return conn.execute("SELECT 1 FROM import_ledger WHERE file_hash = ?", (digest,)).fetchone() is not None
+
+
+def get_status(conn):
+    row = conn.execute('''
+    SELECT pid, mode, state, heartbeat, last_file, last_error, files_total, records_total
+    FROM ingest_status WHERE id = 1
+    ''').fetchone()
+    if row is None:
+        return None
+    keys = ['pid', 'mode', 'state', 'heartbeat', 'last_file', 'last_error', 'files_total', 'records_total']
+    return dict(zip(keys, row))
+
+
+def spc_columns(registry=None):
+    # 导入只需要的列: PN单元格所在列 + 各参数的SN列和值列(0-based)
+    registry = registry or spc_registry.get()
+    columns = {SPC_PN[1] - 1}
+    for parameter in registry.parameters():
+        columns.update((parameter.sn_col - 1, parameter.value_col - 1))
+    return sorted(columns)
+
+
+def iter_excel_chunks(filepath, columns, chunk_size=CHUNK_SIZE):
+    # 以只读流方式逐行读取，只保留需要的列，每chunk_size行产出一个DataFrame
+    # 行号与pd.read_excel(filepath)一致: 第1行为表头，DataFrame第0行对应Excel第2行
+    if filepath.endswith('.xls'):
+        # xls不支持openpyxl，仍整表读取
+        df = pd.read_excel(filepath)
+        ncols = len(df.columns)
+        df.columns = range(ncols)
+        yield df[[c for c in columns if c < ncols]], ncols
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ncols = ws.max_column or (max(columns) + 1)
+        buffer = []
+        start = 0
+        blank_run = 0  # 连续空行先不入缓冲，末尾的空行与pandas一样丢弃
+        for row in ws.iter_rows(min_row=2, max_col=max(columns) + 1, values_only=True):
+            values = [row[c] if c < len(row) else None for c in columns]
+            if all(v is None for v in values):
+                blank_run += 1
+                continue
+            if blank_run:
+                buffer.extend([[None] * len(columns)] * blank_run)
+                blank_run = 0
+            buffer.append(values)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=columns,
+                                   index=range(start, start + len(buffer))), ncols
+                start += len(buffer)
+                buffer = []
+        if buffer or start == 0:
+            yield pd.DataFrame(buffer, columns=columns,
+                               index=range(start, start + len(buffer))), ncols
+    finally:
+        wb.close()
+
+
+def detect_pn(df, filename):
+    # 先读SPC_PN单元格，为空时再从文件名提取
+    pn = "Unknown"
+    try:
+        cell_value = df.at[SPC_PN[0] - 1, SPC_PN[1] - 1]
+        if pd.notna(cell_value):
+            pn = str(cell_value).strip()
+    except KeyError:
+        pass
+
+    if pn == "Unknown":
+        filename_pn = re.search(r'(\d{5}-\d{4}-\d{3})', filename)
+        pn = filename_pn.group(1) if filename_pn else "Unknown"
+    return pn
+
+
+def extract_measurements(df, pn, filename, ncols=None, registry=None, current_date=None):
+    # 每个参数只切一次SN列和值列，用pandas整体转换和校验
+    # df的列标签为0-based列号，索引为DataFrame行号(可以是分块后的一段)
+    # 规格限取导入日期(即measurement_date)当天生效的版本
+    if ncols is None:
+        ncols = len(df.columns)
+    registry = registry or spc_registry.get()
+    current_date = current_date or datetime.now().strftime('%Y-%m-%d')
+    batches = []
+    errors = []
+    for parameter in registry.parameters(pn):
+        param_name = parameter.name
+        sn_col = parameter.sn_col - 1
+        value_col = parameter.value_col - 1
+        start_row = parameter.start_row - 1
+
+        if sn_col >= ncols or value_col >= ncols:
+            errors.append((filename, f"参数{param_name}: 列索引超出范围: SN列{parameter.sn_col}, 值列{parameter.value_col}"))
+            continue
+
+        block = df.loc[df.index >= start_row, [sn_col, value_col]]
+        if block.empty:
+            continue
+
+        raw_values = block[value_col]
+        values = pd.to_numeric(raw_values, errors='coerce').to_numpy(dtype=float)
+        raw_sns = block[sn_col]
+        sns = raw_sns.astype(str).to_numpy()
+
+        # SN为空的行先剔除并记错误，否则astype(str)后都变成'nan'/'None'，在唯一键上互相覆盖
+        has_sn = (raw_sns.notna() & (raw_sns.astype(str).str.strip() != '')).to_numpy()
+        blank_rows = np.flatnonzero(~has_sn)
+        if blank_rows.size:
+            line_no = block.index.to_numpy()[blank_rows] + 1
+            errors.extend((filename, f"行{n}: SN为空 ({param_name})") for n in line_no.tolist())
+
+        valid = np.isfinite(values) & has_sn
+        bad_rows = np.flatnonzero(~np.isfinite(values) & has_sn)
+        if bad_rows.size:
+            line_no = block.index.to_numpy()[bad_rows] + 1
+            bad_raw = raw_values.to_numpy()[bad_rows]
+            errors.extend(
+                (filename, f"行{n}: 无效数值 {v!r} ({param_name})")
+                for n, v in zip(line_no.tolist(), bad_raw.tolist())
+            )
+
+        if valid.any():
+            lower, upper = registry.limits_at(pn, param_name, current_date)
+            batches.append({'param': param_name, 'lower': lower, 'upper': upper,
+                            'sn': sns[valid], 'value': values[valid]})
+    return batches, errors
+
+
+def merge_batches(batches):
+    # 把分块提取的结果按参数合并
+    merged = {}
+    for batch in batches:
+        if batch['param'] in merged:
+            target = merged[batch['param']]
+            target['sn'] = np.concatenate([target['sn'], batch['sn']])
+            target['value'] = np.concatenate([target['value'], batch['value']])
+        else:
+            merged[batch['param']] = dict(batch)
+    return list(merged.values())
+
+
+def iter_rows(pn, current_date, batch, row_version):
+    for sn, value in zip(batch['sn'].tolist(), batch['value'].tolist()):
+        yield batch['param'], pn, sn, value, current_date, batch['lower'], batch['upper'], row_version
+
+
+def count_month(conn, pn, parameter_name, month):
+    return conn.execute('''
+    SELECT COUNT(*) FROM measurement_data
+    WHERE pn = ? AND parameter_name = ? AND measurement_month = ?
+    ''', (pn, parameter_name, month)).fetchone()[0]
+
+
+def write_measurements(conn, pn, current_date, batches, digest=None, filename=None):
+    # 一个文件一个事务，每个参数一次executemany写入，同一事务内更新子组统计并登记文件哈希
+    month = current_date[:7]
+    records = sum(len(batch['value']) for batch in batches)
+    with conn:
+        row_version = next_row_version(conn)
+        for batch in batches:
+            before = count_month(conn, pn, batch['param'], month)
+            conn.executemany(INSERT_SQL, iter_rows(pn, current_date, batch, row_version))
+            inserted = count_month(conn, pn, batch['param'], month) - before
+            if inserted == len(batch['value']):
+                spc_stats.append(conn, pn, batch['param'], month, batch['value'])
+            else:
+                # 有记录按自然键覆盖了旧值，该月子组需要重算
+                spc_stats.rebuild(conn, pn, batch['param'], month)
+        if digest is not None:
+            conn.execute('''
+            INSERT INTO import_ledger (file_hash, filename, pn, records, imported_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (digest, filename, pn, records, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return records
+
+
+def write_error_log(errors, error_file=ERROR_FILE):
+    if not errors:
+        return
+    file_exists = os.path.isfile(error_file)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with open(error_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if not file_exists:
+            writer.writerow(['Timestamp', 'Filename', 'Error'])
+        writer.writerows([timestamp, err_filename, err_detail] for err_filename, err_detail in errors)
+
+
+def new_result(filename, current_date, digest=None):
+    return {'filename': filename, 'hash': digest, 'pn': "Unknown", 'date': current_date,
+            'batches': [], 'records': 0, 'params': [], 'duplicate': False,
+            'errors': [], 'seconds': 0.0, 'rows_per_sec': 0.0}
+
+
+def parse_file(filename, current_date, folder=UPLOAD_DIR, digest=None, registry=None):
+    # 只做解析和参数提取，不碰数据库(参数注册表由父进程传入)，可在子进程中运行
+    start = time.perf_counter()
+    result = new_result(filename, current_date, digest)
+    try:
+        registry = registry or spc_registry.get()
+        pn = None
+        batches = []
+        seen = set()  # 列超出范围的错误每个分块都会报一次，只保留第一次；用集合判重，错误很多时也是线性的
+        for chunk, ncols in iter_excel_chunks(os.path.join(folder, filename), spc_columns(registry)):
+            if pn is None:
+                pn = detect_pn(chunk, filename)
+            chunk_batches, errors = extract_measurements(chunk, pn, filename, ncols, registry, current_date)
+            batches.extend(chunk_batches)
+            for error in errors:
+                if error not in seen:
+                    seen.add(error)
+                    result['errors'].append(error)
+        result['pn'] = pn or "Unknown"
+        result['batches'] = merge_batches(batches)
+        result['params'] = [batch['param'] for batch in result['batches']]
+    except Exception as e:
+        result['errors'].append((filename, str(e)))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def move_to_success(filename, folder=UPLOAD_DIR):
+    success_dir = os.path.join(folder, 'success')
+    os.makedirs(success_dir, exist_ok=True)
+    os.replace(os.path.join(folder, filename), os.path.join(success_dir, filename))
+
+
+def commit_file(conn, result, folder=UPLOAD_DIR):
+    # 写入数据库后再把文件原子地移动到uploads/success
+    start = time.perf_counter()
+    filename = result['filename']
+    batches = result.pop('batches', [])
+    try:
+        if result['hash'] is not None and is_imported(conn, result['hash']):
+            # 同一批里内容相同的文件，前一个已经提交
+            result['duplicate'] = True
+            move_to_success(filename, folder)
+        elif batches:
+            result['records'] = write_measurements(conn, result['pn'], result['date'], batches,
+                                                   result['hash'], filename)
+            db.invalidate('measurement_data', 'spc_subgroup_stats', 'import_ledger')
+            move_to_success(filename, folder)
+            # 检查新数据是否超规格或违反判异规则
+            alerts.check_measurements(conn)
+    except Exception as e:
+        result['errors'].append((filename, str(e)))
+    result['seconds'] += time.perf_counter() - start
+    if result['seconds'] > 0:
+        result['rows_per_sec'] = result['records'] / result['seconds']
+    return result
+
+
+def check_duplicate(conn, filename, current_date, folder=UPLOAD_DIR):
+    # 按内容哈希查登记表，已导入过的文件不再解析
+    result = new_result(filename, current_date)
+    try:
+        result['hash'] = file_hash(os.path.join(folder, filename))
+        if is_imported(conn, result['hash']):
+            result['duplicate'] = True
+            move_to_success(filename, folder)
+    except Exception as e:
+        result['errors'].append((filename, str(e)))
+    return result
+
+
+def process_file(conn, filename, current_date, folder=UPLOAD_DIR):
+    checked = check_duplicate(conn, filename, current_date, folder)
+    if checked['duplicate'] or checked['errors']:
+        return checked
+    return commit_file(conn, parse_file(filename, current_date, folder, checked['hash'], spc_registry.get(conn)),
+                       folder)
+
+
+def process_files(conn, filenames, current_date, folder=UPLOAD_DIR, max_workers=None):
+    # 多个文件时用进程池并行解析，当前进程作为唯一写入者按完成顺序提交
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(filenames))
+    if max_workers <= 1:
+        for filename in filenames:
+            yield process_file(conn, filename, current_date, folder)
+        return
+
+    pending = []
+    for filename in filenames:
+        checked = check_duplicate(conn, filename, current_date, folder)
+        if checked['duplicate'] or checked['errors']:
+            yield checked
+        else:
+            pending.append(checked)
+    if not pending:
+        return
+
+    registry = spc_registry.get(conn)
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+        futures = {pool.submit(parse_file, checked['filename'], current_date, folder, checked['hash'], registry): checked
+                   for checked in pending}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = futures[future]
+                result['errors'].append((result['filename'], str(e)))
+            yield commit_file(conn, result, folder)
@@ -0,0 +1,134 @@
+# 后台SPC导入服务: 监视uploads/，把新的T&A文件持续写入measurement_data
+# 用法: python ingest_service.py [--interval 5] [--settle 3]
+import os
+import time
+import signal
+import argparse
+import threading
+from datetime import datetime
+
+import db
+import ingest
+import migrations
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 没有watchdog时退回轮询
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _WakeHandler(FileSystemEventHandler):
+    def __init__(self, wake):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            self.wake.set()
+
+
+def update_status(conn, **fields):
+    fields['heartbeat'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = ', '.join(f"{k} = ?" for k in fields)
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO ingest_status (id) VALUES (1)")
+        conn.execute(f"UPDATE ingest_status SET {columns} WHERE id = 1", list(fields.values()))
+
+
+def stable_files(folder, seen, failed, settle):
+    # 文件大小和修改时间在settle秒内不再变化才认为写完；导入失败的文件内容不变就不再重试
+    now = time.time()
+    ready = []
+    current = set()
+    for filename in ingest.list_excel_files(folder):
+        current.add(filename)
+        try:
+            stat = os.stat(os.path.join(folder, filename))
+        except FileNotFoundError:
+            continue
+        signature = (stat.st_size, stat.st_mtime)
+        if failed.get(filename) == signature:
+            continue
+        previous = seen.get(filename)
+        if previous is None or previous[0] != signature:
+            seen[filename] = (signature, now)
+        elif now - previous[1] >= settle and now - stat.st_mtime >= settle:
+            ready.append(filename)
+    for filename in set(seen) - current:
+        del seen[filename]
+    for filename in set(failed) - current:
+        del failed[filename]
+    return ready
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(folder=ingest.UPLOAD_DIR, interval=5.0, settle=3.0):
+    conn = db.connect()
+    migrations.migrate(conn)
+
+    wake = threading.Event()
+    observer = None
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(_WakeHandler(wake), folder, recursive=False)
+        observer.start()
+    mode = 'inotify' if observer is not None else 'polling'
+    update_status(conn, pid=os.getpid(), mode=mode, state='idle', last_error=None)
+    print(f"监视 {folder} ({mode})")
+
+    seen = {}
+    failed = {}
+    files_total = conn.execute("SELECT files_total FROM ingest_status WHERE id = 1").fetchone()[0] or 0
+    records_total = conn.execute("SELECT records_total FROM ingest_status WHERE id = 1").fetchone()[0] or 0
+    try:
+        while True:
+            ready = stable_files(folder, seen, failed, settle)
+            if ready:
+                update_status(conn, state='importing')
+                current_date = datetime.now().strftime('%Y-%m-%d')
+                errors = []
+                for result in ingest.process_files(conn, ready, current_date, folder):
+                    errors.extend(result['errors'])
+                    signature = seen.pop(result['filename'], (None,))[0]
+                    if os.path.exists(os.path.join(folder, result['filename'])):
+                        failed[result['filename']] = signature
+                    files_total += 1
+                    records_total += result['records']
+                    if result['duplicate']:
+                        print(f"{result['filename']}: 内容已导入过，跳过")
+                    else:
+                        print(f"{result['filename']}: {result['records']} 条 "
+                              f"({result['rows_per_sec']:.0f} 行/秒), 错误 {len(result['errors'])}")
+                    update_status(conn, state='importing', last_file=result['filename'],
+                                  files_total=files_total, records_total=records_total)
+                ingest.write_error_log(errors)
+                update_status(conn, state='idle',
+                              last_error=f"{errors[-1][0]}: {errors[-1][1]}" if errors else None)
+            else:
+                update_status(conn, state='idle')
+
+            # 有文件在等待稳定时按settle间隔复查，否则等待事件或轮询间隔
+            wake.wait(settle if seen else interval)
+            wake.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        update_status(conn, state='stopped')
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SPC watch-folder ingestion service")
+    parser.add_argument('--folder', default=ingest.UPLOAD_DIR)
+    parser.add_argument('--interval', type=float, default=5.0, help="轮询/心跳间隔(秒)")
+    parser.add_argument('--settle', type=float, default=3.0, help="文件稳定多少秒后才导入")
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, _stop)
+    run(args.folder, args.interval, args.settle)
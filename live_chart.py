@@ -0,0 +1,85 @@
+import streamlit as st
+from config import PN_TO_MODULE
+import spc_engine
+import spc_registry
+import spc_live
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("实时SPC控制图")
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    registry = spc_registry.get()
+    pns = registry.pns()
+    selected_pn = st.selectbox("选择PN", pns, format_func=lambda pn: f"{pn} ({PN_TO_MODULE.get(pn, 'Unknown')})")
+with col2:
+    params = [parameter.name for parameter in registry.parameters(selected_pn)]
+    selected_param = st.selectbox("选择参数", params)
+with col3:
+    window = st.number_input("显示最近子组数", min_value=10, max_value=500, value=50, step=10)
+with col4:
+    interval = st.number_input("刷新间隔(秒)", min_value=5, max_value=300, value=15, step=5)
+
+# 每个会话为当前选择保留一个序列，切换选择或点击重置时重新读取
+key = (selected_pn, selected_param, int(window))
+if st.session_state.get('live_key') != key or st.button("重置控制限"):
+    st.session_state.live_key = key
+    st.session_state.live_series = spc_live.LiveSeries(selected_pn, selected_param, int(window))
+
+
+@st.fragment(run_every=int(interval))
+def live_chart():
+    series = st.session_state.live_series
+    new_rows = series.poll()
+    data = series.frame()
+    limits = data['limits']
+    if not data['subgroup']:
+        st.info("该参数还没有测量数据")
+        return
+
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    flagged = spc_engine.any_violation(data['violations'])
+    labels = spc_engine.violation_labels(data['violations'])
+    x = data['subgroup']
+
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
+                        subplot_titles=(f'X-bar - {selected_param}', 'R'))
+    fig.add_trace(go.Scatter(x=x, y=data['xbar'], mode='lines+markers', name='X-bar',
+                             text=data['date'], line=dict(color='blue')), row=1, col=1)
+    fig.add_hline(y=limits['center'], line=dict(color='red', dash='dash'),
+                  annotation_text=f"AVG: {limits['center']:.3f}", row=1, col=1)
+    fig.add_trace(go.Scatter(x=x, y=data['ucl'], mode='lines', name='UCL',
+                             line=dict(color='green', dash='dash', shape='hvh')), row=1, col=1)
+    fig.add_trace(go.Scatter(x=x, y=data['lcl'], mode='lines', name='LCL',
+                             line=dict(color='green', dash='dash', shape='hvh')), row=1, col=1)
+    fig.add_trace(go.Scatter(
+        x=[x[i] for i in flagged.nonzero()[0]],
+        y=data['xbar'][flagged],
+        mode='markers', name='判异',
+        marker=dict(color='red', size=10, symbol='circle-open', line=dict(width=2)),
+        text=[f"规则 {labels[i]}" for i in flagged.nonzero()[0]],
+        hovertemplate='%{text}<extra></extra>'
+    ), row=1, col=1)
+    fig.add_trace(go.Scatter(x=x, y=data['r'], mode='lines+markers', name='R',
+                             line=dict(color='green')), row=2, col=1)
+    if limits['r_bar'] == limits['r_bar']:
+        fig.add_hline(y=limits['r_bar'], line=dict(color='red', dash='dash'),
+                      annotation_text=f"R̄: {limits['r_bar']:.3f}", row=2, col=1)
+    fig.update_layout(height=700, showlegend=True, hovermode='x unified')
+    st.plotly_chart(fig, use_container_width=True)
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("累计数据", limits['n'], delta=new_rows or None)
+    c2.metric("组内σ (R̄/d2)", f"{limits['sigma']:.5f}")
+    c3.metric("整体σ", f"{limits['sigma_overall']:.5f}")
+    c4.metric("最新数据", data['date'][-1])
+    if flagged[-1]:
+        st.error(f"最新子组违反判异规则 {labels[-1]}")
+
+
+live_chart()
@@ -1,20 +1,19 @@
 import streamlit as st
-import pandas as pd
-import sqlite3
 import os
 from datetime import datetime
-from config import CONN, PN_TO_MODULE
+import db
+import alerts
+import week_calendar
+import yield_rollup
+import defect_clusters
 
-# 数据库连接
-conn = sqlite3.connect(CONN)
 if 'username' not in st.session_state or not st.session_state.username:
     st.warning("请先登录系统")
     st.stop()
     
 # 获取产品和工站列表
-with sqlite3.connect(CONN) as conn:
-    products = pd.read_sql("SELECT id, pn, module_name FROM Products", conn)
-    stations = pd.read_sql("SELECT id, name FROM Stations", conn)
+products = db.cached_read_sql("SELECT id, pn, module_name FROM Products")
+stations = db.cached_read_sql("SELECT id, name FROM Stations")
 
 # 创建查询界面
 st.subheader("通过ID查询和修改良率数据")
@@ -31,7 +30,7 @@ if st.button("查询记录"):
     LEFT JOIN Stations s ON y.station_id = s.id
     WHERE y.id = ?
     """
-    record = pd.read_sql(query, conn, params=(record_id,))
+    record = db.cached_read_sql(query, params=(record_id,))
     
     if not record.empty:
         st.session_state.current_record = record.iloc[0].to_dict()
@@ -73,45 +72,54 @@ if 'current_record' in st.session_state:
         
         # 提交修改
         if st.form_submit_button("保存修改"):
-            # 处理文件上传
-            picture_path = record['picture']
-            if new_picture:
-                os.makedirs("uploads/productionyield", exist_ok=True)
-                picture_path = f"uploads/productionyield/{record_id}_{new_picture.name}"
-                with open(picture_path, "wb") as f:
-                    f.write(new_picture.getbuffer())
+            if week_calendar.week_key(date_code) is None:
+                st.error("日期代码格式不正确，应为YYWW(如2514)或YYMMWww(如2504W14)")
+            else:
+                # 处理文件上传
+                picture_path = record['picture']
+                if new_picture:
+                    os.makedirs("uploads/productionyield", exist_ok=True)
+                    picture_path = f"uploads/productionyield/{record_id}_{new_picture.name}"
+                    with open(picture_path, "wb") as f:
+                        f.write(new_picture.getbuffer())
             
-            attachment_path = record['attachment']
-            if new_attachment:
-                os.makedirs("uploads/productionyield", exist_ok=True)
-                attachment_path = f"uploads/productionyield/{record_id}_{new_attachment.name}"
-                with open(attachment_path, "wb") as f:
-                    f.write(new_attachment.getbuffer())
+                attachment_path = record['attachment']
+                if new_attachment:
+                    os.makedirs("uploads/productionyield", exist_ok=True)
+                    attachment_path = f"uploads/productionyield/{record_id}_{new_attachment.name}"
+                    with open(attachment_path, "wb") as f:
+                        f.write(new_attachment.getbuffer())
             
-            # 获取产品和工站ID
-            product_pn = product_choice.split(" - ")[0]
-            station_name = station_choice
+                # 获取产品和工站ID
+                product_pn = product_choice.split(" - ")[0]
+                station_name = station_choice
             
-            with sqlite3.connect(CONN) as conn:
-                conn.execute("""
-                UPDATE YieldData SET
-                    product_id = (SELECT id FROM Products WHERE pn = ?),
-                    station_id = (SELECT id FROM Stations WHERE name = ?),
-                    date_code = ?,
-                    good_count = ?,
-                    bad_count = ?,
-                    defect_description = ?,
-                    improvement_measures = ?,
-                    picture = ?,
-                    attachment = ?
-                WHERE id = ?
-                """, (
-                    product_pn, station_name,
-                    date_code, good_count, bad_count,
-                    defect_description, improvement_measures,
-                    picture_path, attachment_path,
-                    record_id
-                ))
-                conn.commit()
-            st.success("记录已更新!")
-            st.rerun()
+                with db.connection() as conn:
+                    old_keys = alerts.yield_keys(conn, [record_id])
+                    conn.execute("""
+                    UPDATE YieldData SET
+                        product_id = (SELECT id FROM Products WHERE pn = ?),
+                        station_id = (SELECT id FROM Stations WHERE name = ?),
+                        date_code = ?,
+                        good_count = ?,
+                        bad_count = ?,
+                        defect_description = ?,
+                        improvement_measures = ?,
+                        picture = ?,
+                        attachment = ?
+                    WHERE id = ?
+                    """, (
+                        product_pn, station_name,
+                        date_code, good_count, bad_count,
+                        defect_description, improvement_measures,
+                        picture_path, attachment_path,
+                        record_id
+                    ))
+                    week_calendar.normalize(conn, [record_id])
+                    yield_rollup.refresh(conn)
+                    defect_clusters.update(conn)
+                    conn.commit()
+                    db.invalidate("YieldData", *yield_rollup.TABLES, *defect_clusters.TABLES)
+                    alerts.check_yield(conn, [record_id], old_keys)
+                st.success("记录已更新!")
+                st.rerun()
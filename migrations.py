@@ -0,0 +1,511 @@
+from config import SPC_DATA, SPC_SHIFT
+import db
+import spc_stats
+import spc_registry
+import week_calendar
+import yield_rollup
+import defect_clusters
+
+# 数据库结构版本管理: 版本号记录在PRAGMA user_version，启动时按顺序执行未执行过的迁移
+
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _baseline(conn):
+    # 原来分散在各页面里的建表语句
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER,
+        username TEXT,
+        password TEXT,
+        rights TEXT,
+        remark TEXT
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS measurement_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parameter_name TEXT,
+        pn TEXT,
+        sn TEXT,
+        measurement_value REAL,
+        measurement_date TEXT,
+        lower_limit REAL,
+        upper_limit REAL
+    )''')
+
+    # 已导入的文件按内容哈希登记，重复文件直接跳过
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS import_ledger (
+        file_hash TEXT PRIMARY KEY,
+        filename TEXT,
+        pn TEXT,
+        records INTEGER,
+        imported_at TEXT
+    )''')
+
+    # 后台导入服务的状态，只有一行(id=1)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_status (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        pid INTEGER,
+        mode TEXT,
+        state TEXT,
+        heartbeat TEXT,
+        last_file TEXT,
+        last_error TEXT,
+        files_total INTEGER DEFAULT 0,
+        records_total INTEGER DEFAULT 0
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Stations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        description TEXT,
+        create_date DATE NOT NULL
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pn TEXT NOT NULL UNIQUE,
+        module_name TEXT NOT NULL,
+        description TEXT,
+        create_date DATE NOT NULL
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS YieldData (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        station_id INTEGER NOT NULL,
+        date_code TEXT NOT NULL,
+        good_count INTEGER NOT NULL,
+        bad_count INTEGER NOT NULL,
+        defect_description TEXT,
+        improvement_measures TEXT,
+        create_date DATE NOT NULL,
+        production_count INTEGER,
+        picture TEXT,
+        attachment TEXT,
+        pn TEXT,
+        station TEXT,
+        FOREIGN KEY(product_id) REFERENCES Products(id),
+        FOREIGN KEY(station_id) REFERENCES Stations(id)
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        No TEXT NOT NULL,
+        customer TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        description TEXT NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE,
+        status TEXT CHECK(status IN ('open', 'closed')) NOT NULL,
+        NG_Picture TEXT,
+        Good_Picture TEXT,
+        report_file TEXT,
+        username TEXT NOT NULL,
+        create_date DATE NOT NULL,
+        type TEXT DEFAULT '8D' NOT NULL
+    )''')
+
+    # 建唯一索引前先清掉历史重复数据，保留最后一次导入的记录
+    conn.execute('''
+    DELETE FROM measurement_data WHERE id NOT IN (
+        SELECT MAX(id) FROM measurement_data
+        GROUP BY pn, parameter_name, sn, measurement_date
+    )''')
+    conn.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_measurement_natural_key
+    ON measurement_data (pn, parameter_name, sn, measurement_date)''')
+
+
+def _query_indexes(conn):
+    # 月份列和年份列用生成列+索引，查询不再对每行做strftime
+    add_column(conn, 'measurement_data', 'measurement_month',
+               "TEXT GENERATED ALWAYS AS (substr(measurement_date, 1, 7)) VIRTUAL")
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_measurement_pn_param_month
+    ON measurement_data (pn, parameter_name, measurement_month)''')
+
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_yielddata_date_code_pn
+    ON YieldData (date_code, pn)''')
+
+    add_column(conn, 'Tracking', 'start_year',
+               "TEXT GENERATED ALWAYS AS (substr(start_date, 1, 4)) VIRTUAL")
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_tracking_type_year
+    ON Tracking (type, start_year, start_date)''')
+
+
+def _subgroup_stats(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS spc_subgroup_stats (
+        pn TEXT NOT NULL,
+        parameter_name TEXT NOT NULL,
+        month TEXT NOT NULL,
+        subgroup INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        sum REAL NOT NULL,
+        sumsq REAL NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        PRIMARY KEY (pn, parameter_name, month, subgroup)
+    )''')
+
+
+def _live_index(conn):
+    # 实时控制图按id增量读取某个pn/参数的新数据(id > 上次读到的id)
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_measurement_pn_param
+    ON measurement_data (pn, parameter_name)''')
+
+
+def _sn_index(conn):
+    # 按序列号(含前缀范围)追溯单台产品的全部测量
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_measurement_sn
+    ON measurement_data (sn)''')
+
+
+def _alerts(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        pn TEXT,
+        subject TEXT,
+        dedupe_key TEXT NOT NULL UNIQUE,
+        message TEXT,
+        value REAL,
+        occurrences INTEGER NOT NULL DEFAULT 1,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL,
+        acknowledged INTEGER NOT NULL DEFAULT 0,
+        ack_by TEXT,
+        ack_at TEXT
+    )''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_alerts_open
+    ON alerts (acknowledged, last_seen)''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS alert_watermarks (
+        source TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    )''')
+    # 从当前数据开始检查，历史数据不补报
+    conn.execute('''
+    INSERT OR IGNORE INTO alert_watermarks (source, last_id)
+    SELECT 'measurement_data', COALESCE(MAX(id), 0) FROM measurement_data''')
+    conn.execute('''
+    INSERT OR IGNORE INTO alert_watermarks (source, last_id)
+    SELECT 'YieldData', COALESCE(MAX(id), 0) FROM YieldData''')
+
+
+def _registry_version_triggers(conn, table):
+    # 注册表的表有任何修改时版本号加1，各进程据此重新加载
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS tr_{table}_{event.lower()}_version
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE spc_registry_version SET version = version + 1 WHERE id = 1;
+        END''')
+
+
+def _parameter_registry(conn):
+    # 参数配置从config.SPC_DATA搬到数据库，原有规格限作为最早的版本(在回填中导入)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS spc_parameters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pn TEXT NOT NULL,
+        parameter_name TEXT NOT NULL,
+        sn_col INTEGER NOT NULL,
+        value_col INTEGER NOT NULL,
+        start_row INTEGER NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        updated_by TEXT,
+        updated_at TEXT,
+        UNIQUE (pn, parameter_name)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS spc_spec_limits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parameter_id INTEGER NOT NULL REFERENCES spc_parameters(id),
+        effective_from TEXT NOT NULL,
+        lsl REAL,
+        usl REAL,
+        created_by TEXT,
+        created_at TEXT,
+        UNIQUE (parameter_id, effective_from)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS spc_registry_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''')
+    conn.execute("INSERT OR IGNORE INTO spc_registry_version (id, version) VALUES (1, 0)")
+    for table in ('spc_parameters', 'spc_spec_limits'):
+        _registry_version_triggers(conn, table)
+
+
+def _week_calendar(conn):
+    # date_code文本按字符串比较既不准确也用不上索引，换算成整数周键并建立周日历维度表
+    # month/quarter按该周周四所在的月份归属(ISO周的年份也是这样确定的)，周/月/季汇总共用
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS week_calendar (
+        week_key INTEGER PRIMARY KEY,
+        iso_year INTEGER NOT NULL,
+        iso_week INTEGER NOT NULL,
+        label TEXT NOT NULL,
+        week_start TEXT NOT NULL,
+        week_end TEXT NOT NULL,
+        month TEXT NOT NULL,
+        quarter TEXT NOT NULL
+    )''')
+    add_column(conn, 'YieldData', 'week_key', "INTEGER")
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_yielddata_week_pn
+    ON YieldData (week_key, pn)''')
+
+
+def _yield_rollup(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS yield_rollup (
+        grain TEXT NOT NULL,
+        period TEXT NOT NULL,
+        pn TEXT NOT NULL,
+        station TEXT NOT NULL,
+        input INTEGER NOT NULL,
+        defects INTEGER NOT NULL,
+        records INTEGER NOT NULL,
+        fpy REAL GENERATED ALWAYS AS (
+            CASE WHEN input > 0 THEN MAX(0.0, 1.0 - CAST(defects AS REAL) / input) END) VIRTUAL,
+        PRIMARY KEY (grain, period, pn, station)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS yield_rollup_rty (
+        grain TEXT NOT NULL,
+        period TEXT NOT NULL,
+        pn TEXT NOT NULL,
+        stations INTEGER NOT NULL,
+        rty REAL,
+        PRIMARY KEY (grain, period, pn)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS yield_rollup_defects (
+        grain TEXT NOT NULL,
+        period TEXT NOT NULL,
+        pn TEXT NOT NULL,
+        station TEXT NOT NULL,
+        defect TEXT NOT NULL,
+        defects INTEGER NOT NULL,
+        records INTEGER NOT NULL,
+        PRIMARY KEY (grain, period, pn, station, defect)
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS yield_rollup_dirty (
+        week_key INTEGER PRIMARY KEY
+    )''')
+    # 新增、修改(含改周、改PN/工站)、删除都把新旧两周标记为待刷新
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_yield_rollup_insert AFTER INSERT ON YieldData
+    WHEN NEW.week_key IS NOT NULL
+    BEGIN INSERT OR IGNORE INTO yield_rollup_dirty VALUES (NEW.week_key); END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_yield_rollup_update AFTER UPDATE ON YieldData
+    BEGIN
+        INSERT OR IGNORE INTO yield_rollup_dirty SELECT OLD.week_key WHERE OLD.week_key IS NOT NULL;
+        INSERT OR IGNORE INTO yield_rollup_dirty SELECT NEW.week_key WHERE NEW.week_key IS NOT NULL;
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_yield_rollup_delete AFTER DELETE ON YieldData
+    WHEN OLD.week_key IS NOT NULL
+    BEGIN INSERT OR IGNORE INTO yield_rollup_dirty VALUES (OLD.week_key); END''')
+
+
+def _defect_clusters(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS defect_clusters (
+        id INTEGER PRIMARY KEY,
+        members INTEGER NOT NULL,
+        centroid BLOB NOT NULL
+    )''')
+    # source是分配类别时的原始描述，记录被修改后与YieldData不一致，下次update()重新分配
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS defect_cluster_members (
+        record_id INTEGER PRIMARY KEY,
+        cluster_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        text TEXT NOT NULL
+    )''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_defect_cluster_members_cluster
+    ON defect_cluster_members (cluster_id)''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS defect_cluster_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        documents INTEGER NOT NULL,
+        idf BLOB NOT NULL,
+        fitted_at TEXT NOT NULL
+    )''')
+
+
+def _row_version(conn):
+    # 导入按自然键覆盖更新时id不变，按id的高水位会漏检，增加行版本号跟踪变化
+    # 已有数据的版本号取id，原来按id记录的高水位可以直接沿用
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS row_sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )''')
+    add_column(conn, 'measurement_data', 'row_version', "INTEGER")
+    conn.execute("UPDATE measurement_data SET row_version = id WHERE row_version IS NULL")
+    conn.execute('''
+    INSERT OR IGNORE INTO row_sequences (name, value)
+    SELECT 'measurement_data', COALESCE(MAX(id), 0) FROM measurement_data''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_measurement_row_version
+    ON measurement_data (row_version)''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS ix_measurement_pn_param_version
+    ON measurement_data (pn, parameter_name, row_version)''')
+    # 不经过write_measurements的写入(手工修改、旧脚本)由触发器补上版本号，每行单独取号
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_measurement_version_insert AFTER INSERT ON measurement_data
+    WHEN NEW.row_version IS NULL
+    BEGIN
+        UPDATE row_sequences SET value = value + 1 WHERE name = 'measurement_data';
+        UPDATE measurement_data SET row_version = (
+            SELECT value FROM row_sequences WHERE name = 'measurement_data') WHERE id = NEW.id;
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_measurement_version_update
+    AFTER UPDATE OF measurement_value, lower_limit, upper_limit ON measurement_data
+    WHEN NEW.row_version IS OLD.row_version
+    BEGIN
+        UPDATE row_sequences SET value = value + 1 WHERE name = 'measurement_data';
+        UPDATE measurement_data SET row_version = (
+            SELECT value FROM row_sequences WHERE name = 'measurement_data') WHERE id = NEW.id;
+    END''')
+
+
+def _rollup_names(conn):
+    # 汇总表存的是PN/工站名称: 产品或工站改名、删除(回退到记录上的文本列)或新建(复用了已删除的id)时，
+    # 把引用它的记录所在的周标记为待刷新；改名很少，按product_id/station_id扫表即可
+    for table, column, key in (('Products', 'pn', 'product_id'), ('Stations', 'name', 'station_id')):
+        for event, row in (('INSERT', 'NEW'), (f'UPDATE OF {column}', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_yield_rollup_{table.lower()}_{event.split()[0].lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO yield_rollup_dirty
+                SELECT DISTINCT week_key FROM YieldData WHERE {key} = {row}.id AND week_key IS NOT NULL;
+            END''')
+
+
+def _shift_settings(conn):
+    # EWMA/CUSUM参数从config.SPC_SHIFT搬到参数注册表，可在SPC参数设置页面修改
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS spc_shift_settings (
+        parameter_id INTEGER PRIMARY KEY REFERENCES spc_parameters(id),
+        ewma_lambda REAL NOT NULL,
+        ewma_l REAL NOT NULL,
+        cusum_k REAL NOT NULL,
+        cusum_h REAL NOT NULL,
+        updated_by TEXT,
+        updated_at TEXT
+    )''')
+    _registry_version_triggers(conn, 'spc_shift_settings')
+
+
+# (版本号, 说明, 迁移函数)，只能在末尾追加，不要修改已发布的迁移
+# 迁移函数里是该版本发布时的建表语句原样，不调用业务模块，以后修改模块不会改变旧迁移在新库上的结果
+MIGRATIONS = [
+    (1, "baseline tables and measurement natural key", _baseline),
+    (2, "indexes for SPC, yield and tracking queries", _query_indexes),
+    (3, "pre-aggregated SPC subgroup statistics", _subgroup_stats),
+    (4, "index for live chart delta queries", _live_index),
+    (5, "index for serial number traceability", _sn_index),
+    (6, "alerts table and per-source watermarks", _alerts),
+    (7, "database-backed SPC parameter registry", _parameter_registry),
+    (8, "ISO week calendar and integer YieldData week key", _week_calendar),
+    (9, "week/month/quarter yield rollup tables", _yield_rollup),
+    (10, "defect description clusters", _defect_clusters),
+    (11, "measurement row version for change tracking", _row_version),
+    (12, "refresh yield rollups when products or stations are renamed", _rollup_names),
+    (13, "EWMA/CUSUM settings in the SPC parameter registry", _shift_settings),
+]
+
+
+def _fill_week_calendar(conn):
+    week_calendar.fill(conn)
+    week_calendar.normalize(conn)
+
+
+def _seed_registry(conn):
+    spc_registry.seed(conn, SPC_DATA)
+
+
+def _seed_shift(conn):
+    spc_registry.seed_shift(conn, SPC_SHIFT)
+
+
+# (版本号, 数据回填): 用业务模块从已有数据生成派生数据，在全部结构迁移之后按最新结构执行
+# 同一个回填只执行一次(9和12都是重算良率汇总)
+BACKFILLS = [
+    (3, spc_stats.rebuild),
+    (7, _seed_registry),
+    (8, _fill_week_calendar),
+    (9, yield_rollup.rebuild),
+    (10, defect_clusters.rebuild),
+    (12, yield_rollup.rebuild),
+    (13, _seed_shift),
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None):
+    # 未执行的结构迁移和对应的数据回填在同一个事务里执行，全部成功后更新版本号；返回执行了的迁移
+    own_conn = conn is None
+    if own_conn:
+        conn = db.connect()
+    try:
+        version = current_version(conn)
+        pending = [(number, description, func) for number, description, func in MIGRATIONS if number > version]
+        if not pending:
+            return []
+        conn.execute("BEGIN")
+        try:
+            for _, _, func in pending:
+                func(conn)
+            done = []
+            for number, backfill in BACKFILLS:
+                if number > version and backfill not in done:
+                    backfill(conn)
+                    done.append(backfill)
+            conn.execute(f"PRAGMA user_version = {pending[-1][0]}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        if own_conn:
+            conn.close()
+    return [(number, description) for number, description, _ in pending]
+
+if __name__ == '__main__':
+    for number, description in migrate():
+        print(f"已升级到版本 {number}: {description}")
@@ -1,26 +1,21 @@
 import streamlit as st
-import pandas as pd
-import os
-import sqlite3
-import shutil
 from datetime import datetime
-from config import SPC_DATA,SPC_PN,CONN
-from config import PN_TO_MODULE
+import db
+import ingest
 
 if 'username' not in st.session_state or not st.session_state.username:
     st.warning("请先登录系统")
     st.stop()  # 停止执行后续代码
+
+SERVICE_TIMEOUT = 30  # 心跳超过多少秒认为后台服务离线
     
 def read_and_process_files():
     # 检查uploads文件夹下是否有Excel文件
-    excel_files = [f for f in os.listdir('uploads') if f.endswith(('.xlsx', '.xls'))]
+    excel_files = ingest.list_excel_files()
     if not excel_files:
         st.warning("未发现Excel文件在uploads文件夹下面")
         return
     
-    # 创建必要的目录
-    os.makedirs('uploads/success', exist_ok=True)
-    
     # 初始化错误日志
     error_log = []
     total_processed = 0
@@ -28,151 +23,67 @@ def read_and_process_files():
     # 获取当前日期
     current_date = datetime.now().strftime('%Y-%m-%d')
     
-    # 数据库连接
-    # 数据库连接
-    conn = sqlite3.connect(CONN)
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS measurement_data (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        parameter_name TEXT,
-        pn TEXT,
-        sn TEXT,
-        measurement_value REAL,
-        measurement_date TEXT,
-        lower_limit REAL,
-        upper_limit REAL
-    )
-    ''')
-    
-    # 处理每个文件
-    for filename in os.listdir('uploads'):
-        if filename.endswith(('.xlsx', '.xls')):
-            filepath = os.path.join('uploads', filename)
-            records_processed = 0
-            
-            try:
-                df = pd.read_excel(filepath)
-                
-                # 读取PN信息时会这样处理：
-                # 读取PN信息 - 修改后的处理逻辑
-                pn_row = SPC_PN[0] - 1
-                pn_col = SPC_PN[1] - 1
-                
-                # 添加调试信息
-                #st.write(f"正在读取文件: {filename}")
-                #st.write(f"数据框形状: {df.shape}")  # 显示行列数
-                #st.write(f"尝试读取位置: 行{pn_row+1} 列{pn_col+1}")
-                
-                # 更严格的空值检查
-                try:
-                    pn_value = df.iat[pn_row, pn_col]  # 使用iat更快
-                    if pd.isna(pn_value):  # 检查是否为空值
-                        #st.warning(f"A1单元格为空或无效，文件名: {filename}{df.iat[-1,1]}")
-                        # 读取PN信息 - 最终解决方案
-                        pn = "Unknown"
-                        try:
-                            # 方案1：从A1单元格读取
-                            cell_value = df.iat[SPC_PN[0]-1, SPC_PN[1]-1]
-                            if pd.notna(cell_value):
-                                pn = str(cell_value).strip()
-                        
-                            # 方案2：从文件名提取（如果A1无效）
-                            if pn == "Unknown":
-                                import re
-                                filename_pn = re.search(r'(\d{5}-\d{4}-\d{3})', filename)
-                                pn = filename_pn.group(1) if filename_pn else "Unknown"
-                                
-                            st.write(f"最终使用的PN值: {pn}")
-                        except Exception as e:
-                            st.error(f"PN读取失败: {str(e)}")
-                    else:
-                        pn = str(pn_value).strip()  # 去除前后空格
-                        st.write(f"成功读取PN值: {pn}")
-                except Exception as e:
-                    st.error(f"读取PN失败: {str(e)}")
-                    pn = "Unknown"
-                
-                for param_name, config in SPC_DATA.items():
-                    try:
-                        # 检查PN是否匹配
-                        if pn != config[5]:  # 新增的PN匹配值在索引5位置
-                            continue
-                            
-                        sn_col = config[0] - 1
-                        value_col = config[1] - 1
-                        start_row = config[2] - 1
-                        lower = config[3]
-                        upper = config[4]
-                        
-                        # 检查列索引
-                        if sn_col >= len(df.columns) or value_col >= len(df.columns):
-                            raise ValueError(f"列索引超出范围: SN列{config[0]}, 值列{config[1]}")
-                            
-                        for i in range(start_row, len(df)):
-                            try:
-                                sn = str(df.iloc[i, sn_col])
-                                value = float(df.iloc[i, value_col])
-                                
-                                cursor.execute('''
-                                INSERT INTO measurement_data 
-                                (parameter_name, pn, sn, measurement_value, measurement_date, lower_limit, upper_limit)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                                ''', (param_name, pn, sn, value, current_date, lower, upper))
-                                records_processed += 1
-                                
-                            except Exception as e:
-                                error_log.append(f"{filename} - 行{i+1}: {str(e)}")
-                                
-                    except Exception as e:
-                        error_log.append(f"{filename} - 参数{param_name}: {str(e)}")
-                
-                # 成功处理后移动文件
-                if records_processed > 0:
-                    shutil.move(filepath, os.path.join('uploads/success', filename))
-                    st.success(f"""
-                    {filename} 成功写入 {records_processed} 条记录
-                    PN: {pn}
-                    处理参数: {param_name},file move to /uploads/success
-                    日期: {current_date}
-                    """)
-                    total_processed += records_processed
-                
-            except Exception as e:
-                error_log.append(f"{filename}: {str(e)}")
-    
-    # 写入错误日志 - 修改为CSV格式
-    if error_log:
-        import csv
-        error_file = 'uploads/error_log.csv'
-        file_exists = os.path.isfile(error_file)
+    with db.connection() as conn:
+        # 进程池并行解析，逐个文件提交并显示进度
+        progress = st.progress(0.0, text=f"0/{len(excel_files)} 个文件")
+        for done, result in enumerate(ingest.process_files(conn, excel_files, current_date), start=1):
+            filename = result['filename']
+            error_log.extend(result['errors'])
+            progress.progress(done / len(excel_files), text=f"{done}/{len(excel_files)} 个文件: {filename}")
         
-        with open(error_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(['Timestamp', 'Filename', 'Error'])  # 写入表头
-            
-            for error in error_log:
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                # 分割错误信息为文件名和错误详情
-                if ' - ' in error:
-                    err_filename, err_detail = error.split(' - ', 1)
-                else:
-                    err_filename, err_detail = filename, error
-                writer.writerow([timestamp, err_filename, err_detail])
-                
-        st.warning(f"处理完成，但有 {len(error_log)} 个错误，详见 {error_file}")
+            # 成功处理后文件已移动到uploads/success
+            if result['duplicate']:
+                st.info(f"{filename} 内容已导入过，跳过并移动到 /uploads/success")
+            elif result['records'] > 0:
+                st.success(f"""
+                {filename} 成功写入 {result['records']} 条记录
+                PN: {result['pn']}
+                处理参数: {', '.join(result['params'])},file move to /uploads/success
+                日期: {current_date}
+                耗时: {result['seconds']:.2f}s ({result['rows_per_sec']:.0f} 行/秒)
+                """)
+                total_processed += result['records']
     
-    conn.commit()
-    conn.close()
+    # 写入错误日志 - CSV格式
+    if error_log:
+        ingest.write_error_log(error_log)
+        st.warning(f"处理完成，但有 {len(error_log)} 个错误，详见 {ingest.ERROR_FILE}")
     
     if total_processed > 0 and not error_log:
         st.success(f"所有文件处理完成，共写入 {total_processed} 条记录")
 
 
 
+def show_ingest_status():
+    # 导入由ingest_service.py在后台完成，这里只显示状态和待处理文件
+    with db.connection() as conn:
+        status = ingest.get_status(conn)
+    backlog = ingest.list_excel_files()
+
+    online = False
+    if status and status['heartbeat'] and status['state'] != 'stopped':
+        age = (datetime.now() - datetime.strptime(status['heartbeat'], '%Y-%m-%d %H:%M:%S')).total_seconds()
+        online = age <= SERVICE_TIMEOUT
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("导入服务", f"{status['state']} ({status['mode']})" if online else "离线")
+    col2.metric("待处理文件", len(backlog))
+    col3.metric("已导入文件", status['files_total'] if status else 0)
+    col4.metric("已导入记录", status['records_total'] if status else 0)
+
+    if status:
+        st.caption(f"心跳: {status['heartbeat']} | 最近文件: {status['last_file'] or '-'}")
+        if status['last_error']:
+            st.warning(f"最近错误: {status['last_error']}")
+    if backlog:
+        with st.expander(f"待处理文件 ({len(backlog)})"):
+            st.write(backlog)
+    return online
+
 st.subheader("SPC Control|Read from Excel")
 st.write("Pls upload T&A Excel file into /uploads")
-if st.button("Read and Process Files"):
-    read_and_process_files()
-
+st.button("刷新状态")
+if not show_ingest_status():
+    st.info("后台导入服务未运行(python ingest_service.py)，可手动导入")
+    if st.button("Read and Process Files"):
+        read_and_process_files()
@@ -1,16 +1,19 @@
 import streamlit as st
-import pandas as pd
-import sqlite3
+from datetime import datetime, timedelta
 
-from datetime import datetime
+import numpy as np
 
-from config import SPC_DATA, PN_TO_MODULE, CONN
+from config import PN_TO_MODULE
+import db
+import week_calendar
+import defect_clusters
 
-# 数据库连接
-conn = sqlite3.connect(CONN)
 if 'username' not in st.session_state or not st.session_state.username:
     st.warning("请先登录系统")
     st.stop()
+
+MAX_PARETO_BARS = 20  # Pareto图最多显示的类别数，明细里列出全部类别
+
 # 获取PN和Module列表
 pn_module_list = [(pn, module) for pn, module in PN_TO_MODULE.items()]
 
@@ -34,39 +37,40 @@ with col2:
 # 第二行：日期范围选择
 col3, col4 = st.columns(2)
 with col3:
-    start_date = st.date_input("开始日期", datetime.now() - pd.Timedelta(days=30))
-    start_yyww = start_date.strftime("%y%W")
-    st.write(f"开始周: {start_yyww}")
+    start_date = st.date_input("开始日期", datetime.now() - timedelta(days=30))
+    start_week = week_calendar.of_date(start_date)
+    st.write(f"开始周: {week_calendar.label(start_week)}")
 with col4:
     end_date = st.date_input("结束日期", datetime.now()) 
-    end_yyww = end_date.strftime("%y%W")
-    st.write(f"结束周: {end_yyww}")
+    end_week = week_calendar.of_date(end_date)
+    st.write(f"结束周: {week_calendar.label(end_week)}")
 
 if st.button("查询数据"):
-    # 构建查询条件
+    # 一次按周范围和PN条件取出明细行(走(week_key, pn)索引)，周汇总、各PN明细、透视表和不良列表都在内存中派生
+    # date_code写法不统一(2514、2504W14)，按录入时换算好的ISO周week_key比较和分组
     query = """
-    SELECT date_code, SUM(good_count) as total_quantity, 
-           SUM(bad_count) as total_defects
-    FROM yielddata
-    WHERE date_code >= ? AND date_code <= ?
+    SELECT y.id, y.pn, y.station, c.label AS week, y.good_count, y.bad_count,
+           y.defect_description, y.improvement_measures
+    FROM yielddata y JOIN week_calendar c ON c.week_key = y.week_key
+    WHERE y.week_key BETWEEN ? AND ?
     """
-    params = [start_yyww, end_yyww]
+    params = [start_week, end_week]
     
     # 添加PN/Module筛选条件
     if search_text:
-        query += " AND (pn LIKE ? OR pn LIKE ?)"
+        query += " AND (y.pn LIKE ? OR y.pn LIKE ?)"
         search_term = f"%{search_text.lower().replace(' ', '')}%"
         params.extend([search_term, search_term])
     elif selected_pn != "All":  # 只有当不是All时才添加PN条件
-        query += " AND pn = ?"
+        query += " AND y.pn = ?"
         params.append(selected_pn)
     
-    query += " GROUP BY date_code ORDER BY date_code"
-    
-    # 执行查询
-    df = pd.read_sql(query, conn, params=params)
+    rows = db.cached_read_sql(query, params=params)
     
-    if not df.empty:
+    if not rows.empty:
+        df = (rows.groupby('week', sort=True)[['good_count', 'bad_count']].sum()
+              .rename(columns={'good_count': 'total_quantity', 'bad_count': 'total_defects'})
+              .reset_index())
         # 计算不良率
         df['defect_rate'] = df['total_defects'] / df['total_quantity']*100
         
@@ -75,146 +79,71 @@ if st.button("查询数据"):
         
         # 使用Streamlit原生图表
         st.subheader("不良率趋势")
-        st.line_chart(df.set_index('date_code')['defect_rate'])
+        st.line_chart(df.set_index('week')['defect_rate'])
         
         st.subheader("生产数量和不良数量")
-        st.bar_chart(df.set_index('date_code')[['total_quantity', 'total_defects']])
+        st.bar_chart(df.set_index('week')[['total_quantity', 'total_defects']])
         
-        # 新增：各PN详细数据查询
-        detail_query = """
-        SELECT pn, station, date_code, 
-               SUM(good_count) as quantity, 
-               SUM(bad_count) as defect_count
-        FROM yielddata
-        WHERE date_code >= ? AND date_code <= ?
-        """
-        detail_params = [start_yyww, end_yyww]
+        # 各PN详细数据
+        detail_df = (rows.groupby(['pn', 'station', 'week'], dropna=False)[['good_count', 'bad_count']].sum()
+                     .rename(columns={'good_count': 'quantity', 'bad_count': 'defect_count'})
+                     .reset_index()
+                     .sort_values(['pn', 'week'], kind='stable', na_position='first', ignore_index=True))
         
-        if search_text:
-            detail_query += " AND (pn LIKE ? OR pn LIKE ?)"
-            detail_params.extend([search_term, search_term])
-        elif selected_pn != "All":
-            detail_query += " AND pn = ?"
-            detail_params.append(selected_pn)
-            
-        detail_query += " GROUP BY pn, station, date_code ORDER BY pn, date_code"
+        st.subheader("各PN详细数据")
+        st.dataframe(detail_df)
         
-        # 获取详细数据
-        detail_df = pd.read_sql(detail_query, conn, params=detail_params)
+        # 叠加柱状图，两张透视表一次生成
+        pivot = detail_df.pivot_table(index='week', columns='pn', values=['quantity', 'defect_count'], aggfunc='sum')
+        st.subheader("各PN生产数量(叠加)")
+        st.bar_chart(pivot['quantity'], use_container_width=True)
         
-        if not detail_df.empty:
-            st.subheader("各PN详细数据")
-            st.dataframe(detail_df)
-            
-            # 新增：叠加柱状图
-            st.subheader("各PN生产数量(叠加)")
-            st.bar_chart(detail_df.pivot_table(
-                index='date_code', 
-                columns='pn', 
-                values='quantity', 
-                aggfunc='sum'
-            ), use_container_width=True)
-            
-            st.subheader("各PN不良数量(叠加)") 
-            st.bar_chart(detail_df.pivot_table(
-                index='date_code',
-                columns='pn',
-                values='defect_count',
-                aggfunc='sum'
-            ), use_container_width=True)
+        st.subheader("各PN不良数量(叠加)") 
+        st.bar_chart(pivot['defect_count'], use_container_width=True)
 
-        # 修改：不良原因和改善措施查询
+        # 不良原因: 近似的描述先聚成一类再做Pareto，每类展开查看明细，不再每条记录一个折叠框
         st.subheader("不良内容详情")
-        defect_query = """
-        SELECT id, pn,station, date_code, defect_description, improvement_measures, SUM(bad_count) as defect_count
-        FROM yielddata
-        WHERE date_code >= ? AND date_code <= ? AND bad_count > 0
-        """
-        defect_params = [start_yyww, end_yyww]
-        
-        if search_text:
-            defect_query += " AND (pn LIKE ? OR pn LIKE ?)"
-            defect_params.extend([search_term, search_term])
-        elif selected_pn != "All":
-            defect_query += " AND pn = ?"
-            defect_params.append(selected_pn)
-            
-        defect_query += " GROUP BY pn, date_code, defect_description, improvement_measures ORDER BY pn, date_code"
-        
-        defect_df = pd.read_sql(defect_query, conn, params=defect_params)
-        
-        if not defect_df.empty:
-            for index, row in defect_df.iterrows():
-                with st.expander(f"ID: {row['id']} |PN: {row['pn']} | 周: {row['date_code']} | 不良数量: {row['defect_count']}"):
-                    st.write(f"不良原因: {row['defect_description']}")
-                    st.write(f"改善措施: {row['improvement_measures']}")
-        else:
+        defect_rows = rows[rows['bad_count'] > 0]
+        if defect_rows.empty:
             st.write("未找到匹配的不良记录")
+        else:
+            # 类别在录入/修改良率记录时分配(defect_clusters.update)，这里只读取
+            clusters = defect_clusters.assignments()
+            defect_rows = defect_rows.merge(clusters[['record_id', 'cluster_id', 'cluster']], how='left',
+                                            left_on='id', right_on='record_id')
+            # 按类别id分组，类别名只用于显示(不同类别的代表描述可能相同)；未分配的记录归到0
+            defect_rows['cluster_id'] = defect_rows['cluster_id'].fillna(0).astype(int)
+            defect_rows['cluster'] = defect_rows['cluster'].fillna('(未填写)')
+            pareto = (defect_rows.groupby('cluster_id')
+                      .agg(cluster=('cluster', 'first'), defects=('bad_count', 'sum'), records=('bad_count', 'size'))
+                      .sort_values('defects', ascending=False))
+            pareto['cumulative'] = pareto['defects'].cumsum() / pareto['defects'].sum()
+            duplicated = pareto['cluster'].duplicated(keep=False)
+            pareto.loc[duplicated, 'cluster'] += ' #' + pareto.index[duplicated].astype(str)
 
-    else:
-        st.warning("没有找到匹配的数据")
-
-    conn.close()  # 确保在最后关闭连接
+            import plotly.graph_objects as go
+            shown = pareto.head(MAX_PARETO_BARS)
+            fig = go.Figure()
+            fig.add_trace(go.Bar(x=shown['cluster'], y=shown['defects'], name='不良数',
+                                 customdata=shown['records'], hovertemplate='%{x}: %{y} (%{customdata}条记录)<extra></extra>'))
+            fig.add_trace(go.Scatter(x=shown['cluster'], y=shown['cumulative'], name='累计占比', yaxis='y2',
+                                     mode='lines+markers', line=dict(color='red')))
+            fig.update_layout(yaxis2=dict(overlaying='y', side='right', tickformat='.0%', range=[0, 1.05]),
+                              hovermode='x unified')
+            st.plotly_chart(fig, use_container_width=True)
 
-# 添加生产数据表结构
-def init_production_db():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS productiondata (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        pn TEXT,
-        modulename TEXT,
-        username TEXT,
-        createdate TEXT,
-        date_code TEXT,
-        good_count INTEGER,
-        bad_count INTEGER,
-        defect_description TEXT,
-        improvement_measures TEXT,
-        remark TEXT
-    )
-    ''')
-    
-    # 生成模拟数据
-    from datetime import datetime, timedelta
-    import random
-    
-    # 检查是否已有数据
-    if cursor.execute("SELECT COUNT(*) FROM productiondata").fetchone()[0] == 0:
-        users = ['张三', '李四', '王五']
-        defect_descriptions = ['材料问题', '工艺问题', '设备故障', '操作失误', '设计缺陷']
-        improvement_measuress = ['更换供应商', '调整参数', '设备维护', '加强培训', '设计优化']
-        
-        # 生成过去8周的数据
-        for i in range(8):
-            week = datetime.now() - timedelta(weeks=8-i)
-            yyww = week.strftime("%y%W")
-            
-            for pn, module in PN_TO_MODULE.items():
-                quantity = random.randint(50, 200)
-                defect_count = random.randint(0, quantity//10)
-                
-                cursor.execute('''
-                INSERT INTO productiondata 
-                (pn, modulename, username, createdate, YYWW, quantity, defect_count, defect_description, improvement_measures, remark)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    pn,
-                    module,
-                    random.choice(users),
-                    week.strftime('%Y-%m-%d'),
-                    yyww,
-                    quantity,
-                    defect_count,
-                    random.choice(defect_descriptions) if defect_count > 0 else '',
-                    random.choice(improvement_measuress) if defect_count > 0 else '',
-                    ''
-                ))
-    
-    conn.commit()
-    conn.close()
-# 在文件末尾调用初始化函数
-init_production_db()
+            # 下钻: 每类一个折叠框，列出记录和去重后的改善措施
+            for cluster_id, cluster, defects, records, cumulative in pareto.itertuples():
+                members = defect_rows[defect_rows['cluster_id'] == cluster_id]
+                with st.expander(f"{cluster} | 不良数量: {defects} | {records} 条记录 | 累计 {cumulative:.0%}"):
+                    st.dataframe(members[['id', 'pn', 'station', 'week', 'bad_count', 'defect_description']],
+                                 hide_index=True, use_container_width=True)
+                    measures = (members['improvement_measures'].map(defect_clusters.normalize)
+                                .replace('', np.nan).dropna().value_counts())
+                    if not measures.empty:
+                        st.write("改善措施:")
+                        for measure, count in measures.items():
+                            st.write(f"- {measure} (×{count})")
 
+    else:
+        st.warning("没有找到匹配的数据")
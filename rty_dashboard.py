@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import streamlit as st
+from config import PN_TO_MODULE
+import yield_rollup
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("产线RTY看板")
+
+REFRESH_SECONDS = 60
+GRAIN_NAMES = {'week': '周', 'month': '月', 'quarter': '季度'}
+
+col1, col2, col3 = st.columns([1, 1, 1])
+with col1:
+    grain = st.radio("汇总粒度", yield_rollup.GRAINS, format_func=GRAIN_NAMES.get, horizontal=True)
+with col2:
+    count = st.number_input(f"最近{GRAIN_NAMES[grain]}数", min_value=1, max_value=52, value=4)
+with col3:
+    top = st.number_input("最差工站显示数", min_value=3, max_value=50, value=10)
+
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def dashboard():
+    # 每分钟重画一次；汇总查询按(粒度, 周期范围)缓存，录入良率刷新汇总表后缓存失效
+    available = yield_rollup.available_periods(grain)
+    if not available:
+        st.warning("还没有良率数据")
+        return
+    periods = sorted(available[:int(count)])
+    start, end = periods[0], periods[-1]
+    stations = yield_rollup.station_yield(grain, start, end)
+    products = yield_rollup.rolled_yield(stations)
+    if products.empty:
+        st.warning("所选范围内没有投入数据")
+        return
+
+    st.caption(f"{start} ~ {end}，更新于 {datetime.now().strftime('%H:%M:%S')}，每{REFRESH_SECONDS}秒自动刷新")
+
+    # 每个PN一张指标卡: RTY和按总数算的合计良率，两者差距越大说明工站越多、单站良率被掩盖得越多
+    cards = st.columns(min(len(products), 4))
+    for i, row in products.iterrows():
+        cards[i % len(cards)].metric(
+            f"{row['pn'] or '(未指定)'} ({PN_TO_MODULE.get(row['pn'], 'Unknown')})",
+            f"RTY {row['rty']:.2%}",
+            delta=f"{row['rty'] - row['naive_yield']:+.2%} vs 合计良率 {row['naive_yield']:.2%}",
+            delta_color='off',
+            help=f"{row['stations']} 个工站，投入 {row['input']}，不良 {row['defects']}",
+        )
+
+    import plotly.express as px
+
+    _, rty, _ = yield_rollup.load(grain, periods)
+    left, right = st.columns(2)
+    with left:
+        st.subheader("RTY趋势")
+        fig = px.line(rty, x='period', y='rty', color='pn', markers=True,
+                      labels={'period': GRAIN_NAMES[grain], 'rty': 'RTY', 'pn': 'PN'})
+        fig.update_yaxes(tickformat='.1%')
+        st.plotly_chart(fig, use_container_width=True)
+    with right:
+        st.subheader("最差工站")
+        worst = yield_rollup.worst_stations(stations, int(top))
+        st.dataframe(
+            worst[['pn', 'station', 'input', 'defects', 'fpy', 'rty_loss_share']],
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                'pn': 'PN',
+                'station': '工站',
+                'input': '投入',
+                'defects': '不良',
+                'fpy': st.column_config.NumberColumn('FPY', format='percent'),
+                'rty_loss_share': st.column_config.ProgressColumn('占该PN的RTY损失', format='percent',
+                                                                  min_value=0.0, max_value=1.0),
+            },
+        )
+
+
+dashboard()
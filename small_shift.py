@@ -0,0 +1,71 @@
+import streamlit as st
+from config import PN_TO_MODULE
+import spc_stats
+import spc_engine
+import spc_registry
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("EWMA / CUSUM 小偏移检测")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    registry = spc_registry.get()
+    pns = registry.pns()
+    selected_pn = st.selectbox("选择PN", pns, format_func=lambda pn: f"{pn} ({PN_TO_MODULE.get(pn, 'Unknown')})")
+with col2:
+    params = [parameter.name for parameter in registry.parameters(selected_pn)]
+    selected_param = st.selectbox("选择参数", params)
+with col3:
+    baseline_size = st.number_input("基准数据点数(估计目标均值和σ)", min_value=10, value=100, step=10)
+
+# 参数默认取注册表(在SPC参数设置页面维护)，可在页面上临时调整
+lam, L, k, h = registry.shift_settings(selected_pn, selected_param)
+c1, c2, c3, c4 = st.columns(4)
+lam = c1.number_input("EWMA λ", min_value=0.01, max_value=1.0, value=float(lam), step=0.05, key=f"lam_{selected_param}")
+L = c2.number_input("EWMA L", min_value=0.5, max_value=5.0, value=float(L), step=0.1, key=f"L_{selected_param}")
+k = c3.number_input("CUSUM k(σ)", min_value=0.0, max_value=3.0, value=float(k), step=0.1, key=f"k_{selected_param}")
+h = c4.number_input("CUSUM h(σ)", min_value=0.5, max_value=20.0, value=float(h), step=0.5, key=f"h_{selected_param}")
+
+data = spc_stats.load_values(selected_pn, selected_param)
+if len(data) < baseline_size:
+    st.warning(f"数据不足: 只有 {len(data)} 个点，少于基准点数 {baseline_size}")
+    st.stop()
+
+values = data['measurement_value'].to_numpy()
+dates = data['measurement_date'].to_numpy()
+mean, sigma = spc_engine.baseline(values, int(baseline_size))
+ewma = spc_engine.ewma(values, lam, L, mean, sigma)
+cusum = spc_engine.cusum(values, k, h, mean, sigma)
+
+m1, m2, m3, m4 = st.columns(4)
+m1.metric("数据点", len(values))
+m2.metric("目标均值", f"{mean:.4f}")
+m3.metric("σ (MR̄/d2)", f"{sigma:.5f}")
+for col, name, signal in ((m4, "EWMA", ewma['signal']), (m4, "CUSUM", cusum['signal'])):
+    if signal.any():
+        first = signal.argmax()
+        col.error(f"{name} 首次报警: 第{first + 1}点 ({dates[first]})")
+    else:
+        col.success(f"{name} 未报警")
+
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import downsample
+
+x = list(range(1, len(values) + 1))
+Scatter = downsample.scatter_class(len(values))
+fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
+                    subplot_titles=(f'EWMA (λ={lam}, L={L})', f'CUSUM (k={k}σ, h={h}σ)'))
+fig.add_trace(Scatter(x=x, y=ewma['z'], mode='lines', name='EWMA', line=dict(color='blue'),
+                      text=dates, hovertemplate='%{text}: %{y:.4f}<extra></extra>'), row=1, col=1)
+fig.add_trace(Scatter(x=x, y=ewma['ucl'], mode='lines', name='UCL', line=dict(color='green', dash='dash')), row=1, col=1)
+fig.add_trace(Scatter(x=x, y=ewma['lcl'], mode='lines', name='LCL', line=dict(color='green', dash='dash')), row=1, col=1)
+fig.add_hline(y=mean, line=dict(color='red', dash='dot'), row=1, col=1)
+fig.add_trace(Scatter(x=x, y=cusum['upper'], mode='lines', name='C+', line=dict(color='darkorange')), row=2, col=1)
+fig.add_trace(Scatter(x=x, y=cusum['lower'], mode='lines', name='C-', line=dict(color='purple')), row=2, col=1)
+fig.add_hline(y=cusum['h'], line=dict(color='red', dash='dash'), annotation_text=f"H = {cusum['h']:.4f}", row=2, col=1)
+fig.update_layout(height=750, hovermode='x unified')
+st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,106 @@
+import os
+import streamlit as st
+import db
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+MAX_ROWS = 2000  # 前缀太短时最多返回的测量条数
+
+# 一条查询: 序列号前缀走ix_measurement_sn范围扫描，判定规格内外，
+# 并对命中的每个SN(去重后)在8D/MVT报告的编号和描述中查找引用
+TRACE_SQL = '''
+WITH hits AS (
+    SELECT sn, pn, parameter_name, measurement_value, lower_limit, upper_limit, measurement_date
+    FROM measurement_data
+    WHERE sn >= ? AND sn < ?
+    ORDER BY sn, parameter_name, measurement_date
+    LIMIT ?
+),
+refs AS (
+    SELECT s.sn, group_concat(t.type || ' ' || t.No, '; ') AS reports
+    FROM (SELECT DISTINCT sn FROM hits) s
+    JOIN Tracking t ON instr(t.description, s.sn) > 0 OR instr(t.No, s.sn) > 0
+    GROUP BY s.sn
+)
+SELECT hits.*,
+       CASE
+           WHEN lower_limit IS NULL OR upper_limit IS NULL THEN 'N/A'
+           WHEN measurement_value < lower_limit OR measurement_value > upper_limit THEN 'FAIL'
+           ELSE 'PASS'
+       END AS status,
+       refs.reports
+FROM hits LEFT JOIN refs ON refs.sn = hits.sn
+'''
+
+
+def prefix_range(prefix):
+    # 前缀匹配转成[prefix, prefix的下一个字符串)范围，大小写敏感，能用上索引
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def trace(prefix):
+    low, high = prefix_range(prefix)
+    return db.cached_read_sql(TRACE_SQL, params=(low, high, MAX_ROWS))
+
+
+st.header("SN追溯")
+
+prefix = st.text_input("序列号或前缀", placeholder="例如 S32201-3A240063-34 或 S32201-3A2400").strip()
+if not prefix:
+    st.info("输入完整序列号或前缀后回车查询")
+    st.stop()
+
+result = trace(prefix)
+if result.empty:
+    st.warning(f"没有找到以 {prefix} 开头的序列号")
+    st.stop()
+
+sns = result['sn'].unique().tolist()
+if len(result) >= MAX_ROWS:
+    st.warning(f"结果超过 {MAX_ROWS} 条，只显示前 {MAX_ROWS} 条，请输入更长的前缀")
+if len(sns) > 1:
+    selected_sn = st.selectbox(f"找到 {len(sns)} 个序列号", sns)
+else:
+    selected_sn = sns[0]
+
+unit = result[result['sn'] == selected_sn]
+failed = int((unit['status'] == 'FAIL').sum())
+col1, col2, col3 = st.columns(3)
+col1.metric("序列号", selected_sn)
+col2.metric("测量项", len(unit))
+col3.metric("超规格", failed)
+
+st.dataframe(
+    unit[['pn', 'parameter_name', 'measurement_value', 'lower_limit', 'upper_limit', 'status', 'measurement_date']]
+    .style.map(lambda v: 'color: red; font-weight: bold' if v == 'FAIL' else
+               ('color: green' if v == 'PASS' else ''), subset=['status']),
+    hide_index=True,
+    use_container_width=True,
+)
+
+# 引用该SN的8D/MVT报告
+reports = unit['reports'].dropna()
+if reports.empty:
+    st.caption("没有8D/MVT报告引用该序列号")
+else:
+    report_nos = [item.split(' ', 1)[1] for item in reports.iloc[0].split('; ')]
+    placeholders = ', '.join('?' * len(report_nos))
+    details = db.cached_read_sql(f'''
+    SELECT No, type, customer, status, start_date, report_file FROM Tracking
+    WHERE No IN ({placeholders}) ORDER BY start_date DESC
+    ''', params=report_nos)
+    st.subheader("相关报告")
+    for i, report in details.iterrows():
+        col1, col2 = st.columns([4, 1])
+        col1.write(f"**{report['type']} {report['No']}** · {report['customer']} · {report['status']} · {report['start_date']}")
+        if isinstance(report['report_file'], str) and os.path.exists(report['report_file']):
+            with open(report['report_file'], "rb") as file:
+                col2.download_button(
+                    label="下载报告",
+                    data=file,
+                    file_name=os.path.basename(report['report_file']),
+                    mime="application/octet-stream",
+                    key=f"report_{i}"
+                )
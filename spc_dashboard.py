@@ -0,0 +1,99 @@
+import numpy as np
+import streamlit as st
+from config import PN_TO_MODULE
+import db
+import spc_stats
+import spc_engine
+import spc_registry
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("SPC看板")
+
+CPK_TARGET = 1.33
+
+months = db.cached_read_sql("SELECT DISTINCT month FROM spc_subgroup_stats ORDER BY month DESC")['month'].tolist()
+if not months:
+    st.warning("还没有SPC数据")
+    st.stop()
+
+registry = spc_registry.get()
+all_pns = registry.pns()
+col1, col2, col3 = st.columns([3, 1, 1])
+with col1:
+    selected_pns = st.multiselect("选择PN", all_pns, default=all_pns,
+                                  format_func=lambda pn: f"{pn} ({PN_TO_MODULE.get(pn, 'Unknown')})")
+with col2:
+    month_count = st.number_input("最近月份数", min_value=1, max_value=len(months), value=min(3, len(months)))
+with col3:
+    grid_cols = st.number_input("每行图表数", min_value=1, max_value=4, value=2)
+
+# 所选PN的全部参数一次查询取出
+since = months[int(month_count) - 1]
+stats = spc_stats.load_many(selected_pns, since)
+stats = stats[[registry.parameter(pn, param) is not None
+               for pn, param in zip(stats['pn'], stats['parameter_name'])]]
+if stats.empty:
+    st.warning("所选PN在该时间范围内没有数据")
+    st.stop()
+
+# 共享时间轴: 每个月在横轴上占所有参数中该月最多的子组数，同一月份在各图中对齐
+span = stats.groupby('month')['subgroup'].max().sort_index()
+offset = (span.cumsum() - span).to_dict()
+stats = stats.assign(position=stats['month'].map(offset) + stats['subgroup'])
+
+panels = []
+for (pn, param), group in stats.groupby(['pn', 'parameter_name'], sort=True):
+    limits, violations = spc_engine.evaluate_stats(group)
+    n_total, mean, sigma_overall = spc_stats.overall(group)
+    lsl, usl = registry.limits_at(pn, param, f"{months[0]}-31")  # 当前生效的规格限
+    cpk = float('nan')
+    if lsl is not None and usl is not None:
+        cpk = float(spc_engine.capability(mean, limits['sigma'], sigma_overall, lsl, usl)['cpk'])
+    flagged = spc_engine.any_violation(violations)
+    if flagged.any():
+        badge, color = f"判异 {int(flagged.sum())} 点", 'red'
+    elif not cpk >= CPK_TARGET:
+        badge, color = f"Cpk {cpk:.2f} < {CPK_TARGET}", 'orange'
+    else:
+        badge, color = "受控", 'green'
+    panels.append({'pn': pn, 'param': param, 'group': group, 'limits': limits, 'flagged': flagged,
+                   'cpk': cpk, 'badge': badge, 'color': color})
+
+# 状态徽章
+st.markdown("  ".join(f":{p['color']}-background[{p['param']} · {p['badge']}]" for p in panels))
+
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+grid_cols = int(grid_cols)
+rows = -(-len(panels) // grid_cols)
+fig = make_subplots(rows=rows, cols=grid_cols, shared_xaxes='all', vertical_spacing=0.12 / max(rows, 1) + 0.05,
+                    subplot_titles=[f"{p['param']}<br><sup>{p['pn']} · Cpk {p['cpk']:.2f} · {p['badge']}</sup>"
+                                    for p in panels])
+for i, p in enumerate(panels):
+    row, col = i // grid_cols + 1, i % grid_cols + 1
+    group = p['group']
+    x = group['position'].to_numpy()
+    xbar = group['xbar'].to_numpy()
+    limits = p['limits']
+    fig.add_trace(go.Scatter(x=x, y=xbar, mode='lines+markers', marker=dict(size=4),
+                             line=dict(color='blue', width=1), showlegend=False,
+                             text=group['month'] + ' #' + group['subgroup'].astype(str),
+                             hovertemplate='%{text}: %{y:.4f}<extra></extra>'), row=row, col=col)
+    for line in (limits['ucl'], limits['lcl']):
+        fig.add_trace(go.Scatter(x=x, y=line, mode='lines', showlegend=False, hoverinfo='skip',
+                                 line=dict(color='green', dash='dash', width=1, shape='hvh')), row=row, col=col)
+    fig.add_hline(y=limits['center'], line=dict(color='red', dash='dot', width=1), row=row, col=col)
+    if p['flagged'].any():
+        fig.add_trace(go.Scatter(x=x[p['flagged']], y=xbar[p['flagged']], mode='markers', showlegend=False,
+                                 marker=dict(color='red', size=8, symbol='circle-open', line=dict(width=2))),
+                      row=row, col=col)
+    fig.layout.annotations[i].font.color = p['color']
+
+# 月份刻度放在各月起点
+fig.update_xaxes(tickvals=[offset[m] + 1 for m in span.index], ticktext=list(span.index))
+fig.update_layout(height=300 * rows + 80, margin=dict(t=80))
+st.plotly_chart(fig, use_container_width=True)
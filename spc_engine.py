@@ -0,0 +1,445 @@
+import math
+
+import numpy as np
+
+try:
+    from scipy.signal import lfilter
+except ImportError:  # 没有scipy时EWMA用NumPy分段累加计算
+    lfilter = None
+try:
+    from scipy.special import log_ndtr
+except ImportError:  # 没有scipy时正态分布函数用math.erfc逐点计算
+    log_ndtr = None
+
+# SPC控制限和Nelson判异规则，全部基于NumPy数组，一次处理整条序列
+# 控制限按每个点的子组大小n计算，月末不满SPC_Group的子组也能得到正确的限值；
+# 子组大小固定时结果与查表的A2/D3/D4、A3/B3/B4完全一致
+
+# d2、d3常数(n=2..25)，A2 = 3/(d2*sqrt(n))，D3/D4 = 1 ∓ 3*d3/d2
+_D2 = [1.128, 1.693, 2.059, 2.326, 2.534, 2.704, 2.847, 2.970, 3.078, 3.173, 3.258, 3.336,
+       3.407, 3.472, 3.532, 3.588, 3.640, 3.689, 3.735, 3.778, 3.819, 3.858, 3.895, 3.931]
+_D3 = [0.853, 0.888, 0.880, 0.864, 0.848, 0.833, 0.820, 0.808, 0.797, 0.787, 0.778, 0.770,
+       0.763, 0.756, 0.750, 0.744, 0.739, 0.733, 0.729, 0.724, 0.720, 0.716, 0.712, 0.708]
+MAX_R_GROUP = 25  # 极差图只适用于n<=25，更大的子组请用X-bar/S图
+
+D2 = np.array([np.nan, np.nan] + _D2)  # 按n直接索引
+D3 = np.array([np.nan, np.nan] + _D3)
+
+RULES = {
+    1: "1点超出3σ",
+    2: "连续9点在中心线同一侧",
+    3: "连续6点持续上升或下降",
+    4: "连续14点上下交替",
+    5: "3点中有2点在同侧2σ以外",
+    6: "5点中有4点在同侧1σ以外",
+    7: "连续15点在1σ以内",
+    8: "连续8点在中心线两侧且都在1σ以外",
+}
+
+
+def c4(n):
+    # c4 = sqrt(2/(n-1)) * Γ(n/2) / Γ((n-1)/2)，用lgamma避免大n溢出，任意n>=2都可用
+    n = np.asarray(n, dtype=float)
+    out = np.full(n.shape, np.nan)
+    ok = n >= 2
+    lg = np.vectorize(math.lgamma, otypes=[float])
+    if ok.any():
+        m = n[ok]
+        out[ok] = np.sqrt(2.0 / (m - 1)) * np.exp(lg(m / 2) - lg((m - 1) / 2))
+    return out
+
+
+def _lookup(table, n):
+    n = np.asarray(n, dtype=int)
+    out = np.full(n.shape, np.nan)
+    ok = (n >= 2) & (n <= MAX_R_GROUP)
+    out[ok] = table[n[ok]]
+    return out
+
+
+def d2_constant(n):
+    # 子组大小n对应的d2，n<2或n>25为NaN
+    return _lookup(D2, n)
+
+
+def capability(mean, sigma_within, sigma_overall, lsl, usl):
+    # Cp/Cpk用组内σ(短期)，Pp/Ppk用整体σ(长期)；支持数组，σ为0或NaN时结果为NaN
+    mean = np.asarray(mean, dtype=float)
+    lsl = np.asarray(lsl, dtype=float)
+    usl = np.asarray(usl, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        within = np.where(np.asarray(sigma_within, dtype=float) > 0, sigma_within, np.nan)
+        overall = np.where(np.asarray(sigma_overall, dtype=float) > 0, sigma_overall, np.nan)
+        nearest = np.minimum(usl - mean, mean - lsl)
+        return {
+            'cp': (usl - lsl) / (6 * within),
+            'cpk': nearest / (3 * within),
+            'pp': (usl - lsl) / (6 * overall),
+            'ppk': nearest / (3 * overall),
+        }
+
+
+def subgroup_std(n, total, sumsq):
+    # 由子组累计量求子组样本标准差，n<2的子组为NaN
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (np.asarray(sumsq, dtype=float) - np.asarray(total, dtype=float) ** 2 / n) / (n - 1)
+    var = np.where(n >= 2, np.maximum(var, 0.0), np.nan)
+    return np.sqrt(var)
+
+
+def _grand_mean(xbar, n):
+    xbar = np.asarray(xbar, dtype=float)
+    n = np.asarray(n, dtype=float)
+    return float((xbar * n).sum() / n.sum())
+
+
+def xbar_r(xbar, r, n):
+    # X-bar/R控制限: σ = mean(R/d2)，X-bar限 = 中心 ± 3σ/sqrt(n)(固定n时即A2·R̄)
+    xbar = np.asarray(xbar, dtype=float)
+    r = np.asarray(r, dtype=float)
+    n = np.asarray(n, dtype=int)
+    d2 = _lookup(D2, n)
+    d3 = _lookup(D3, n)
+    sigma = float(np.nanmean(r / d2)) if np.isfinite(d2).any() else float('nan')
+    center = _grand_mean(xbar, n)
+    half = 3 * sigma / np.sqrt(n)
+    r_center = d2 * sigma
+    return {
+        'center': center,
+        'sigma': sigma,
+        'ucl': center + half,
+        'lcl': center - half,
+        'point_sigma': sigma / np.sqrt(n),
+        'r_center': r_center,
+        'r_ucl': r_center + 3 * d3 * sigma,
+        'r_lcl': np.maximum(r_center - 3 * d3 * sigma, 0.0),
+    }
+
+
+def xbar_s(xbar, s, n):
+    # X-bar/S控制限: σ = mean(s/c4)，S图中心c4·σ，限值 ± 3σ·sqrt(1-c4²)(固定n时即B3/B4·s̄)
+    xbar = np.asarray(xbar, dtype=float)
+    s = np.asarray(s, dtype=float)
+    n = np.asarray(n, dtype=int)
+    c = c4(n)
+    sigma = float(np.nanmean(s / c)) if np.isfinite(c).any() else float('nan')
+    center = _grand_mean(xbar, n)
+    half = 3 * sigma / np.sqrt(n)
+    s_center = c * sigma
+    s_half = 3 * sigma * np.sqrt(1 - c * c)
+    return {
+        'center': center,
+        'sigma': sigma,
+        'ucl': center + half,
+        'lcl': center - half,
+        'point_sigma': sigma / np.sqrt(n),
+        's_center': s_center,
+        's_ucl': s_center + s_half,
+        's_lcl': np.maximum(s_center - s_half, 0.0),
+    }
+
+
+def imr(x):
+    # 单值-移动极差图: σ = MR̄/d2(2)，MR图上限 = D4(2)·MR̄
+    x = np.asarray(x, dtype=float)
+    mr = np.abs(np.diff(x))
+    mr_bar = float(mr.mean()) if mr.size else float('nan')
+    sigma = mr_bar / D2[2]
+    center = float(x.mean()) if x.size else float('nan')
+    return {
+        'center': center,
+        'sigma': sigma,
+        'ucl': center + 3 * sigma,
+        'lcl': center - 3 * sigma,
+        'point_sigma': np.full(x.shape, sigma),
+        'mr': np.concatenate([[np.nan], mr]) if x.size else mr,
+        'mr_center': mr_bar,
+        'mr_ucl': mr_bar * (1 + 3 * D3[2] / D2[2]),
+        'mr_lcl': 0.0,
+    }
+
+
+class RunningStats:
+    # 增量均值/方差(Welford)，一批新数据用Chan合并公式一次并入，不需要保留历史数据
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        count = values.size
+        if count == 0:
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        total = self.n + count
+        delta = batch_mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += batch_m2 + delta * delta * self.n * count / total
+        self.n = total
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else float('nan')
+
+    @property
+    def std(self):
+        return self.variance ** 0.5
+
+
+def _window_count(mask, width):
+    # 以每个点为窗口末端，统计最近width个点中mask为真的个数；不足width个点的位置为-1
+    counts = np.full(mask.size, -1, dtype=int)
+    if mask.size >= width:
+        c = np.concatenate([[0], np.cumsum(mask, dtype=int)])
+        counts[width - 1:] = c[width:] - c[:-width]
+    return counts
+
+
+def nelson_rules(x, center, sigma):
+    # 一次计算8条Nelson规则，返回{规则号: 布尔数组}，违规标记在触发窗口的最后一个点上
+    # sigma可以是每个点各自的σ(如X-bar点的σ/sqrt(n))
+    x = np.asarray(x, dtype=float)
+    # σ为0(数据完全相同)时不判异，避免浮点误差被放大成无穷大
+    sigma = np.where(np.asarray(sigma, dtype=float) > 0, sigma, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = (x - center) / sigma
+    z = np.broadcast_to(z, x.shape)
+    size = x.size
+    above = z > 0
+    below = z < 0
+
+    diff = np.diff(x)
+    up = diff > 0
+    down = diff < 0
+    trend = np.zeros(size, dtype=bool)
+    trend[1:] = (_window_count(up, 5) == 5) | (_window_count(down, 5) == 5)
+
+    alternate = np.zeros(size, dtype=bool)
+    if size >= 3:
+        flips = (np.sign(diff[1:]) * np.sign(diff[:-1])) < 0
+        alternate[2:] = _window_count(flips, 12) == 12
+
+    return {
+        1: np.abs(z) > 3,
+        2: (_window_count(above, 9) == 9) | (_window_count(below, 9) == 9),
+        3: trend,
+        4: alternate,
+        5: (_window_count(z > 2, 3) >= 2) | (_window_count(z < -2, 3) >= 2),
+        6: (_window_count(z > 1, 5) >= 4) | (_window_count(z < -1, 5) >= 4),
+        7: _window_count(np.abs(z) < 1, 15) == 15,
+        8: _window_count(np.abs(z) > 1, 8) == 8,
+    }
+
+
+def any_violation(violations):
+    return np.logical_or.reduce(list(violations.values()))
+
+
+def violation_labels(violations):
+    # 每个点违反的规则号，如"1,5"，没有违规为空字符串
+    size = len(next(iter(violations.values())))
+    labels = [[] for _ in range(size)]
+    for rule, mask in violations.items():
+        for i in np.flatnonzero(mask):
+            labels[i].append(str(rule))
+    return [','.join(item) for item in labels]
+
+
+def evaluate_stats(stats):
+    # 对spc_stats.load()返回的子组统计计算X-bar/R控制限并判异
+    n = stats['n'].to_numpy()
+    limits = xbar_r(stats['xbar'].to_numpy(), stats['r'].to_numpy(), n)
+    violations = nelson_rules(stats['xbar'].to_numpy(), limits['center'], limits['point_sigma'])
+    return limits, violations
+
+
+def _ewma_numpy(x, lam, start):
+    # z_t = a^t * (z_0 + lam * Σ x_i * a^-i)，a = 1-lam；分段计算避免a^-i溢出
+    a = 1.0 - lam
+    if a <= 0:
+        return x.copy()
+    out = np.empty_like(x)
+    chunk = max(1, int(250 / -np.log10(a)))
+    prev = start
+    for begin in range(0, x.size, chunk):
+        seg = x[begin:begin + chunk]
+        powers = a ** np.arange(1, seg.size + 1)
+        out[begin:begin + seg.size] = powers * (prev + lam * np.cumsum(seg / powers))
+        prev = out[begin + seg.size - 1]
+    return out
+
+
+def ewma(x, lam, L, mean, sigma):
+    # EWMA图: z_t = λx_t + (1-λ)z_{t-1}，z_0 = 目标均值；限值随t收敛到 ± Lσ·sqrt(λ/(2-λ))
+    x = np.asarray(x, dtype=float)
+    if lfilter is not None:
+        z = lfilter([lam], [1.0, lam - 1.0], x, zi=[(1.0 - lam) * mean])[0]
+    else:
+        z = _ewma_numpy(x, lam, mean)
+    t = np.arange(1, x.size + 1)
+    half = L * sigma * np.sqrt(lam / (2 - lam) * (1 - (1 - lam) ** (2 * t)))
+    ucl = mean + half
+    lcl = mean - half
+    return {'z': z, 'ucl': ucl, 'lcl': lcl, 'signal': (z > ucl) | (z < lcl)}
+
+
+def _lindley(steps):
+    # C_t = max(0, C_{t-1} + step_t)，C_0 = 0，等价于累计和减去其(含0的)历史最小值
+    s = np.cumsum(steps)
+    return s - np.minimum(np.minimum.accumulate(s), 0.0)
+
+
+def cusum(x, k, h, mean, sigma):
+    # 表格CUSUM: C+累计高于μ+kσ的偏差，C-累计低于μ-kσ的偏差，超过hσ报警
+    x = np.asarray(x, dtype=float)
+    upper = _lindley(x - (mean + k * sigma))
+    lower = _lindley((mean - k * sigma) - x)
+    limit = h * sigma
+    return {'upper': upper, 'lower': lower, 'h': limit, 'signal': (upper > limit) | (lower > limit)}
+
+
+def baseline(x, size):
+    # 用前size个点估计目标均值和σ(移动极差法，对缓慢漂移不敏感)
+    x = np.asarray(x, dtype=float)[:size]
+    if x.size < 2:
+        return float('nan'), float('nan')
+    return float(x.mean()), float(np.abs(np.diff(x)).mean() / D2[2])
+
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+PERCENTILE_LOW, PERCENTILE_HIGH = 0.135, 99.865  # 正态分布±3σ对应的百分位
+NORMAL_ALPHA = 0.05  # 正态性检验显著性水平
+
+
+def _log_norm_cdf(z):
+    # ln Φ(z)，用erfc计算，尾部不会因为1-Φ下溢为0
+    if log_ndtr is not None:
+        return log_ndtr(np.asarray(z, dtype=float))
+    return np.log(0.5 * _erfc(-np.asarray(z, dtype=float) / math.sqrt(2)).astype(float))
+
+
+def anderson_darling(x):
+    # 参数未知(用样本均值和标准差)的正态性Anderson-Darling检验，返回(A*², p值)
+    # p值用D'Agostino & Stephens(1986)的分段近似
+    x = np.sort(np.asarray(x, dtype=float))
+    n = x.size
+    if n < 8:
+        return float('nan'), float('nan')
+    sd = x.std(ddof=1)
+    if sd == 0:
+        return float('inf'), 0.0
+    z = (x - x.mean()) / sd
+    i = np.arange(1, n + 1)
+    a2 = -n - np.sum((2 * i - 1) * (_log_norm_cdf(z) + _log_norm_cdf(-z[::-1]))) / n
+    a2 *= 1 + 0.75 / n + 2.25 / n ** 2
+    if a2 < 0.2:
+        p = 1 - math.exp(-13.436 + 101.14 * a2 - 223.73 * a2 ** 2)
+    elif a2 < 0.34:
+        p = 1 - math.exp(-8.318 + 42.796 * a2 - 59.938 * a2 ** 2)
+    elif a2 < 0.6:
+        p = math.exp(0.9177 - 4.279 * a2 - 1.38 * a2 ** 2)
+    elif a2 < 13:
+        p = math.exp(1.2937 - 5.709 * a2 + 0.0186 * a2 ** 2)
+    else:
+        p = 0.0
+    return float(a2), float(min(max(p, 0.0), 1.0))
+
+
+def skewness(x):
+    x = np.asarray(x, dtype=float)
+    sd = x.std()
+    return float(((x - x.mean()) ** 3).mean() / sd ** 3) if sd > 0 else 0.0
+
+
+def boxcox_transform(x, lam):
+    x = np.asarray(x, dtype=float)
+    return np.log(x) if abs(lam) < 1e-8 else (x ** lam - 1) / lam
+
+
+def boxcox_lambda(x, grid=np.linspace(-5, 5, 201)):
+    # 极大化Box-Cox剖面对数似然，先在网格上整体计算，再在最优点附近细化；x必须为正
+    x = np.asarray(x, dtype=float)
+    logs = np.log(x)
+    log_sum = logs.sum()
+
+    def loglik(lams):
+        lams = np.atleast_1d(lams)[:, None]
+        safe = np.where(np.abs(lams) < 1e-8, 1.0, lams)
+        y = np.where(np.abs(lams) < 1e-8, logs, (x ** safe - 1) / safe)
+        return -x.size / 2 * np.log(y.var(axis=1)) + (lams[:, 0] - 1) * log_sum
+
+    best = grid[np.nanargmax(loglik(grid))]
+    step = grid[1] - grid[0]
+    fine = np.linspace(best - step, best + step, 41)
+    return float(fine[np.nanargmax(loglik(fine))])
+
+
+def _boxcox_limit(limit, shift, lam):
+    # 规格限按同样的平移和λ变换；λ>0时0也在定义域内(映射为-1/λ)
+    if limit is None or limit + shift < 0 or (limit + shift == 0 and lam <= 0):
+        return None
+    return float(boxcox_transform(limit + shift, lam))
+
+
+def _ppk(mean, sd, lsl, usl):
+    sides = []
+    if usl is not None and np.isfinite(usl):
+        sides.append((usl - mean) / (3 * sd))
+    if lsl is not None and np.isfinite(lsl):
+        sides.append((mean - lsl) / (3 * sd))
+    return float(min(sides)) if sides and sd > 0 else float('nan')
+
+
+def nonnormal_capability(x, lsl, usl):
+    # 正态性检验 + Box-Cox变换后的Ppk + 百分位法Ppk(ISO 22514-4)，并给出建议采用的结果
+    x = np.asarray(x, dtype=float)
+    x = x[np.isfinite(x)]
+    result = {'n': int(x.size), 'mean': float('nan'), 'std': float('nan'), 'skewness': float('nan'),
+              'ad': float('nan'), 'p': float('nan'), 'normal_ppk': float('nan'),
+              'boxcox_lambda': float('nan'), 'boxcox_shift': 0.0, 'boxcox_p': float('nan'),
+              'boxcox_ppk': float('nan'), 'percentile_ppk': float('nan'), 'method': 'normal'}
+    if x.size < 8:
+        return result
+    result['mean'] = float(x.mean())
+    result['std'] = float(x.std(ddof=1))
+    result['skewness'] = skewness(x)
+    result['ad'], result['p'] = anderson_darling(x)
+    result['normal_ppk'] = _ppk(result['mean'], result['std'], lsl, usl)
+
+    # 百分位法: 用0.135%/50%/99.865%分位代替均值±3σ
+    low, median, high = np.percentile(x, [PERCENTILE_LOW, 50, PERCENTILE_HIGH])
+    sides = []
+    if usl is not None and high > median:
+        sides.append((usl - median) / (high - median))
+    if lsl is not None and median > low:
+        sides.append((median - lsl) / (median - low))
+    if sides:
+        result['percentile_ppk'] = float(min(sides))
+
+    # Box-Cox: 数据有0或负值时整体平移到正数(下界为0的数据很常见)
+    shift = 0.0
+    if x.min() <= 0:
+        spread = x.max() - x.min()
+        shift = -x.min() + (spread * 0.01 if spread > 0 else 1.0)
+    if np.ptp(x) > 0:
+        lam = boxcox_lambda(x + shift)
+        y = boxcox_transform(x + shift, lam)
+        # 规格限一起变换；落在变换定义域以外的一侧视为自然边界，只算单侧
+        t_lsl = _boxcox_limit(lsl, shift, lam)
+        t_usl = _boxcox_limit(usl, shift, lam)
+        result['boxcox_lambda'] = lam
+        result['boxcox_shift'] = shift
+        result['boxcox_p'] = anderson_darling(y)[1]
+        result['boxcox_ppk'] = _ppk(float(y.mean()), float(y.std(ddof=1)), t_lsl, t_usl)
+
+    if result['p'] >= NORMAL_ALPHA:
+        result['method'] = 'normal'
+    elif result['boxcox_p'] >= NORMAL_ALPHA:
+        result['method'] = 'boxcox'
+    else:
+        result['method'] = 'percentile'
+    return result
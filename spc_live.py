@@ -0,0 +1,138 @@
+from collections import deque
+
+import numpy as np
+
+from config import SPC_Group
+import db
+import spc_engine
+
+# 实时控制图的数据序列: 首次读取最近window个子组，之后每次只查询row_version大于上次读到的变化
+# 子组按导入顺序(id)每SPC_Group个划分；控制限用增量统计，随新数据更新，不再重读整月
+# 导入按自然键覆盖更新时id不变但row_version变大: 新的id追加到序列末尾，已读入的点被改过时重新读取窗口
+
+TAIL_SQL = '''
+SELECT id, measurement_value, measurement_date FROM measurement_data
+WHERE pn = ? AND parameter_name = ?
+ORDER BY id DESC LIMIT ?
+'''
+VERSION_SQL = '''
+SELECT MAX(row_version) FROM measurement_data
+WHERE pn = ? AND parameter_name = ?
+'''
+DELTA_SQL = '''
+SELECT id, measurement_value, measurement_date, row_version FROM measurement_data
+WHERE pn = ? AND parameter_name = ? AND row_version > ?
+ORDER BY id
+'''
+
+
+class LiveSeries:
+    def __init__(self, pn, parameter_name, window=50, group_size=SPC_Group):
+        self.pn = pn
+        self.parameter_name = parameter_name
+        self.window = window
+        self.group_size = group_size
+        self._reset()
+
+    def _reset(self):
+        self.first_seen = 0  # 已读入的最小id，更早的数据不在统计里
+        self.last_seen = 0  # 已读入的最大id
+        self.last_version = 0
+        self.values = spc_engine.RunningStats()  # 单值的均值和整体方差
+        self.ranges = spc_engine.RunningStats()  # 已满子组的平均极差R̄
+        self.subgroups = deque(maxlen=self.window)  # [n, sum, min, max, 最后日期]，最后一个可能未满
+        self.count = 0  # 已读入的子组序号，用作横轴
+
+    def _reload(self, conn):
+        # 重新读取最近window个子组，先取版本号，之后写入的变化下次poll再读
+        self._reset()
+        key = (self.pn, self.parameter_name)
+        self.last_version = conn.execute(VERSION_SQL, key).fetchone()[0] or 0
+        rows = conn.execute(TAIL_SQL, key + (self.window * self.group_size,)).fetchall()[::-1]
+        if rows:
+            self.first_seen = rows[0][0]
+        return self._read(rows)
+
+    def poll(self):
+        # 读取新数据并更新子组和统计量，返回新读到或被更新的条数
+        with db.connection() as conn:
+            if self.last_seen == 0:
+                return self._reload(conn)
+            rows = conn.execute(DELTA_SQL, (self.pn, self.parameter_name, self.last_version)).fetchall()
+            if not rows:
+                return 0
+            self.last_version = max(row[3] for row in rows)
+            if any(self.first_seen <= row[0] <= self.last_seen for row in rows):
+                # 已显示的点被覆盖更新，增量统计无法撤回旧值，重读窗口
+                self._reload(conn)
+                return len(rows)
+        return self._read([row for row in rows if row[0] > self.last_seen])
+
+    def _read(self, rows):
+        if not rows:
+            return 0
+        self.last_seen = rows[-1][0]
+        values = np.array([row[1] for row in rows], dtype=float)
+        self.values.update(values)
+        self._append(values, [row[2] for row in rows])
+        return len(rows)
+
+    def _append(self, values, dates):
+        # 先补满最后一个未满的子组，其余按group_size切分
+        start = 0
+        if self.subgroups and self.subgroups[-1][0] < self.group_size:
+            last = self.subgroups[-1]
+            fill = min(self.group_size - last[0], values.size)
+            head = values[:fill]
+            last[0] += fill
+            last[1] += float(head.sum())
+            last[2] = min(last[2], float(head.min()))
+            last[3] = max(last[3], float(head.max()))
+            last[4] = dates[fill - 1]
+            if last[0] == self.group_size:
+                self.ranges.update([last[3] - last[2]])
+            start = fill
+        for i in range(start, values.size, self.group_size):
+            chunk = values[i:i + self.group_size]
+            self.count += 1
+            group = [chunk.size, float(chunk.sum()), float(chunk.min()), float(chunk.max()),
+                     dates[i + chunk.size - 1], self.count]
+            if chunk.size == self.group_size:
+                self.ranges.update([group[3] - group[2]])
+            self.subgroups.append(group)
+
+    def limits(self):
+        # 组内σ = R̄/d2；还没有满的子组时退回整体标准差
+        d2 = spc_engine.d2_constant(self.group_size)
+        if self.ranges.n and np.isfinite(d2):
+            sigma = self.ranges.mean / float(d2)
+        else:
+            sigma = self.values.std
+        return {
+            'center': self.values.mean,
+            'sigma': sigma,
+            'sigma_overall': self.values.std,
+            'r_bar': self.ranges.mean if self.ranges.n else float('nan'),
+            'n': self.values.n,
+        }
+
+    def frame(self):
+        # 当前窗口内各子组的序号、均值、极差和对应控制限及判异结果
+        groups = list(self.subgroups)
+        n = np.array([g[0] for g in groups], dtype=float)
+        xbar = np.array([g[1] for g in groups]) / n if groups else np.array([])
+        r = np.array([g[3] - g[2] for g in groups], dtype=float)
+        limits = self.limits()
+        point_sigma = limits['sigma'] / np.sqrt(n)
+        violations = spc_engine.nelson_rules(xbar, limits['center'], point_sigma)
+        return {
+            'subgroup': [g[5] for g in groups],
+            'date': [g[4] for g in groups],
+            'n': n,
+            'xbar': xbar,
+            'r': r,
+            'ucl': limits['center'] + 3 * point_sigma,
+            'lcl': limits['center'] - 3 * point_sigma,
+            'limits': limits,
+            'violations': violations,
+        }
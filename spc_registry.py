@@ -0,0 +1,199 @@
+import time
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from config import SPC_SHIFT_DEFAULT
+import db
+
+# SPC参数注册表: 参数和规格限存在数据库里，页面和导入通过内存索引查找，不再扫描config.SPC_DATA
+# 规格限带生效日期，同一参数可以有多个版本，按测量日期取当时有效的版本
+# EWMA/CUSUM小偏移检测参数[λ, L, k, h]也按参数存在这里，没有设置的参数用config.SPC_SHIFT_DEFAULT
+# 表有任何修改时触发器把版本号加1，各进程定期比较版本号，变了就重新加载，不需要重启
+
+Parameter = namedtuple('Parameter', ['id', 'pn', 'name', 'sn_col', 'value_col', 'start_row', 'active'])
+
+CHECK_INTERVAL = 5  # 两次检查版本号之间至少间隔的秒数
+SEED_EFFECTIVE_FROM = '1900-01-01'  # 从config.SPC_DATA迁移来的规格限的生效日期
+
+
+def seed(conn, spc_data):
+    # 把config.SPC_DATA的 [SN列, 值列, 起始行, LSL, USL, PN] 导入注册表
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for name, config in spc_data.items():
+        conn.execute('''
+        INSERT OR IGNORE INTO spc_parameters (pn, parameter_name, sn_col, value_col, start_row, updated_by, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'config', ?)''', (config[5], name, config[0], config[1], config[2], now))
+        conn.execute('''
+        INSERT OR IGNORE INTO spc_spec_limits (parameter_id, effective_from, lsl, usl, created_by, created_at)
+        SELECT id, ?, ?, ?, 'config', ? FROM spc_parameters WHERE pn = ? AND parameter_name = ?
+        ''', (SEED_EFFECTIVE_FROM, config[3], config[4], now, config[5], name))
+
+
+def seed_shift(conn, spc_shift):
+    # 把config.SPC_SHIFT的 参数名 -> [λ, L, k, h] 导入注册表，同名参数的各个PN都用这组值
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for name, (lam, L, k, h) in spc_shift.items():
+        conn.execute('''
+        INSERT OR IGNORE INTO spc_shift_settings
+            (parameter_id, ewma_lambda, ewma_l, cusum_k, cusum_h, updated_by, updated_at)
+        SELECT id, ?, ?, ?, ?, 'config', ? FROM spc_parameters WHERE parameter_name = ?
+        ''', (lam, L, k, h, now, name))
+
+
+class Registry:
+    # 某个版本的注册表快照，只读，可以传给导入子进程
+
+    def __init__(self, version, parameters, limits, shifts=()):
+        self.version = version
+        self.by_key = {}  # (pn, 参数名) -> Parameter
+        self.by_pn = {}  # pn -> [Parameter]，按参数名排序
+        self.by_name = {}  # 参数名 -> [Parameter]
+        for parameter in parameters:
+            self.by_key[(parameter.pn, parameter.name)] = parameter
+            if parameter.active:
+                self.by_pn.setdefault(parameter.pn, []).append(parameter)
+                self.by_name.setdefault(parameter.name, []).append(parameter)
+        for items in self.by_pn.values():
+            items.sort(key=lambda p: p.name)
+        # parameter_id -> (生效日期列表(升序), [(lsl, usl)])
+        self._limits = {}
+        for parameter_id, effective_from, lsl, usl in limits:
+            dates, values = self._limits.setdefault(parameter_id, ([], []))
+            dates.append(effective_from)
+            values.append((lsl, usl))
+        # parameter_id -> (λ, L, k, h)
+        self._shifts = {parameter_id: tuple(values) for parameter_id, *values in shifts}
+
+    def pns(self):
+        return sorted(self.by_pn)
+
+    def parameters(self, pn=None):
+        if pn is None:
+            return [p for pn in self.pns() for p in self.by_pn[pn]]
+        return self.by_pn.get(pn, [])
+
+    def parameter(self, pn, name):
+        return self.by_key.get((pn, name))
+
+    def limits_at(self, pn, name, date):
+        # 某日期生效的(LSL, USL)；date为'YYYY-MM-DD'，也可以是'YYYY-MM-31'表示月末
+        parameter = self.by_key.get((pn, name))
+        if parameter is None or parameter.id not in self._limits:
+            return None, None
+        dates, values = self._limits[parameter.id]
+        i = bisect_right(dates, str(date)) - 1
+        return values[i] if i >= 0 else (None, None)
+
+    def limits_history(self, pn, name):
+        parameter = self.by_key.get((pn, name))
+        if parameter is None or parameter.id not in self._limits:
+            return []
+        dates, values = self._limits[parameter.id]
+        return [(date, lsl, usl) for date, (lsl, usl) in zip(dates, values)]
+
+    def limits_changed(self, pn, name, start, end):
+        # start~end之间(不含start当天)规格限是否换过版本
+        return any(start < date <= end for date, _, _ in self.limits_history(pn, name))
+
+    def shift_settings(self, pn, name):
+        # EWMA/CUSUM参数(λ, L, k, h)，没有单独设置时返回默认值
+        parameter = self.by_key.get((pn, name))
+        if parameter is None or parameter.id not in self._shifts:
+            return tuple(SPC_SHIFT_DEFAULT)
+        return self._shifts[parameter.id]
+
+
+def current_version(conn):
+    row = conn.execute("SELECT version FROM spc_registry_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def load(conn):
+    version = current_version(conn)
+    parameters = [Parameter(*row) for row in conn.execute('''
+    SELECT id, pn, parameter_name, sn_col, value_col, start_row, active FROM spc_parameters
+    ''')]
+    limits = conn.execute('''
+    SELECT parameter_id, effective_from, lsl, usl FROM spc_spec_limits
+    ORDER BY parameter_id, effective_from
+    ''').fetchall()
+    shifts = conn.execute('''
+    SELECT parameter_id, ewma_lambda, ewma_l, cusum_k, cusum_h FROM spc_shift_settings
+    ''').fetchall()
+    return Registry(version, parameters, limits, shifts)
+
+
+_registry = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get(conn=None):
+    # 返回当前注册表；每CHECK_INTERVAL秒最多查一次版本号，版本变了才重新加载
+    # 调用方已经持有连接时传进来，避免再从连接池借一个
+    global _registry, _checked_at
+    now = time.monotonic()
+    if _registry is not None and now - _checked_at < CHECK_INTERVAL:
+        return _registry
+    with _lock:
+        if _registry is None or now - _checked_at >= CHECK_INTERVAL:
+            if conn is None:
+                with db.connection() as conn:
+                    _refresh(conn)
+            else:
+                _refresh(conn)
+            _checked_at = now
+    return _registry
+
+
+def _refresh(conn):
+    global _registry
+    if _registry is None or current_version(conn) != _registry.version:
+        _registry = load(conn)
+
+
+def reload():
+    global _checked_at
+    _checked_at = 0.0
+    return get()
+
+
+def save_parameter(pn, name, sn_col, value_col, start_row, active, username):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db.connection() as conn:
+        conn.execute('''
+        INSERT INTO spc_parameters (pn, parameter_name, sn_col, value_col, start_row, active, updated_by, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(pn, parameter_name) DO UPDATE SET
+            sn_col = excluded.sn_col, value_col = excluded.value_col, start_row = excluded.start_row,
+            active = excluded.active, updated_by = excluded.updated_by, updated_at = excluded.updated_at
+        ''', (pn, name, sn_col, value_col, start_row, int(active), username, now))
+    return reload()
+
+
+def add_spec_limits(pn, name, effective_from, lsl, usl, username):
+    # 新增一个规格限版本；同一天再次设置时覆盖当天的版本
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db.connection() as conn:
+        conn.execute('''
+        INSERT INTO spc_spec_limits (parameter_id, effective_from, lsl, usl, created_by, created_at)
+        SELECT id, ?, ?, ?, ?, ? FROM spc_parameters WHERE pn = ? AND parameter_name = ?
+        ON CONFLICT(parameter_id, effective_from) DO UPDATE SET
+            lsl = excluded.lsl, usl = excluded.usl, created_by = excluded.created_by, created_at = excluded.created_at
+        ''', (str(effective_from), lsl, usl, username, now, pn, name))
+    return reload()
+
+
+def save_shift_settings(pn, name, lam, L, k, h, username):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db.connection() as conn:
+        conn.execute('''
+        INSERT INTO spc_shift_settings (parameter_id, ewma_lambda, ewma_l, cusum_k, cusum_h, updated_by, updated_at)
+        SELECT id, ?, ?, ?, ?, ?, ? FROM spc_parameters WHERE pn = ? AND parameter_name = ?
+        ON CONFLICT(parameter_id) DO UPDATE SET
+            ewma_lambda = excluded.ewma_lambda, ewma_l = excluded.ewma_l, cusum_k = excluded.cusum_k,
+            cusum_h = excluded.cusum_h, updated_by = excluded.updated_by, updated_at = excluded.updated_at
+        ''', (lam, L, k, h, username, now, pn, name))
+    return reload()
@@ -0,0 +1,219 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+from config import SPC_Group
+import db
+import spc_engine
+
+# 按(pn, 参数, 月份, 子组)累计的统计量，导入时增量更新，画图和CPK只读这张表
+# 子组划分与原来一致: 同一月份内按(measurement_date, id)排序，每SPC_Group个数据一组，组号从1开始
+
+STATS_COLUMNS = ['pn', 'parameter_name', 'month', 'subgroup', 'n', 'sum', 'sumsq', 'min', 'max']
+
+UPSERT_SQL = '''
+INSERT INTO spc_subgroup_stats (pn, parameter_name, month, subgroup, n, sum, sumsq, min, max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(pn, parameter_name, month, subgroup) DO UPDATE SET
+    n = excluded.n, sum = excluded.sum, sumsq = excluded.sumsq,
+    min = excluded.min, max = excluded.max
+'''
+
+
+def summarize(values, first_subgroup=1, group_size=SPC_Group):
+    # 把按顺序排列的数值切成子组，返回每组的(subgroup, n, sum, sumsq, min, max)
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return []
+    starts = np.arange(0, values.size, group_size)
+    n = np.diff(np.append(starts, values.size))
+    sums = np.add.reduceat(values, starts)
+    sumsq = np.add.reduceat(values * values, starts)
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    subgroups = np.arange(first_subgroup, first_subgroup + starts.size)
+    return list(zip(subgroups.tolist(), n.tolist(), sums.tolist(), sumsq.tolist(),
+                    mins.tolist(), maxs.tolist()))
+
+
+def append(conn, pn, parameter_name, month, values, group_size=SPC_Group):
+    # 新数据排在该月已有数据之后: 先补满最后一个未满的子组，剩下的继续分组
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return
+    last = conn.execute('''
+    SELECT subgroup, n, sum, sumsq, min, max FROM spc_subgroup_stats
+    WHERE pn = ? AND parameter_name = ? AND month = ?
+    ORDER BY subgroup DESC LIMIT 1
+    ''', (pn, parameter_name, month)).fetchone()
+
+    rows = []
+    next_subgroup = 1
+    if last is not None:
+        subgroup, n, total, sumsq, lo, hi = last
+        next_subgroup = subgroup + 1
+        fill = min(group_size - n, values.size)
+        if fill > 0:
+            head = values[:fill]
+            rows.append((subgroup, n + fill, total + head.sum(), sumsq + (head * head).sum(),
+                         min(lo, head.min()), max(hi, head.max())))
+            values = values[fill:]
+    rows.extend(summarize(values, next_subgroup, group_size))
+    conn.executemany(UPSERT_SQL, [(pn, parameter_name, month) + tuple(row) for row in rows])
+
+
+def rebuild(conn, pn=None, parameter_name=None, month=None):
+    # 从measurement_data重新计算(可只限定某个pn/参数/月份)
+    where = []
+    params = []
+    for column, value in [('pn', pn), ('parameter_name', parameter_name), ('measurement_month', month)]:
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    conn.execute(f"DELETE FROM spc_subgroup_stats {where_sql.replace('measurement_month', 'month')}", params)
+    df = pd.read_sql(f'''
+    SELECT pn, parameter_name, measurement_month AS month, measurement_value
+    FROM measurement_data {where_sql}
+    ORDER BY pn, parameter_name, measurement_month, measurement_date, id
+    ''', conn, params=params)
+    if df.empty:
+        return 0
+
+    df['subgroup'] = df.groupby(['pn', 'parameter_name', 'month']).cumcount() // SPC_Group + 1
+    df['sq'] = df['measurement_value'] ** 2
+    stats = df.groupby(['pn', 'parameter_name', 'month', 'subgroup'], sort=False).agg(
+        n=('measurement_value', 'size'),
+        sum=('measurement_value', 'sum'),
+        sumsq=('sq', 'sum'),
+        min=('measurement_value', 'min'),
+        max=('measurement_value', 'max'),
+    ).reset_index()
+    conn.executemany(UPSERT_SQL, stats[STATS_COLUMNS].itertuples(index=False, name=None))
+    return len(stats)
+
+
+def load(pn, parameter_name, month):
+    # 读取某月的子组统计(带查询缓存)，并算出每组的均值和极差
+    df = db.cached_read_sql('''
+    SELECT subgroup, n, sum, sumsq, min, max FROM spc_subgroup_stats
+    WHERE pn = ? AND parameter_name = ? AND month = ?
+    ORDER BY subgroup
+    ''', params=(pn, parameter_name, month))
+    df['xbar'] = df['sum'] / df['n']
+    df['r'] = df['max'] - df['min']
+    return df.set_index('subgroup')
+
+
+def load_many(pns, since_month):
+    # 多个PN所有参数从since_month起的子组统计，一次查询(走主键索引)，看板用
+    if not pns:
+        return pd.DataFrame(columns=['pn', 'parameter_name', 'month', 'subgroup', 'n', 'sum', 'sumsq',
+                                     'min', 'max', 'xbar', 'r'])
+    placeholders = ', '.join('?' * len(pns))
+    df = db.cached_read_sql(f'''
+    SELECT pn, parameter_name, month, subgroup, n, sum, sumsq, min, max FROM spc_subgroup_stats
+    WHERE pn IN ({placeholders}) AND month >= ?
+    ORDER BY pn, parameter_name, month, subgroup
+    ''', params=(*pns, since_month))
+    df['xbar'] = df['sum'] / df['n']
+    df['r'] = df['max'] - df['min']
+    return df
+
+
+def load_values(pn, parameter_name):
+    # 某参数的全部单值，顺序与子组划分一致
+    return db.cached_read_sql('''
+    SELECT measurement_value, measurement_date FROM measurement_data
+    WHERE pn = ? AND parameter_name = ?
+    ORDER BY measurement_date, id
+    ''', params=(pn, parameter_name))
+
+
+def daily_summary(pn, parameter_name, month):
+    # 某月按测量日期汇总的样本数、和、平方和，用于按当天生效的规格限分段计算CPK
+    return db.cached_read_sql('''
+    SELECT measurement_date, COUNT(*) AS n, SUM(measurement_value) AS sum,
+           SUM(measurement_value * measurement_value) AS sumsq
+    FROM measurement_data
+    WHERE pn = ? AND parameter_name = ? AND measurement_month = ?
+    GROUP BY measurement_date
+    ORDER BY measurement_date
+    ''', params=(pn, parameter_name, month))
+
+
+def overall(stats):
+    # 由子组累计量合并出整体样本数、均值和样本标准差
+    n = stats['n'].sum()
+    total = stats['sum'].sum()
+    mean = total / n if n else float('nan')
+    if n > 1:
+        variance = max((stats['sumsq'].sum() - total * total / n) / (n - 1), 0.0)
+        std = variance ** 0.5
+    else:
+        std = float('nan')
+    return n, mean, std
+
+
+def month_summary(min_count=1):
+    # 一条分组查询得到所有(pn, 参数, 月份)的整体统计和组内σ(R̄/d2)，批量能力报告用
+    # 按子组大小n再分一层，d2随n不同，在pandas里换算后合并
+    df = db.cached_read_sql('''
+    SELECT pn, parameter_name, month, n, COUNT(*) AS subgroups,
+           SUM(n) AS count, SUM(sum) AS sum, SUM(sumsq) AS sumsq, SUM(max - min) AS range_sum
+    FROM spc_subgroup_stats
+    GROUP BY pn, parameter_name, month, n
+    ''')
+    if df.empty:
+        return pd.DataFrame(columns=['pn', 'parameter_name', 'month', 'n', 'mean', 'sigma_within', 'sigma_overall'])
+
+    d2 = spc_engine.d2_constant(df['n'].to_numpy())
+    usable = np.isfinite(d2)
+    df['r_over_d2'] = np.where(usable, df['range_sum'] / np.where(usable, d2, 1.0), 0.0)
+    df['r_groups'] = np.where(usable, df['subgroups'], 0)
+
+    keys = ['pn', 'parameter_name', 'month']
+    agg = df.groupby(keys, sort=True)[['count', 'sum', 'sumsq', 'r_over_d2', 'r_groups']].sum().reset_index()
+    agg = agg[agg['count'] >= min_count]
+    n = agg['count'].astype(float)
+    agg['mean'] = agg['sum'] / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (agg['sumsq'] - agg['sum'] ** 2 / n) / (n - 1)
+        agg['sigma_within'] = agg['r_over_d2'] / agg['r_groups'].replace(0, np.nan)
+    agg['sigma_overall'] = np.sqrt(variance.clip(lower=0).where(n > 1))
+    return agg.rename(columns={'count': 'n'})[
+        ['pn', 'parameter_name', 'month', 'n', 'mean', 'sigma_within', 'sigma_overall']]
+
+
+def month_values(pn, parameter_name, month):
+    # 某参数某月的全部单值及测量日期，非正态能力分析用
+    return db.cached_read_sql('''
+    SELECT measurement_value, measurement_date FROM measurement_data
+    WHERE pn = ? AND parameter_name = ? AND measurement_month = ?
+    ORDER BY measurement_date, id
+    ''', params=(pn, parameter_name, month))
+
+
+def segment_version(pn, parameter_name, month, start, end):
+    # 某段数据的(条数, 最大row_version): 新增、删除或导入覆盖更新了值都会变；查询走cached_read_sql，导入后随measurement_data失效
+    row = db.cached_read_sql('''
+    SELECT COUNT(*) AS n, COALESCE(MAX(row_version), 0) AS version FROM measurement_data
+    WHERE pn = ? AND parameter_name = ? AND measurement_month = ? AND measurement_date BETWEEN ? AND ?
+    ''', params=(pn, parameter_name, month, start, end)).iloc[0]
+    return int(row['n']), int(row['version'])
+
+
+def nonnormal_capability(pn, parameter_name, month, start, end, lsl, usl):
+    # 正态性检验和Box-Cox/百分位法能力指数，按(pn, 参数, 月份, 规格段, 段内数据版本)缓存，切换页面或视图不重复拟合
+    return _nonnormal_capability(pn, parameter_name, month, start, end, lsl, usl,
+                                 segment_version(pn, parameter_name, month, start, end))
+
+
+@functools.lru_cache(maxsize=256)
+def _nonnormal_capability(pn, parameter_name, month, start, end, lsl, usl, version):
+    data = month_values(pn, parameter_name, month)
+    dates = data['measurement_date']
+    values = data['measurement_value'].to_numpy()[((dates >= start) & (dates <= end)).to_numpy()]
+    return spc_engine.nonnormal_capability(values, lsl, usl)
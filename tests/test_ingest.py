@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from config import SPC_PN, SPC_Group
+import db
+import ingest
+import migrations
+import spc_registry
+import spc_stats
+from spc_registry import Parameter, Registry
+
+PN = 'TEST-PN'
+
+
+def make_registry():
+    # 一个参数: SN在第1列，值在第2列，从第2行开始
+    parameter = Parameter(1, PN, 'gap', 1, 2, 2, 1)
+    return Registry(1, [parameter], [(1, '1900-01-01', 0.0, 1.0)])
+
+
+def test_blank_sn_rows_are_logged_not_written():
+    df = pd.DataFrame({
+        0: ['SN', 'A001', None, '   ', np.nan, 'A005'],
+        1: ['value', 0.1, 0.2, 0.3, 0.4, 0.5],
+    })
+    batches, errors = ingest.extract_measurements(df, PN, 'blank.xlsx', registry=make_registry(),
+                                                  current_date='2026-01-01')
+
+    assert len(batches) == 1
+    assert batches[0]['sn'].tolist() == ['A001', 'A005']
+    assert batches[0]['value'].tolist() == [0.1, 0.5]
+    assert errors == [('blank.xlsx', f"行{n}: SN为空 (gap)") for n in (3, 4, 5)]
+
+
+def test_blank_sn_with_invalid_value_is_reported_once():
+    df = pd.DataFrame({
+        0: ['SN', '', 'A002'],
+        1: ['value', 'abc', 'xyz'],
+    })
+    batches, errors = ingest.extract_measurements(df, PN, 'bad.xlsx', registry=make_registry(),
+                                                  current_date='2026-01-01')
+
+    assert batches == []
+    assert errors == [('bad.xlsx', "行2: SN为空 (gap)"), ('bad.xlsx', "行3: 无效数值 'xyz' (gap)")]
+
+
+# 以下用临时数据库跑完整的process_files: 解析 -> 写入 -> 子组统计 -> 登记文件哈希 -> 移到success
+DATE = '2026-01-15'
+SNS = [f"A{i:03d}" for i in range(12)]
+
+
+@pytest.fixture
+def import_db(tmp_path, monkeypatch):
+    # 迁移好的临时数据库，连接池和查询缓存都指向它；注册表里加一个测试参数(SN第1列，值第2列，Excel第6行开始)
+    database = str(tmp_path / 'test.db')
+    conn = db.connect(database)
+    migrations.migrate(conn)
+    with conn:
+        conn.execute('''
+        INSERT INTO spc_parameters (pn, parameter_name, sn_col, value_col, start_row) VALUES (?, 'gap', 1, 2, 5)
+        ''', (PN,))
+        conn.execute('''
+        INSERT INTO spc_spec_limits (parameter_id, effective_from, lsl, usl)
+        SELECT id, '1900-01-01', 0.0, 10.0 FROM spc_parameters WHERE pn = ?
+        ''', (PN,))
+    monkeypatch.setattr(db, '_pool', db.ConnectionPool(database))
+    monkeypatch.setattr(spc_registry, '_registry', None)
+    db.clear_cache()
+    yield conn
+    db.get_pool().close_all()
+    db.clear_cache()
+    conn.close()
+
+
+@pytest.fixture
+def stats_calls(monkeypatch):
+    # 记录write_measurements走的是增量追加还是按月重算
+    calls = []
+    append, rebuild = spc_stats.append, spc_stats.rebuild
+
+    def spy_append(conn, pn, parameter_name, month, values, *args, **kwargs):
+        calls.append('append')
+        return append(conn, pn, parameter_name, month, values, *args, **kwargs)
+
+    def spy_rebuild(conn, pn=None, parameter_name=None, month=None):
+        calls.append('rebuild')
+        return rebuild(conn, pn, parameter_name, month)
+
+    monkeypatch.setattr(spc_stats, 'append', spy_append)
+    monkeypatch.setattr(spc_stats, 'rebuild', spy_rebuild)
+    return calls
+
+
+def make_workbook(path, values):
+    # 与T&A导出的格式一致: 第1行表头，PN在SPC_PN单元格，测量数据从第6行开始
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['SN', 'gap'])
+    for row in range(2, 6):
+        ws.append([PN if row == SPC_PN[0] + 1 else None, None])
+    for sn, value in zip(SNS, values):
+        ws.append([sn, value])
+    wb.save(path)
+
+
+def import_once(conn, folder, filename, values):
+    make_workbook(folder / filename, values)
+    results = list(ingest.process_files(conn, [filename], DATE, str(folder), max_workers=1))
+    assert len(results) == 1
+    assert results[0]['errors'] == []
+    assert not (folder / filename).exists()
+    assert (folder / 'success' / filename).exists()
+    return results[0]
+
+
+def measurements(conn):
+    return conn.execute('''
+    SELECT sn, measurement_value FROM measurement_data WHERE pn = ? ORDER BY sn
+    ''', (PN,)).fetchall()
+
+
+def subgroups(conn):
+    return conn.execute('''
+    SELECT subgroup, n, sum, min, max FROM spc_subgroup_stats
+    WHERE pn = ? AND parameter_name = 'gap' AND month = ? ORDER BY subgroup
+    ''', (PN, DATE[:7])).fetchall()
+
+
+def expected_subgroups(values):
+    values = np.asarray(values)
+    return [(k // SPC_Group + 1, len(group), pytest.approx(group.sum()), group.min(), group.max())
+            for k, group in ((k, values[k:k + SPC_Group]) for k in range(0, len(values), SPC_Group))]
+
+
+def test_process_files_twice_skips_identical_file(import_db, stats_calls, tmp_path):
+    values = [round(1.0 + 0.1 * i, 2) for i in range(len(SNS))]
+    first = import_once(import_db, tmp_path, 'first.xlsx', values)
+    assert first['duplicate'] is False
+    assert first['records'] == len(SNS)
+    assert stats_calls == ['append']
+    assert measurements(import_db) == list(zip(SNS, values))
+    assert subgroups(import_db) == expected_subgroups(values)
+    ledger = import_db.execute("SELECT file_hash, filename, pn, records FROM import_ledger").fetchall()
+    assert ledger == [(first['hash'], 'first.xlsx', PN, len(SNS))]
+    assert ingest.is_imported(import_db, first['hash'])
+
+    # 内容相同的文件换个名字再导入: 按sha256判重，不解析、不写入，直接移到success
+    second = import_once(import_db, tmp_path, 'again.xlsx', values)
+    assert second['hash'] == first['hash']
+    assert second['duplicate'] is True
+    assert second['records'] == 0
+    assert stats_calls == ['append']
+    assert measurements(import_db) == list(zip(SNS, values))
+    assert subgroups(import_db) == expected_subgroups(values)
+    assert import_db.execute("SELECT COUNT(*) FROM import_ledger").fetchone()[0] == 1
+
+
+def test_process_files_twice_upserts_changed_values(import_db, stats_calls, tmp_path):
+    values = [round(1.0 + 0.1 * i, 2) for i in range(len(SNS))]
+    first = import_once(import_db, tmp_path, 'first.xlsx', values)
+    version = import_db.execute("SELECT MAX(row_version) FROM measurement_data").fetchone()[0]
+
+    # 同一天同样的SN重新测量: 按自然键覆盖旧值，不增加行，该月子组按新值重算
+    changed = [value + 1.0 if i % 4 == 0 else value for i, value in enumerate(values)]
+    second = import_once(import_db, tmp_path, 'retest.xlsx', changed)
+    assert second['hash'] != first['hash']
+    assert second['duplicate'] is False
+    assert second['records'] == len(SNS)
+    assert stats_calls == ['append', 'rebuild']
+    assert measurements(import_db) == list(zip(SNS, changed))
+    assert subgroups(import_db) == expected_subgroups(changed)
+    assert import_db.execute('''
+    SELECT filename, records FROM import_ledger ORDER BY imported_at, filename
+    ''').fetchall() == [('first.xlsx', len(SNS)), ('retest.xlsx', len(SNS))]
+
+    # 只有值变了的行拿到新的行版本号
+    bumped = import_db.execute('''
+    SELECT sn FROM measurement_data WHERE pn = ? AND row_version > ? ORDER BY sn
+    ''', (PN, version)).fetchall()
+    assert [sn for sn, in bumped] == SNS[::4]
@@ -0,0 +1,219 @@
+import numpy as np
+import pytest
+
+import spc_engine
+
+# 期望值取自常用SPC教材的控制图常数表(n=2..25)
+
+
+@pytest.mark.parametrize('n, d2, d3', [(2, 1.128, 0.853), (5, 2.326, 0.864), (10, 3.078, 0.797), (25, 3.931, 0.708)])
+def test_d2_d3_match_table(n, d2, d3):
+    assert spc_engine.d2_constant(n) == pytest.approx(d2)
+    assert spc_engine.D3[n] == pytest.approx(d3)
+
+
+def test_d2_outside_table_is_nan():
+    assert np.isnan(spc_engine.d2_constant([1, 26])).all()
+
+
+@pytest.mark.parametrize('n, c4', [(2, 0.7979), (5, 0.9400), (10, 0.9727), (25, 0.9896)])
+def test_c4_matches_table(n, c4):
+    assert spc_engine.c4(n) == pytest.approx(c4, abs=1e-4)
+
+
+def test_c4_below_two_is_nan():
+    assert np.isnan(spc_engine.c4([0, 1])).all()
+
+
+def test_xbar_r_fixed_n_matches_a2_d3_d4():
+    # n=5: A2=0.577, D3=0, D4=2.114
+    n = np.full(4, 5)
+    r = np.array([1.0, 2.0, 3.0, 2.0])
+    limits = spc_engine.xbar_r(np.array([10.0, 10.2, 9.8, 10.0]), r, n)
+    assert limits['center'] == pytest.approx(10.0)
+    assert limits['ucl'] - limits['center'] == pytest.approx(0.577 * r.mean(), rel=1e-3)
+    assert limits['r_ucl'] == pytest.approx(2.114 * r.mean(), rel=1e-3)
+    assert limits['r_lcl'] == pytest.approx(0.0)
+
+
+def test_xbar_s_fixed_n_matches_a3_b4():
+    # n=5: A3=1.427, B3=0, B4=2.089
+    n = np.full(3, 5)
+    s = np.array([0.5, 1.0, 1.5])
+    limits = spc_engine.xbar_s(np.array([5.0, 5.0, 5.0]), s, n)
+    assert limits['ucl'] - limits['center'] == pytest.approx(1.427 * s.mean(), rel=1e-3)
+    assert limits['s_ucl'] == pytest.approx(2.089 * s.mean(), rel=1e-3)
+    assert limits['s_lcl'] == pytest.approx(0.0)
+
+
+def flagged(x, rule):
+    return np.flatnonzero(spc_engine.nelson_rules(np.asarray(x, dtype=float), 0.0, 1.0)[rule]).tolist()
+
+
+@pytest.mark.parametrize('rule, x, expected', [
+    (1, [0, 0, 3.5, 0, -3.1], [2, 4]),
+    (2, [0.5] * 9, [8]),
+    (2, [-0.5] * 10, [8, 9]),
+    (3, [0, 0.1, 0.2, 0.3, 0.4, 0.5], [5]),
+    (3, [0.5, 0.4, 0.3, 0.2, 0.1, 0.0, 0.1], [5]),
+    (4, [0.1 * (-1) ** i for i in range(14)], [13]),
+    (5, [0, 2.5, 0, 2.5], [3]),
+    (5, [-2.5, 0, -2.5], [2]),
+    (6, [1.5, 1.5, 0, 1.5, 1.5], [4]),
+    (7, [0.5] * 15, [14]),
+    (8, [1.5 * (-1) ** i for i in range(8)], [7]),
+])
+def test_nelson_rule_triggers_on_last_point(rule, x, expected):
+    assert flagged(x, rule) == expected
+
+
+@pytest.mark.parametrize('rule, x', [
+    (2, [0.5] * 8),
+    (3, [0, 0.1, 0.2, 0.3, 0.4]),
+    (4, [0.1 * (-1) ** i for i in range(13)]),
+    (5, [2.5, 0, 0, -2.5]),
+    (7, [0.5] * 14),
+    (8, [1.5] * 4 + [0.5] + [1.5] * 4),
+])
+def test_nelson_rule_does_not_trigger(rule, x):
+    assert flagged(x, rule) == []
+
+
+def reference_rules(z):
+    # 逐点按定义判断，用来核对向量化实现
+    n = len(z)
+    out = {rule: np.zeros(n, dtype=bool) for rule in spc_engine.RULES}
+    for i in range(n):
+        w = lambda k: z[i - k + 1:i + 1] if i >= k - 1 else None
+        out[1][i] = abs(z[i]) > 3
+        if w(9) is not None:
+            out[2][i] = (w(9) > 0).all() or (w(9) < 0).all()
+        if w(6) is not None:
+            d = np.diff(w(6))
+            out[3][i] = (d > 0).all() or (d < 0).all()
+        if w(14) is not None:
+            d = np.sign(np.diff(w(14)))
+            out[4][i] = (d[1:] * d[:-1] < 0).all()
+        if w(3) is not None:
+            out[5][i] = (w(3) > 2).sum() >= 2 or (w(3) < -2).sum() >= 2
+        if w(5) is not None:
+            out[6][i] = (w(5) > 1).sum() >= 4 or (w(5) < -1).sum() >= 4
+        if w(15) is not None:
+            out[7][i] = (np.abs(w(15)) < 1).all()
+        if w(8) is not None:
+            out[8][i] = (np.abs(w(8)) > 1).all()
+    return out
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nelson_rules_match_pointwise_definition(seed):
+    rng = np.random.default_rng(seed)
+    # 混合正常波动、漂移和交替，保证各条规则都有触发
+    z = np.concatenate([rng.normal(0, 1, 200), rng.normal(0, 1, 100).cumsum() * 0.3,
+                        rng.normal(0, 0.3, 50), 1.5 * (-1) ** np.arange(30)])
+    actual = spc_engine.nelson_rules(z, 0.0, 1.0)
+    expected = reference_rules(z)
+    for rule in spc_engine.RULES:
+        assert actual[rule].tolist() == expected[rule].tolist(), rule
+
+
+def test_nelson_rules_zero_sigma_never_flags():
+    violations = spc_engine.nelson_rules(np.full(20, 5.0), 5.0, 0.0)
+    assert not spc_engine.any_violation(violations).any()
+
+
+def test_violation_labels():
+    violations = {1: np.array([True, False, True]), 5: np.array([True, False, False])}
+    assert spc_engine.violation_labels(violations) == ['1,5', '', '1']
+
+
+def reference_ewma(x, lam, start):
+    z, out = start, []
+    for value in x:
+        z = lam * value + (1 - lam) * z
+        out.append(z)
+    return np.array(out)
+
+
+def first_order_lfilter(b, a, x, zi):
+    # 与scipy.signal.lfilter语义相同的一阶滤波(转置直接II型)，没有scipy时代替它核对ewma()传入的系数和初值
+    assert len(b) == 1 and len(a) == 2 and a[0] == 1.0
+    state, out = zi[0], []
+    for value in x:
+        y = b[0] * value + state
+        state = -a[1] * y
+        out.append(y)
+    return np.array(out), np.array([state])
+
+
+@pytest.fixture(params=['lfilter', 'numpy'])
+def ewma_branch(request, monkeypatch):
+    # 分别走lfilter分支和NumPy分段累加分支；没有安装scipy时lfilter分支用上面的一阶实现模拟
+    if request.param == 'lfilter':
+        if spc_engine.lfilter is None:
+            monkeypatch.setattr(spc_engine, 'lfilter', first_order_lfilter)
+    else:
+        monkeypatch.setattr(spc_engine, 'lfilter', None)
+    return request.param
+
+
+def test_ewma_textbook_values(ewma_branch):
+    # λ=0.2, L=3, μ0=10, σ=1: z1 = 0.2*x1 + 0.8*10，第1点限宽 = Lσλ，限宽收敛到 Lσ·sqrt(λ/(2-λ)) = 1
+    x = [10.5, 11.0, 9.0, 12.0]
+    result = spc_engine.ewma(x, 0.2, 3.0, 10.0, 1.0)
+    assert result['z'] == pytest.approx([10.1, 10.28, 10.024, 10.4192])
+    assert result['ucl'][0] - 10.0 == pytest.approx(0.6)
+    assert result['lcl'][0] == pytest.approx(9.4)
+    far = spc_engine.ewma(np.full(500, 10.0), 0.2, 3.0, 10.0, 1.0)
+    assert far['ucl'][-1] == pytest.approx(11.0)
+    assert not far['signal'].any()
+
+
+@pytest.mark.parametrize('lam', [0.05, 0.2, 0.9, 0.999])
+def test_ewma_matches_recursion(ewma_branch, lam):
+    # 长序列和λ接近1时NumPy分支要分段，结果仍与逐点递推一致
+    x = np.random.default_rng(1).normal(50, 2, 3000)
+    result = spc_engine.ewma(x, lam, 3.0, 50.0, 2.0)
+    np.testing.assert_allclose(result['z'], reference_ewma(x, lam, 50.0), rtol=1e-9)
+
+
+def test_ewma_lambda_one_is_the_data(ewma_branch):
+    x = np.array([1.0, 3.0, 2.0])
+    np.testing.assert_allclose(spc_engine.ewma(x, 1.0, 3.0, 0.0, 1.0)['z'], x)
+
+
+def test_ewma_signals_sustained_shift(ewma_branch):
+    x = np.concatenate([np.full(10, 10.0), np.full(10, 12.0)])
+    signal = spc_engine.ewma(x, 0.2, 3.0, 10.0, 1.0)['signal']
+    assert not signal[:10].any()
+    assert signal[-1]
+
+
+def test_cusum_textbook_values():
+    # μ=10, σ=1, k=0.5: C+ = max(0, C+ + x - 10.5)，C- = max(0, C- + 9.5 - x)
+    result = spc_engine.cusum([10, 11, 12, 9, 13, 8], 0.5, 5.0, 10.0, 1.0)
+    assert result['upper'].tolist() == pytest.approx([0.0, 0.5, 2.0, 0.5, 3.0, 0.5])
+    assert result['lower'].tolist() == pytest.approx([0.0, 0.0, 0.0, 0.5, 0.0, 1.5])
+    assert result['h'] == pytest.approx(5.0)
+    assert not result['signal'].any()
+
+
+def test_cusum_signals_first_point_beyond_h():
+    # 均值偏移+2σ，每点C+增加1.5，第4点6 > h=5
+    result = spc_engine.cusum(np.full(6, 12.0), 0.5, 5.0, 10.0, 1.0)
+    assert result['upper'].tolist() == pytest.approx([1.5, 3.0, 4.5, 6.0, 7.5, 9.0])
+    assert np.flatnonzero(result['signal']).tolist() == [3, 4, 5]
+
+
+def test_cusum_matches_recursion():
+    x = np.random.default_rng(2).normal(0, 1, 1000) + np.repeat([0.0, 0.8, -0.8, 0.0], 250)
+    result = spc_engine.cusum(x, 0.5, 4.0, 0.0, 1.0)
+    upper, lower = [], []
+    cu = cl = 0.0
+    for value in x:
+        cu = max(0.0, cu + value - 0.5)
+        cl = max(0.0, cl - 0.5 - value)
+        upper.append(cu)
+        lower.append(cl)
+    np.testing.assert_allclose(result['upper'], upper, atol=1e-9)
+    np.testing.assert_allclose(result['lower'], lower, atol=1e-9)
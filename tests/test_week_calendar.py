@@ -0,0 +1,105 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import week_calendar
+
+
+@pytest.mark.parametrize('code, key', [
+    # %W周一开始、1月第一个周一之前为第00周；ISO周包含1月4日。2020-01-01是周三:
+    # 第00周(1/1~1/5)属于ISO第1周，%W第01周(1/6起)已是ISO第2周，两者差1
+    ('2000', 202001),
+    ('2001', 202002),
+    ('0900', 200901),
+    ('0901', 200902),
+    # 2018-01-01是周一，%W和ISO周号相同
+    ('1801', 201801),
+    ('1830', 201830),
+    # 有W53的年份: 2020-12-28所在周是ISO 2020-W53，%W为第52周
+    ('2052', 202053),
+    ('1552', 201553),
+    # 2021-01-01~03是%W第00周，仍属于ISO 2020-W53
+    ('2100', 202053),
+    ('2101', 202101),
+    # 2024-12-30(周一)是%W第53周，但已是ISO 2025年第1周
+    ('2452', 202452),
+    ('2453', 202501),
+])
+def test_yyww_maps_to_iso_week(code, key):
+    assert week_calendar.week_key(code) == key
+
+
+@pytest.mark.parametrize('code', ['2053', '2454', '1653', '2099'])
+def test_yyww_past_end_of_year_is_rejected(code):
+    # 周一已经落到下一年的%W周号不存在
+    assert week_calendar.week_key(code) is None
+
+
+def test_yyww_from_strftime_matches_iso_week_of_the_day():
+    # 页面默认值是strftime('%y%W')；%W周和ISO周都是周一到周日，所以任意一天的编码都应换算到它自己的ISO周
+    day = date(2000, 1, 1)
+    while day < date(2031, 1, 1):
+        assert week_calendar.week_key(day.strftime('%y%W')) == week_calendar.of_date(day), day
+        day += timedelta(days=1)
+
+
+@pytest.mark.parametrize('code, key', [
+    ('2504W14', 202514),
+    ('2504w14', 202514),
+    ('25W14', 202514),
+    ('2001W1', 202001),
+    # ISO周号原样使用: 2020年有53周，2025-W01从2024-12-30开始
+    ('2012W53', 202053),
+    ('2501W01', 202501),
+    (' 1512W53 ', 201553),
+])
+def test_iso_code_maps_to_week_key(code, key):
+    assert week_calendar.week_key(code) == key
+
+
+@pytest.mark.parametrize('code', ['2112W53', '2512W53', '2501W00', '2501W54', '', None, 'abc', '25-14', '202514'])
+def test_invalid_codes_are_rejected(code):
+    assert week_calendar.week_key(code) is None
+
+
+def test_label():
+    assert week_calendar.label(202053) == '2020-W53'
+    assert week_calendar.label(202501) == '2025-W01'
+
+
+@pytest.fixture
+def calendar():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+    CREATE TABLE week_calendar (
+        week_key INTEGER PRIMARY KEY, iso_year INTEGER, iso_week INTEGER, label TEXT,
+        week_start TEXT, week_end TEXT, month TEXT, quarter TEXT
+    )''')
+    week_calendar.fill(conn)
+    yield conn
+    conn.close()
+
+
+def week(conn, key):
+    return conn.execute('''
+    SELECT label, week_start, week_end, month, quarter FROM week_calendar WHERE week_key = ?
+    ''', (key,)).fetchone()
+
+
+def test_calendar_year_boundary_weeks(calendar):
+    # 跨年的周按周四所在的月份/季度归属
+    assert week(calendar, 202053) == ('2020-W53', '2020-12-28', '2021-01-03', '2020-12', '2020-Q4')
+    assert week(calendar, 202101) == ('2021-W01', '2021-01-04', '2021-01-10', '2021-01', '2021-Q1')
+    assert week(calendar, 202501) == ('2025-W01', '2024-12-30', '2025-01-05', '2025-01', '2025-Q1')
+    assert week(calendar, 202153) is None
+
+
+def test_calendar_weeks_are_contiguous(calendar):
+    rows = calendar.execute("SELECT week_key, week_start FROM week_calendar ORDER BY week_key").fetchall()
+    years = range(week_calendar.FIRST_YEAR, week_calendar.LAST_YEAR + 1)
+    assert len(rows) == sum(date(year, 12, 28).isocalendar()[1] for year in years)
+    # 按整数week_key排序后每周相隔7天: 大小顺序就是时间顺序，跨年范围查询可以直接比较
+    starts = [date.fromisoformat(start) for _, start in rows]
+    assert all(b - a == timedelta(days=7) for a, b in zip(starts, starts[1:]))
+    assert all(week_calendar.of_date(start) == key for (key, _), start in zip(rows, starts))
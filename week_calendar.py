@@ -0,0 +1,75 @@
+import re
+from datetime import date, timedelta
+
+# 周日历维度表: 每个ISO周一行，week_key = ISO年*100+ISO周(如202514)
+# YieldData.date_code是手工录入的文本，写入时换算成整数week_key存到YieldData.week_key，
+# 按周范围查询走(week_key, pn)索引，跨年也能按整数大小正确比较
+# date_code支持两种写法:
+#   YYWW    - 页面默认值strftime('%y%W')，周一开始，1月第一个周一之前为第00周
+#   YYMMWww - 如2504W14，W后面是ISO周号，MM月份只作参考
+
+FIRST_YEAR, LAST_YEAR = 2000, 2099
+
+_YYWW = re.compile(r'^(\d{2})(\d{2})$')
+_ISO = re.compile(r'^(\d{2})(\d{2})?W(\d{1,2})$', re.IGNORECASE)
+
+
+def fill(conn):
+    # 填充FIRST_YEAR~LAST_YEAR的全部ISO周，已有的周保留不动
+    # month/quarter按该周周四所在的月份归属(ISO周的年份也是这样确定的)，周/月/季汇总共用
+    rows = []
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        weeks = date(year, 12, 28).isocalendar()[1]  # 12月28日所在的周一定是该年最后一周
+        for week in range(1, weeks + 1):
+            monday = date.fromisocalendar(year, week, 1)
+            thursday = monday + timedelta(days=3)
+            rows.append((year * 100 + week, year, week, f"{year}-W{week:02d}",
+                         monday.isoformat(), (monday + timedelta(days=6)).isoformat(),
+                         thursday.strftime('%Y-%m'), f"{thursday.year}-Q{(thursday.month - 1) // 3 + 1}"))
+    conn.executemany("INSERT OR IGNORE INTO week_calendar VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def of_date(day):
+    # 某个日期所在ISO周的week_key
+    year, week, _ = day.isocalendar()
+    return year * 100 + week
+
+
+def week_key(date_code):
+    # 把date_code换算成week_key，格式无法识别时返回None
+    code = str(date_code or '').strip()
+    match = _YYWW.match(code)
+    if match:
+        year, week = 2000 + int(match.group(1)), int(match.group(2))
+        jan1 = date(year, 1, 1)
+        first_monday = jan1 + timedelta(days=(7 - jan1.weekday()) % 7)
+        if week == 0:
+            return of_date(jan1)
+        day = first_monday + timedelta(weeks=week - 1)
+        return of_date(day) if day.year == year else None
+    match = _ISO.match(code)
+    if match:
+        year, week = 2000 + int(match.group(1)), int(match.group(3))
+        try:
+            date.fromisocalendar(year, week, 1)
+        except ValueError:
+            return None
+        return year * 100 + week
+    return None
+
+
+def label(key):
+    return f"{key // 100}-W{key % 100:02d}"
+
+
+def normalize(conn, ids=None):
+    # 重新计算YieldData.week_key；ids为空时处理全部记录(迁移回填用)
+    if ids is None:
+        rows = conn.execute("SELECT id, date_code FROM YieldData").fetchall()
+    else:
+        ids = list(ids)
+        marks = ','.join('?' * len(ids))
+        rows = conn.execute(f"SELECT id, date_code FROM YieldData WHERE id IN ({marks})", ids).fetchall()
+    conn.executemany("UPDATE YieldData SET week_key = ? WHERE id = ?",
+                     [(week_key(date_code), record_id) for record_id, date_code in rows])
+    return len(rows)
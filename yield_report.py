@@ -0,0 +1,83 @@
+import streamlit as st
+from config import PN_TO_MODULE
+import yield_rollup
+
+if 'username' not in st.session_state or not st.session_state.username:
+    st.warning("请先登录系统")
+    st.stop()  # 停止执行后续代码
+
+st.header("良率汇总")
+
+# 数据全部来自汇总表(录入良率时增量刷新)，不扫描YieldData
+GRAIN_NAMES = {'week': '周', 'month': '月', 'quarter': '季度'}
+
+col1, col2, col3 = st.columns([1, 1, 3])
+with col1:
+    grain = st.radio("汇总粒度", yield_rollup.GRAINS, format_func=GRAIN_NAMES.get, horizontal=True)
+available = yield_rollup.available_periods(grain)
+if not available:
+    st.warning("还没有良率数据")
+    st.stop()
+with col2:
+    count = st.number_input(f"最近{GRAIN_NAMES[grain]}数", min_value=1, max_value=len(available),
+                            value=min(8, len(available)))
+
+periods = sorted(available[:int(count)])
+fpy, rty, defects = yield_rollup.load(grain, periods)
+with col3:
+    selected_pns = st.multiselect("PN(留空为全部)", sorted(fpy['pn'].unique()),
+                                  format_func=lambda pn: f"{pn or '(未指定)'} ({PN_TO_MODULE.get(pn, 'Unknown')})")
+if selected_pns:
+    fpy, rty, defects = (df[df['pn'].isin(selected_pns)] for df in (fpy, rty, defects))
+if fpy.empty:
+    st.warning("所选范围内没有良率数据")
+    st.stop()
+
+import plotly.express as px
+
+# RTY趋势: 每个PN一条线
+st.subheader("滚动直通率 RTY")
+rty_fig = px.line(rty, x='period', y='rty', color='pn', markers=True,
+                  labels={'period': GRAIN_NAMES[grain], 'rty': 'RTY', 'pn': 'PN'})
+rty_fig.update_yaxes(tickformat='.1%')
+st.plotly_chart(rty_fig, use_container_width=True)
+
+# FPY: 行=PN/工站，列=周期
+st.subheader("各工站直通率 FPY")
+grid = (fpy.assign(label=fpy['pn'] + ' | ' + fpy['station'])
+        .pivot(index='label', columns='period', values='fpy'))
+import plotly.graph_objects as go
+
+fpy_fig = go.Figure(go.Heatmap(
+    z=grid.to_numpy(),
+    x=grid.columns.tolist(),
+    y=grid.index.tolist(),
+    zmin=0.9, zmax=1.0,
+    colorscale='RdYlGn',
+    text=(grid * 100).round(2).astype(str).replace('nan', '').to_numpy(),
+    texttemplate='%{text}',
+    hovertemplate='%{y}<br>%{x}: %{z:.2%}<extra></extra>',
+    colorbar=dict(title='FPY', tickformat='.0%'),
+))
+fpy_fig.update_layout(height=max(300, 40 * len(grid) + 120), yaxis=dict(autorange='reversed'))
+st.plotly_chart(fpy_fig, use_container_width=True)
+
+# 不良Pareto: 所选范围内按不良描述合计，折线为累计占比
+st.subheader("不良原因 Pareto")
+if defects.empty:
+    st.success("所选范围内没有不良记录")
+else:
+    pareto = (defects.assign(defect=defects['defect'].replace('', '(未填写)'))
+              .groupby('defect')['defects'].sum().sort_values(ascending=False).reset_index())
+    pareto['cumulative'] = pareto['defects'].cumsum() / pareto['defects'].sum()
+    pareto_fig = go.Figure()
+    pareto_fig.add_trace(go.Bar(x=pareto['defect'], y=pareto['defects'], name='不良数'))
+    pareto_fig.add_trace(go.Scatter(x=pareto['defect'], y=pareto['cumulative'], name='累计占比',
+                                    yaxis='y2', mode='lines+markers', line=dict(color='red')))
+    pareto_fig.update_layout(yaxis2=dict(overlaying='y', side='right', tickformat='.0%', range=[0, 1.05]),
+                             hovermode='x unified')
+    st.plotly_chart(pareto_fig, use_container_width=True)
+
+with st.expander("汇总明细"):
+    st.dataframe(fpy, hide_index=True, use_container_width=True,
+                 column_config={'fpy': st.column_config.NumberColumn('FPY', format='percent')})
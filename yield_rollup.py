@@ -0,0 +1,162 @@
+import numpy as np
+
+import db
+
+# 良率汇总表: PN × 工站 × 周/月/季的投入数、不良数和直通率(FPY)，各PN的滚动直通率(RTY)，以及不良原因Pareto
+# YieldData、Products、Stations上的触发器把受影响的week_key记到yield_rollup_dirty，写入方在同一事务里调用refresh()，
+# 只重算这些周，再由周汇总合成所在的月和季(ISO周按周四归属月份，周可以完整地加到月和季)
+# good_count是页面上的"生产数量"(投入数)，FPY = 1 - 不良数/投入数
+# 看板只查这几张表，不再扫描YieldData
+
+GRAINS = ('week', 'month', 'quarter')
+TABLES = ('yield_rollup', 'yield_rollup_rty', 'yield_rollup_defects')
+
+# 当前有效的PN和工站名: 优先取关联表，兼容只有文本列的旧记录
+# 没有PN/工站/不良描述的记录归到空字符串下，避免主键里出现NULL
+_SOURCE = '''
+SELECT COALESCE(p.pn, y.pn, '') AS pn, COALESCE(s.name, y.station, '') AS station,
+       y.good_count, y.bad_count, COALESCE(NULLIF(TRIM(y.defect_description), ''), '') AS defect
+FROM YieldData y
+LEFT JOIN Products p ON p.id = y.product_id
+LEFT JOIN Stations s ON s.id = y.station_id
+WHERE y.week_key = ?
+'''
+
+
+def _refresh_week(conn, week_key, label):
+    # 从原始记录重算一周的汇总行
+    conn.execute("DELETE FROM yield_rollup WHERE grain = 'week' AND period = ?", (label,))
+    conn.execute("DELETE FROM yield_rollup_defects WHERE grain = 'week' AND period = ?", (label,))
+    conn.execute(f'''
+    INSERT INTO yield_rollup (grain, period, pn, station, input, defects, records)
+    SELECT 'week', ?, pn, station, SUM(good_count), SUM(bad_count), COUNT(*)
+    FROM ({_SOURCE}) GROUP BY pn, station''', (label, week_key))
+    conn.execute(f'''
+    INSERT INTO yield_rollup_defects (grain, period, pn, station, defect, defects, records)
+    SELECT 'week', ?, pn, station, defect, SUM(bad_count), COUNT(*)
+    FROM ({_SOURCE}) WHERE bad_count > 0 GROUP BY pn, station, defect''', (label, week_key))
+
+
+def _refresh_period(conn, grain, period):
+    # 月/季汇总由所含各周的周汇总相加得到
+    conn.execute("DELETE FROM yield_rollup WHERE grain = ? AND period = ?", (grain, period))
+    conn.execute("DELETE FROM yield_rollup_defects WHERE grain = ? AND period = ?", (grain, period))
+    weeks = f"SELECT label FROM week_calendar WHERE {grain} = ?"
+    conn.execute(f'''
+    INSERT INTO yield_rollup (grain, period, pn, station, input, defects, records)
+    SELECT ?, ?, pn, station, SUM(input), SUM(defects), SUM(records)
+    FROM yield_rollup WHERE grain = 'week' AND period IN ({weeks})
+    GROUP BY pn, station''', (grain, period, period))
+    conn.execute(f'''
+    INSERT INTO yield_rollup_defects (grain, period, pn, station, defect, defects, records)
+    SELECT ?, ?, pn, station, defect, SUM(defects), SUM(records)
+    FROM yield_rollup_defects WHERE grain = 'week' AND period IN ({weeks})
+    GROUP BY pn, station, defect''', (grain, period, period))
+
+
+def _refresh_rty(conn, grain, period):
+    # RTY = 该PN各工站FPY的乘积，没有投入数的工站不参与
+    conn.execute("DELETE FROM yield_rollup_rty WHERE grain = ? AND period = ?", (grain, period))
+    rty = {}
+    for pn, fpy in conn.execute('''
+    SELECT pn, fpy FROM yield_rollup WHERE grain = ? AND period = ? AND fpy IS NOT NULL''', (grain, period)):
+        stations, product = rty.get(pn, (0, 1.0))
+        rty[pn] = (stations + 1, product * fpy)
+    conn.executemany("INSERT INTO yield_rollup_rty VALUES (?, ?, ?, ?, ?)",
+                     [(grain, period, pn, stations, product) for pn, (stations, product) in rty.items()])
+
+
+def refresh(conn):
+    # 重算yield_rollup_dirty里记录的周及其所在的月、季，返回刷新的周数
+    # 调用方负责提交事务，提交后用db.invalidate(*TABLES)清除查询缓存
+    weeks = conn.execute('''
+    SELECT d.week_key, c.label, c.month, c.quarter
+    FROM yield_rollup_dirty d JOIN week_calendar c ON c.week_key = d.week_key''').fetchall()
+    conn.execute("DELETE FROM yield_rollup_dirty")
+    if not weeks:
+        return 0
+    for week_key, label, _, _ in weeks:
+        _refresh_week(conn, week_key, label)
+    periods = {('week', label) for _, label, _, _ in weeks}
+    for _, _, month, quarter in weeks:
+        periods.add(('month', month))
+        periods.add(('quarter', quarter))
+    for grain, period in sorted(periods, key=lambda item: GRAINS.index(item[0])):
+        if grain != 'week':
+            _refresh_period(conn, grain, period)
+        _refresh_rty(conn, grain, period)
+    return len(weeks)
+
+
+def rebuild(conn):
+    # 全部重算(迁移和数据修复用)
+    for table in TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute('''
+    INSERT OR IGNORE INTO yield_rollup_dirty
+    SELECT DISTINCT week_key FROM YieldData WHERE week_key IS NOT NULL''')
+    return refresh(conn)
+
+
+def load(grain, periods=None, pns=None):
+    # 读取某个粒度的汇总，periods/pns为空时不筛选；返回(FPY明细, RTY, 不良Pareto)三张表
+    where, params = "grain = ?", [grain]
+    if periods:
+        where += f" AND period IN ({','.join('?' * len(periods))})"
+        params += list(periods)
+    if pns:
+        where += f" AND pn IN ({','.join('?' * len(pns))})"
+        params += list(pns)
+    fpy = db.cached_read_sql(f'''
+    SELECT period, pn, station, input, defects, records, fpy FROM yield_rollup
+    WHERE {where} ORDER BY period, pn, station''', params=params)
+    rty = db.cached_read_sql(f'''
+    SELECT period, pn, stations, rty FROM yield_rollup_rty
+    WHERE {where} ORDER BY period, pn''', params=params)
+    defects = db.cached_read_sql(f'''
+    SELECT period, pn, station, defect, defects, records FROM yield_rollup_defects
+    WHERE {where} ORDER BY defects DESC''', params=params)
+    return fpy, rty, defects
+
+
+def available_periods(grain):
+    return db.cached_read_sql('''
+    SELECT DISTINCT period FROM yield_rollup WHERE grain = ? ORDER BY period DESC''', params=(grain,))['period'].tolist()
+
+
+def station_yield(grain, start, end, pns=None):
+    # 周期范围[start, end]内各PN各工站的合计投入、不良和FPY；查询结果按(粒度, 范围, PN)缓存，刷新汇总时失效
+    sql = '''
+    SELECT pn, station, SUM(input) AS input, SUM(defects) AS defects, COUNT(*) AS periods
+    FROM yield_rollup
+    WHERE grain = ? AND period BETWEEN ? AND ?'''
+    params = [grain, start, end]
+    if pns:
+        sql += f" AND pn IN ({','.join('?' * len(pns))})"
+        params += list(pns)
+    stations = db.cached_read_sql(sql + " GROUP BY pn, station", params=params)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stations['fpy'] = np.where(stations['input'] > 0,
+                                   np.clip(1 - stations['defects'] / stations['input'], 0, 1), np.nan)
+    return stations
+
+
+def rolled_yield(stations, keys=('pn',)):
+    # RTY = 各工站FPY之积，按keys分组整体相乘；同时给出简单合计良率(1-总不良/总投入)对比
+    usable = stations[stations['fpy'].notna()]
+    grouped = usable.groupby(list(keys), sort=True)
+    result = grouped.agg(stations=('station', 'size'), input=('input', 'sum'), defects=('defects', 'sum'))
+    result['rty'] = grouped['fpy'].prod()
+    result['naive_yield'] = 1 - result['defects'] / result['input']
+    return result.reset_index()
+
+
+def worst_stations(stations, top=10):
+    # 按对RTY损失的贡献排序: 工站FPY的对数占所在PN的RTY对数的比例，FPY相同时投入大的排前面
+    ranked = stations[stations['fpy'].notna()].copy()
+    log_fpy = np.log(ranked['fpy'].clip(lower=1e-9))
+    ranked['rty_loss_share'] = log_fpy / log_fpy.groupby(ranked['pn']).transform('sum')
+    ranked['rty_loss_share'] = ranked['rty_loss_share'].fillna(0.0)
+    ranked['loss'] = 1 - ranked['fpy']
+    ranked = ranked.sort_values(['loss', 'input'], ascending=[False, False])
+    return ranked.head(top).reset_index(drop=True)